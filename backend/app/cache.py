@@ -0,0 +1,242 @@
+# cache.py - Content-addressed verdict cache for repeated prompts
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import typing as t
+from collections import OrderedDict
+
+from .utils import get_env
+
+CACHE_BACKEND = get_env("CACHE_BACKEND", "memory")  # memory | sqlite | off
+CACHE_TTL_SECONDS = float(get_env("CACHE_TTL_SECONDS", "3600"))
+CACHE_MAX_ENTRIES = int(get_env("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(get_env("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_SQLITE_PATH = get_env("CACHE_SQLITE_PATH", "verdict_cache.sqlite3")
+
+
+def cache_key(prompt: str, persona: str, ruleset_version: str, options: t.Optional[dict] = None) -> str:
+    # The exact text: whitespace and unicode forms change what the detectors match
+    parts = [prompt, persona or "", ruleset_version, json.dumps(options or {}, sort_keys=True)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class CacheBackend:
+    """Storage for serialized responses. Subclasses handle LRU, TTL and size caps."""
+
+    name = "base"
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> int:
+        """Store a value and return how many entries were evicted to fit it."""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def info(self) -> dict:
+        raise NotImplementedError
+
+    def after_fork(self) -> None:
+        """Called in a forked worker before it serves requests."""
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU dict with per-entry expiry and a byte budget."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, clock: t.Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._data: "OrderedDict[str, t.Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                self._bytes -= len(value)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> int:
+        if len(value) > self.max_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._data[key] = (self.clock() + ttl, value)
+            self._bytes += len(value)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, dropped) = self._data.popitem(last=False)
+                self._bytes -= len(dropped)
+                evicted += 1
+        return evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def info(self) -> dict:
+        return {"entries": len(self._data), "bytes": self._bytes}
+
+
+class SQLiteBackend(CacheBackend):
+    """On-disk store so cached verdicts survive restarts; LRU by last access time."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, clock: t.Callable[[], float] = time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdict_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdict_cache_accessed ON verdict_cache(accessed_at)")
+        self._entries, self._bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM verdict_cache").fetchone()
+
+    def _delete(self, key: str, size: int) -> None:
+        self._conn.execute("DELETE FROM verdict_cache WHERE key = ?", (key,))
+        self._entries -= 1
+        self._bytes -= size
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, size, expires_at FROM verdict_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, size, expires_at = row
+            if expires_at <= now:
+                self._delete(key, size)
+                return None
+            self._conn.execute("UPDATE verdict_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: float) -> int:
+        if len(value) > self.max_bytes:
+            return 0
+        now = self.clock()
+        evicted = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                row = self._conn.execute("SELECT size FROM verdict_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._delete(key, row[0])
+                self._conn.execute(
+                    "INSERT INTO verdict_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now + ttl, now),
+                )
+                self._entries += 1
+                self._bytes += len(value)
+                while self._entries > self.max_entries or self._bytes > self.max_bytes:
+                    oldest = self._conn.execute("SELECT key, size FROM verdict_cache ORDER BY accessed_at LIMIT 1").fetchone()
+                    if oldest is None:
+                        break
+                    self._delete(*oldest)
+                    evicted += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._entries, self._bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM verdict_cache").fetchone()
+                raise
+        return evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM verdict_cache")
+            self._entries, self._bytes = 0, 0
+
+    def info(self) -> dict:
+        return {"entries": self._entries, "bytes": self._bytes, "path": self.path}
+
+    def after_fork(self) -> None:
+        # SQLite connections must never cross a fork; each worker opens its own
+        self._lock = threading.Lock()
+        self._connect()
+
+
+class VerdictCache:
+    """Front for a CacheBackend that keeps hit/miss/eviction counters."""
+
+    def __init__(self, backend: t.Optional[CacheBackend], ttl: float = CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str) -> t.Optional[str]:
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode("utf-8")
+
+    def set(self, key: str, value: str) -> None:
+        if self.backend is None:
+            return
+        self.evictions += self.backend.set(key, value.encode("utf-8"), self.ttl)
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear()
+
+    def after_fork(self) -> None:
+        if self.backend is not None:
+            self.backend.after_fork()
+
+    def stats(self) -> dict:
+        if self.backend is None:
+            return {"backend": "off"}
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            **self.backend.info(),
+        }
+
+
+def build_cache(kind: str = CACHE_BACKEND) -> VerdictCache:
+    kind = (kind or "off").lower()
+    if kind == "memory":
+        return VerdictCache(MemoryBackend())
+    if kind == "sqlite":
+        return VerdictCache(SQLiteBackend())
+    return VerdictCache(None)
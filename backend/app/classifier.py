@@ -0,0 +1,102 @@
+# classifier.py - Tiered verdicts: local detectors first, the LLM rule check only when they are unsure
+import threading
+import typing as t
+
+from .utils import get_env
+from .detectors import ScanResult
+from . import providers
+
+# local: detectors only | hybrid: escalate uncertain verdicts to the LLM rule check
+CLASSIFIER_MODE = get_env("CLASSIFIER_MODE", "local")
+# An ALLOW at or above this score is final
+HYBRID_ALLOW_MIN_SCORE = int(get_env("HYBRID_ALLOW_MIN_SCORE", "90"))
+# A BLOCK backed by a match in one of these categories is final
+HYBRID_BLOCK_CATEGORIES = tuple(c.strip() for c in get_env("HYBRID_BLOCK_CATEGORIES", "explicit,harmful,profanity,injection,system_token").split(",") if c.strip())
+
+VERDICTS = ("ALLOW", "NEEDS_FIX", "BLOCK")
+LOCAL, LLM = "local", "llm"
+
+
+class Review(t.NamedTuple):
+    """The LLM rule check's answer for an escalated prompt."""
+    verdict: str
+    reasons: t.List[str]
+    costar: dict
+
+
+class TieredClassifier:
+    """
+    Decides whether the local verdict stands. Confident local verdicts (a
+    clean ALLOW with a high score, a BLOCK backed by a hard category) return
+    at detector latency; the rest (NEEDS_FIX, low-score ALLOW, BLOCKs that
+    only come from counting issues, truncated scans without a hard hit) go
+    to the LLM rule check. If the check fails, or only the stub provider is configured, the
+    local verdict stands.
+    """
+
+    def __init__(self, mode: str = CLASSIFIER_MODE, allow_min_score: int = HYBRID_ALLOW_MIN_SCORE, block_categories: t.Sequence[str] = HYBRID_BLOCK_CATEGORIES, provider: t.Optional["providers.LLMProvider"] = None):
+        if mode not in (LOCAL, "hybrid"):
+            raise ValueError(f"Unknown CLASSIFIER_MODE {mode!r} (expected local or hybrid)")
+        self.mode = mode
+        self.allow_min_score = allow_min_score
+        self.block_categories = tuple(block_categories)
+        self.provider = provider
+        self._counts = {"decisions": 0, "escalated": 0, "overridden": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "hybrid"
+
+    def confident(self, verdict: str, score: int, scan: ScanResult) -> bool:
+        if verdict == "BLOCK" and scan.has(*self.block_categories):
+            # A hard hit is final even if the budget cut the scan short
+            return True
+        if scan.truncated:
+            return False
+        return verdict == "ALLOW" and score >= self.allow_min_score
+
+    def should_escalate(self, verdict: str, score: int, scan: ScanResult) -> bool:
+        """Counts the decision; True when the LLM should judge this prompt."""
+        escalate = self.enabled and not self.confident(verdict, score, scan)
+        if escalate and isinstance(self.provider or providers.PROVIDER, providers.StubProvider):
+            # The stub's canned ALLOW is not a judgement
+            escalate = False
+        self._count("decisions")
+        if escalate:
+            self._count("escalated")
+        return escalate
+
+    async def review(self, prompt: str, local_verdict: str) -> t.Optional[Review]:
+        try:
+            result = await providers.run_rule_check(prompt, self.provider, fail_closed=False)
+        except Exception:
+            self._count("failed")
+            return None
+        verdict = result.get("verdict")
+        if verdict not in VERDICTS:
+            self._count("failed")
+            return None
+        if verdict != local_verdict:
+            self._count("overridden")
+        reasons = [f"LLM review: {r}" for r in result.get("reasons") or [] if isinstance(r, str)]
+        costar = result.get("costar") if isinstance(result.get("costar"), dict) else {}
+        return Review(verdict, reasons, costar)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "mode": self.mode,
+            "allow_min_score": self.allow_min_score,
+            "block_categories": list(self.block_categories),
+            **counts,
+            "escalation_rate": round(counts["escalated"] / counts["decisions"], 4) if counts["decisions"] else 0.0,
+        }
+
+
+CLASSIFIER = TieredClassifier()
@@ -0,0 +1,210 @@
+# detect_pool.py - Run detection for long prompts in worker processes under a time budget
+import os
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+import typing as t
+
+from .utils import get_env
+from .detectors import RULESET_PATH, DetectorEngine, ScanResult, active_engine, build_engine_from_file
+from .metrics import REGISTRY, Counter
+
+DETECT_POOL_WORKERS = int(get_env("DETECT_POOL_WORKERS", "2"))  # 0 = always detect in-process
+DETECT_POOL_MIN_CHARS = int(get_env("DETECT_POOL_MIN_CHARS", "4000"))
+DETECT_BUDGET_MS = float(get_env("DETECT_BUDGET_MS", "1000"))
+
+DETECT_TRUNCATED_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_detect_truncated_total", "Prompts whose regex detection hit the time budget", ("reason",),
+))
+
+
+def _worker_main(conn, ruleset_path: str) -> None:
+    """
+    Worker loop: receive (ruleset digest, text), reply with the keyword
+    pass, then one message per regex rule so the parent keeps every result
+    that finished before the budget ran out.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = active_engine()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        digest, text = msg
+        if engine.digest != digest:
+            try:
+                engine = build_engine_from_file(ruleset_path)
+            except Exception:
+                pass
+            if engine.digest != digest:
+                conn.send(("stale", engine.digest))
+                continue
+        conn.send(("keywords", engine.scan_keywords(text)))
+        for i, rule in enumerate(engine.rules):
+            conn.send(("rule", i, engine.match_rule(rule, text)))
+        conn.send(("done",))
+
+
+class _Worker:
+    def __init__(self, ctx, ruleset_path: str):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, ruleset_path), name="detect-worker", daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=1)
+        finally:
+            self.conn.close()
+
+
+class DetectionPool:
+    """
+    Fixed set of detection processes. Prompts shorter than `min_chars` are
+    scanned in-process (IPC would cost more than the scan). Longer ones go
+    to an idle worker; if it has not finished within `budget_ms` of wall
+    time (the worker is single-threaded, so this tracks its CPU time) the
+    worker is killed and replaced, and the caller gets the matches found so
+    far with the remaining rules listed in ScanResult.skipped_rules. The
+    budget starts before waiting for an idle worker. If none frees up in
+    time, or the worker cannot load the caller's ruleset, the caller gets
+    the keyword pass only with every regex rule skipped: running the rules
+    in-process would hold the GIL for the whole server under overload.
+
+    scan() blocks while waiting; call it from a thread, not the event loop.
+    """
+
+    def __init__(self, workers: int = DETECT_POOL_WORKERS, budget_ms: float = DETECT_BUDGET_MS, min_chars: int = DETECT_POOL_MIN_CHARS, ruleset_path: str = RULESET_PATH):
+        self.workers = workers
+        self.budget = budget_ms / 1000.0
+        self.min_chars = min_chars
+        self.ruleset_path = ruleset_path
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._all: t.List[_Worker] = []
+        self._lock = threading.Lock()
+        self._pid: t.Optional[int] = None
+
+    def offloads(self, text: str) -> bool:
+        return self.workers > 0 and len(text) >= self.min_chars
+
+    def _ensure_started(self) -> None:
+        # Started lazily, and again after a fork, so each serving process owns its pool
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+            self._ctx = ctx
+            self._idle = queue.Queue()
+            self._all = []
+            for _ in range(self.workers):
+                self._add_worker()
+            self._pid = os.getpid()
+
+    def _add_worker(self) -> None:
+        worker = _Worker(self._ctx, self.ruleset_path)
+        self._all.append(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+            self._add_worker()
+
+    def scan(self, text: str, engine: t.Optional[DetectorEngine] = None, stop: t.Optional[t.Callable[[ScanResult], bool]] = None) -> ScanResult:
+        """`stop` (see DetectorEngine.scan) only applies in-process; workers run every rule."""
+        engine = engine or active_engine()
+        if not self.offloads(text):
+            return engine.scan(text, stop)
+        self._ensure_started()
+        # The budget covers waiting for a worker too
+        deadline = time.monotonic() + self.budget
+        try:
+            worker = self._idle.get(timeout=self.budget)
+        except queue.Empty:
+            return self._keywords_only(text, engine, "pool_busy")
+        keywords = None
+        rule_matches: t.List[t.Any] = [None] * len(engine.rules)
+        finished = [False] * len(engine.rules)
+        reason = None
+        try:
+            worker.conn.send((engine.digest, text))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    reason = "budget"
+                    break
+                msg = worker.conn.recv()
+                if msg[0] == "keywords":
+                    keywords = msg[1]
+                elif msg[0] == "rule":
+                    rule_matches[msg[1]] = msg[2]
+                    finished[msg[1]] = True
+                elif msg[0] == "done":
+                    break
+                else:  # "stale": worker could not load these rules
+                    self._idle.put(worker)
+                    worker = None
+                    return self._keywords_only(text, engine, "stale")
+        except (EOFError, OSError):
+            reason = "worker_died"
+        except Exception:
+            # A reply that does not fit these rules; unread messages may
+            # still be in the pipe, so the worker is not reused
+            reason = "bad_reply"
+        finally:
+            if worker is not None:
+                if reason is None:
+                    self._idle.put(worker)
+                else:
+                    # Still busy with (or dead from) a runaway regex: replace it
+                    self._replace(worker)
+
+        if keywords is None:
+            # The automaton is linear-time, so finishing it here is safe
+            keywords = engine.scan_keywords(text)
+        skipped = [rule.pattern_id for rule, done in zip(engine.rules, finished) if not done]
+        if skipped:
+            DETECT_TRUNCATED_TOTAL.inc(reason=reason or "budget")
+        return engine.assemble(text, keywords, rule_matches, skipped)
+
+    def _keywords_only(self, text: str, engine: DetectorEngine, reason: str) -> ScanResult:
+        """The budget-exhausted result: the linear-time keyword pass, no regex rules."""
+        DETECT_TRUNCATED_TOTAL.inc(reason=reason)
+        return engine.assemble(text, engine.scan_keywords(text), [None] * len(engine.rules), [rule.pattern_id for rule in engine.rules])
+
+    def close(self) -> None:
+        with self._lock:
+            for worker in self._all:
+                try:
+                    worker.conn.send(None)
+                    worker.process.join(timeout=0.5)
+                except OSError:
+                    pass
+                worker.kill()
+            self._all = []
+            self._idle = queue.Queue()
+            self._pid = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": len(self._all) if self._pid == os.getpid() else 0,
+            "idle": self._idle.qsize() if self._pid == os.getpid() else 0,
+            "budget_ms": self.budget * 1000,
+            "min_chars": self.min_chars,
+        }
+
+
+DETECT_POOL = DetectionPool()
@@ -0,0 +1,550 @@
+# detectors.py - Precompiled detector engine for the analyze pipeline
+import os
+import re
+import json
+import bisect
+import hashlib
+import typing as t
+
+from .utils import get_env
+from .keywords import KeywordAutomaton, KeywordEntry, KeywordHit
+from .regex_safety import PatternReport, compile_pattern, match_reach
+
+# Rules live in a versioned file (rules/default.json by default) so they can
+# change without a redeploy; see ruleset.py for hot reloading
+DEFAULT_RULESET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules", "default.json")
+RULESET_PATH = get_env("RULESET_PATH", DEFAULT_RULESET_PATH)
+
+# Keyword lists and regex families a ruleset file may define
+KEYWORD_LISTS = ("slang", "profanity")
+PATTERN_FAMILIES = ("explicit", "harmful", "risky", "ambiguous", "injection", "system_tokens")
+
+# a few Kannada Unicode words example: (you can extend)
+KANNADA_UNICODE_REGEX = re.compile(r"[\u0C80-\u0CFF]")
+
+# COSTAR fields whose labels accumulate ("AI, Network"); for the others the
+# last matching rule in the file wins
+COSTAR_ACCUMULATE = ("Context",)
+
+# Categories whose presence always blocks the prompt
+BLOCKING_CATEGORIES = ("explicit", "harmful", "injection", "system_token")
+# Categories that make build_sanitized_rewrite replace the prompt entirely
+REPLACE_CATEGORIES = ("explicit", "harmful", "profanity")
+
+# Verdict impact of a rule: a match in a blocking category decides BLOCK on
+# its own; any other match adds one issue
+IMPACT_BLOCK, IMPACT_ISSUE = "block", "issue"
+# Cost of the keyword automaton pass in pattern_cost() units: it is a Python
+# loop per character, about as slow as a regex of cost ~500-800 running in C
+KEYWORD_PASS_COST = 500
+# scan_order entry standing for the keyword pass
+_KEYWORD_STEP = -1
+
+# StreamScanner: new text scanned per window, and how far past a window's end
+# the scanner looks before settling matches that start inside it. Matches
+# longer than the overlap may be missed when they straddle a window boundary.
+STREAM_WINDOW_CHARS = int(get_env("STREAM_WINDOW_CHARS", "65536"))
+STREAM_OVERLAP_CHARS = int(get_env("STREAM_OVERLAP_CHARS", "4096"))
+# Slang hits a stream keeps as highlights; the verdict only needs two, the score saturates at six
+STREAM_MAX_SLANG_HITS = int(get_env("STREAM_MAX_SLANG_HITS", "100"))
+# Characters kept in front of each window so \b and keyword boundaries see real context
+_STREAM_CONTEXT = 64
+# IncrementalScanner: how far an edit is assumed to reach for rules whose match
+# length has no static bound (e.g. "f+u+c+k+"); such matches longer than this
+# may be reported stale after an edit
+INCREMENTAL_MARGIN_CHARS = int(get_env("INCREMENTAL_MARGIN_CHARS", "1024"))
+
+
+class DetectorMatch(t.NamedTuple):
+    category: str
+    pattern_id: str
+    pattern: str
+    start: int
+    end: int
+    text: str
+
+
+class DetectorRule(t.NamedTuple):
+    pattern_id: str
+    category: str
+    pattern: str
+    regex: t.Pattern
+    # Static estimate from regex_safety.pattern_cost(); cheaper rules run first
+    # when a scan may stop early
+    cost: int = 1
+    impact: str = IMPACT_ISSUE
+
+
+class KeywordScan(t.NamedTuple):
+    """The keyword-automaton part of a scan (linear time, never truncated)."""
+    slang: t.List[DetectorMatch]
+    profanity: t.Optional[DetectorMatch]
+    costar_hits: t.List[KeywordHit]
+    has_kannada: bool
+
+
+_NO_KEYWORDS = KeywordScan([], None, [], False)
+
+
+class ScanResult:
+    """All detector matches for one prompt, in rule order.
+
+    Built once per prompt by DetectorEngine.scan() and shared by every
+    consumer (highlights, verdict, rewrite) so no pattern runs twice.
+    `truncated` is set when a time budget stopped the regex rules early;
+    `skipped_rules` lists the pattern ids that never ran. `stopped_early`
+    is set when the scan stopped because the verdict was already decided.
+    """
+
+    def __init__(self, text: str, matches: t.List[DetectorMatch], has_kannada: bool, costar_hits: t.List[KeywordHit], engine: "DetectorEngine", skipped_rules: t.Sequence[str] = (), stopped_early: bool = False):
+        self.text = text
+        self.matches = matches
+        self.has_kannada = has_kannada
+        self.costar_hits = costar_hits
+        self.engine = engine
+        self.skipped_rules = list(skipped_rules)
+        self.stopped_early = stopped_early
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.skipped_rules)
+
+    def by_category(self, *categories: str) -> t.List[DetectorMatch]:
+        return [m for m in self.matches if m.category in categories]
+
+    def has(self, *categories: str) -> bool:
+        return any(m.category in categories for m in self.matches)
+
+    @property
+    def injection_found(self) -> bool:
+        return self.has("injection", "system_token")
+
+    @property
+    def needs_replacement(self) -> bool:
+        """Explicit, harmful or profane prompts are never lightly sanitized."""
+        return self.has(*REPLACE_CATEGORIES)
+
+
+class DetectorEngine:
+    """
+    Holds every detector of one ruleset version compiled once: regex rules
+    plus one keyword automaton for the slang, profanity and COSTAR word
+    lists. Never mutated after construction; a reload builds a new engine.
+    """
+
+    def __init__(self, version: str, rules: t.List[DetectorRule], keywords: KeywordAutomaton, profanity: t.Iterable[str], costar_rules: list, reports: t.Sequence[PatternReport] = (), digest: t.Optional[str] = None):
+        self.version = version
+        # Identifies the rules themselves (declared version plus a content
+        # hash): cache keys and worker processes compare this, since a file
+        # edited without a version bump keeps its version
+        self.digest = digest or version
+        # ReDoS lint result per rule, in rule order
+        self.reports = tuple(reports)
+        self.rules = tuple(rules)
+        # Evaluation order for early-exit scans: rule indexes plus _KEYWORD_STEP,
+        # cheapest first, blocking rules first on ties
+        costs = {i: (r.cost, r.impact != IMPACT_BLOCK, i) for i, r in enumerate(self.rules)}
+        costs[_KEYWORD_STEP] = (KEYWORD_PASS_COST, True, -1)
+        self.scan_order = tuple(sorted(costs, key=costs.__getitem__))
+        self._replaces = tuple(r.category in REPLACE_CATEGORIES for r in self.rules)
+        self._replace_rules = sum(self._replaces)
+        self.keywords = keywords
+        self.profanity = frozenset(w.lower() for w in profanity)
+        self.costar_rules = tuple(costar_rules)
+        # For IncrementalScanner: chars around an attempt's start it can read (None = unbounded)
+        self.reaches = tuple(match_reach(r.regex.pattern) for r in self.rules)
+        # Longest keyword plus one boundary character on each side
+        self.keyword_reach = max((len(e.keyword) for e in keywords.entries), default=0) + 2
+
+    def scan(self, text: str, stop: t.Optional[t.Callable[[ScanResult], bool]] = None) -> ScanResult:
+        """
+        Run every detector over `text`. With `stop`, the rules and the
+        keyword pass run in scan_order and stop(partial result) is asked
+        after every step that found something; once it is true the scan
+        ends, but never before the REPLACE_CATEGORIES outcome (explicit,
+        harmful or profanity found, or all of them checked) is known, so the
+        kind of rewrite is the same as after a full scan. A scan that ends
+        before the keyword pass reports no slang, COSTAR or Kannada.
+        """
+        if stop is None:
+            keywords = self.scan_keywords(text)
+            return self.assemble(text, keywords, [self.match_rule(rule, text) for rule in self.rules])
+        keywords = _NO_KEYWORDS
+        keywords_done = False
+        rule_matches: t.List[t.Optional[DetectorMatch]] = [None] * len(self.rules)
+        decided = replacing = False
+        replace_left = self._replace_rules
+        for step in self.scan_order:
+            if decided and (replacing or (keywords_done and replace_left == 0)):
+                return self.assemble(text, keywords, rule_matches, stopped_early=True)
+            if step == _KEYWORD_STEP:
+                keywords, keywords_done = self.scan_keywords(text), True
+                replacing = replacing or keywords.profanity is not None
+                found = bool(keywords.slang) or keywords.profanity is not None or keywords.has_kannada
+            else:
+                match = rule_matches[step] = self.match_rule(self.rules[step], text)
+                found = match is not None
+                if self._replaces[step]:
+                    replace_left -= 1
+                    replacing = replacing or found
+            if found and not decided:
+                decided = stop(self.assemble(text, keywords, rule_matches))
+        return self.assemble(text, keywords, rule_matches)
+
+    def scan_keywords(self, text: str) -> KeywordScan:
+        keyword_hits = self.keywords.scan(text)
+        slang = [
+            DetectorMatch("slang", "slang", h.keyword, h.start, h.end, text[h.start:h.end])
+            for h in keyword_hits if h.category == "slang"
+        ]
+        # Profanity is a plain substring check (e.g. "shitty" counts), never a highlight
+        profane = next((h for h in keyword_hits if h.category == "profanity"), None)
+        profanity = None
+        if profane:
+            profanity = DetectorMatch("profanity", "profanity", profane.keyword, profane.start, profane.end, text[profane.start:profane.end])
+        costar_hits = [h for h in keyword_hits if h.category == "costar"]
+        return KeywordScan(slang, profanity, costar_hits, bool(KANNADA_UNICODE_REGEX.search(text)))
+
+    @staticmethod
+    def match_rule(rule: DetectorRule, text: str) -> t.Optional[DetectorMatch]:
+        # Regex rules report their first match only
+        m = rule.regex.search(text)
+        if m is None:
+            return None
+        return DetectorMatch(rule.category, rule.pattern_id, rule.pattern, m.start(), m.end(), m.group(0))
+
+    def assemble(self, text: str, keywords: KeywordScan, rule_matches: t.Sequence[t.Optional[DetectorMatch]], skipped_rules: t.Sequence[str] = (), stopped_early: bool = False) -> ScanResult:
+        """ScanResult from the keyword pass plus one entry per rule (None = no match or not run)."""
+        matches = list(keywords.slang)
+        matches += [m for m in rule_matches if m is not None]
+        if keywords.profanity is not None:
+            matches.append(keywords.profanity)
+        return ScanResult(text, matches, keywords.has_kannada, keywords.costar_hits, self, skipped_rules, stopped_early)
+
+    def strip_slang(self, text: str) -> str:
+        """Remove whole-word slang (except profanity, which forces a full rewrite)."""
+        spans = [
+            (h.start, h.end) for h in self.keywords.scan(text, original_boundaries=True)
+            if h.category == "slang" and h.keyword not in self.profanity
+        ]
+        if not spans:
+            return text
+        parts, pos = [], 0
+        for start, end in spans:
+            if start >= pos:
+                parts.append(text[pos:start])
+                pos = end
+        parts.append(text[pos:])
+        return "".join(parts)
+
+    def extract_costar(self, scan: ScanResult) -> t.Dict[str, str]:
+        """COSTAR labels from the keyword hits; empty string when nothing matched."""
+        fired = {h.value for h in scan.costar_hits}
+        fields: t.Dict[str, str] = {}
+        for i, (field, label, _) in enumerate(self.costar_rules):
+            if i not in fired:
+                continue
+            if field in COSTAR_ACCUMULATE and fields.get(field):
+                fields[field] = f"{fields[field]}, {label}"
+            else:
+                fields[field] = label
+        return fields
+
+
+class StreamScanner:
+    """
+    DetectorEngine.scan() over text that arrives in pieces, holding at most
+    one window plus the overlap in memory.
+
+    Each window is scanned together with the next `overlap` characters; a
+    match is settled by the window it starts in, so a match straddling the
+    boundary is seen whole (up to `overlap` chars long) and reported once,
+    with offsets into the whole stream. Regex rules still report their first
+    match only, so the result equals a whole-text scan. feed() returns True
+    as soon as a BLOCKING_CATEGORIES rule has matched; the caller may stop
+    reading there, and finish() then skips the unscanned rest. Only the
+    first `max_slang` slang hits are kept (slang_total counts them all),
+    so memory stays bounded however long the stream runs.
+    """
+
+    def __init__(self, engine: DetectorEngine, window: int = STREAM_WINDOW_CHARS, overlap: int = STREAM_OVERLAP_CHARS, max_slang: int = STREAM_MAX_SLANG_HITS):
+        if window <= 0 or overlap < 0:
+            raise ValueError("window must be positive and overlap non-negative")
+        self.engine = engine
+        self.window = window
+        self.overlap = overlap
+        self.max_slang = max_slang
+        self.slang_total = 0
+        self._buf = ""
+        self._base = 0  # stream offset of _buf[0]
+        self._pos = 0   # index in _buf where unsettled text starts
+        self._slang: t.List[DetectorMatch] = []
+        self._profanity: t.Optional[DetectorMatch] = None
+        # One hit per COSTAR rule is all extract_costar() needs
+        self._costar: t.Dict[t.Any, KeywordHit] = {}
+        self._kannada = False
+        self._rule_matches: t.List[t.Optional[DetectorMatch]] = [None] * len(engine.rules)
+        self.windows = 0
+
+    @property
+    def scanned(self) -> int:
+        """Characters of the stream settled so far."""
+        return self._base + self._pos
+
+    @property
+    def blocked(self) -> bool:
+        return any(m is not None and m.category in BLOCKING_CATEGORIES for m in self._rule_matches)
+
+    def feed(self, text: str) -> bool:
+        """Append text and scan every window it completes. Returns self.blocked."""
+        for i in range(0, len(text), self.window):
+            self._buf += text[i:i + self.window]
+            while len(self._buf) - self._pos >= self.window + self.overlap:
+                self._scan(self._pos + self.window)
+                if self.blocked:
+                    return True
+        return self.blocked
+
+    def finish(self) -> ScanResult:
+        """Scan whatever is buffered (unless already blocked) and build the result."""
+        if not self.blocked:
+            while len(self._buf) - self._pos > self.window + self.overlap:
+                self._scan(self._pos + self.window)
+            if len(self._buf) > self._pos:
+                self._scan(len(self._buf))
+        costar_hits = sorted(self._costar.values(), key=lambda h: (h.start, h.end))
+        keywords = KeywordScan(self._slang, self._profanity, costar_hits, self._kannada)
+        # The stream is never held whole, so the result carries no text
+        return self.engine.assemble("", keywords, self._rule_matches, stopped_early=self.blocked)
+
+    def _scan(self, limit: int) -> None:
+        """Settle every match starting in _buf[_pos:limit], looking ahead by the overlap."""
+        final = limit >= len(self._buf)
+        view = self._buf if final else self._buf[:limit + self.overlap]
+        base, pos = self._base, self._pos
+        for h in self.engine.keywords.scan(view):
+            if not pos <= h.start < limit:
+                continue
+            hit = h._replace(start=h.start + base, end=h.end + base)
+            if h.category == "slang":
+                self.slang_total += 1
+                if len(self._slang) < self.max_slang:
+                    self._slang.append(DetectorMatch("slang", "slang", h.keyword, hit.start, hit.end, view[h.start:h.end]))
+            elif h.category == "profanity":
+                if self._profanity is None:
+                    self._profanity = DetectorMatch("profanity", "profanity", h.keyword, hit.start, hit.end, view[h.start:h.end])
+            else:
+                self._costar.setdefault(h.value, hit)
+        self._kannada = self._kannada or bool(KANNADA_UNICODE_REGEX.search(view, pos, limit))
+        for i, rule in enumerate(self.engine.rules):
+            if self._rule_matches[i] is not None:
+                continue
+            m = rule.regex.search(view, pos)
+            if m is not None and (final or m.start() < limit):
+                self._rule_matches[i] = DetectorMatch(rule.category, rule.pattern_id, rule.pattern, m.start() + base, m.end() + base, m.group(0))
+        # Keep a little context in front of the next window and drop the rest
+        cut = max(0, limit - _STREAM_CONTEXT)
+        self._buf = self._buf[cut:]
+        self._base += cut
+        self._pos = limit - cut
+        self.windows += 1
+
+
+class IncrementalScanner:
+    """
+    DetectorEngine.scan() for a text that is edited in place, re-scanning
+    only around each edit.
+
+    All keyword hits and each rule's first match are kept with their
+    offsets. An edit replaces text[start:start + delete] with `insert`;
+    only match attempts that start within the rule's reach of the edited
+    span can change outcome, so only that zone is searched (with
+    search(pos, endpos)) and hits on either side are kept or shifted. A
+    rule's first match destroyed by an edit is looked for again past the
+    zone. Rules without a static match-length bound use `margin` as their
+    reach. scan() then equals engine.scan(text) without running every rule
+    over the whole text.
+    """
+
+    def __init__(self, engine: DetectorEngine, text: str = "", margin: int = INCREMENTAL_MARGIN_CHARS):
+        self.engine = engine
+        self.margin = margin
+        self.reaches = tuple(r if r is not None else margin for r in engine.reaches)
+        self.text = text
+        self._hits: t.List[KeywordHit] = engine.keywords.scan(text)
+        self._starts = [h.start for h in self._hits]
+        self._rule_matches: t.List[t.Optional[DetectorMatch]] = [engine.match_rule(rule, text) for rule in engine.rules]
+        self._kannada = len(KANNADA_UNICODE_REGEX.findall(text))
+        # Characters searched by the last edit, and rules that had to search past their zone
+        self.last_scanned = len(text)
+        self.tail_searches = 0
+
+    def edit(self, start: int, delete: int, insert: str) -> None:
+        if not 0 <= start <= len(self.text) or delete < 0 or start + delete > len(self.text):
+            raise ValueError(f"edit [{start}:{start + delete}] outside text of length {len(self.text)}")
+        old_end = start + delete
+        removed = self.text[start:old_end]
+        self.text = text = self.text[:start] + insert + self.text[old_end:]
+        new_end = start + len(insert)
+        shift = new_end - old_end
+        self._kannada += len(KANNADA_UNICODE_REGEX.findall(insert)) - len(KANNADA_UNICODE_REGEX.findall(removed))
+        scanned = self._edit_keywords(start, old_end, new_end, shift)
+        for i, rule in enumerate(self.engine.rules):
+            scanned += self._edit_rule(i, rule, start, old_end, new_end, shift)
+        self.last_scanned = scanned
+
+    def _edit_keywords(self, start: int, old_end: int, new_end: int, shift: int) -> int:
+        reach = self.engine.keyword_reach
+        lo, hi = max(0, start - reach), new_end + reach
+        # Old hits starting in [lo, old_end + reach) may have changed; later ones just move
+        first = bisect.bisect_left(self._starts, lo)
+        last = bisect.bisect_left(self._starts, old_end + reach)
+        after = [h._replace(start=h.start + shift, end=h.end + shift) for h in self._hits[last:]]
+        view_lo = max(0, lo - 1)
+        view = self.text[view_lo:hi + reach]
+        fresh = [h for h in self.engine.keywords.scan(view, offset=view_lo) if lo <= h.start < hi]
+        self._hits = self._hits[:first] + fresh + after
+        self._starts = [h.start for h in self._hits]
+        return len(view)
+
+    def _edit_rule(self, i: int, rule: DetectorRule, start: int, old_end: int, new_end: int, shift: int) -> int:
+        old = self._rule_matches[i]
+        reach = self.reaches[i]
+        zone_lo, zone_hi = max(0, start - reach), new_end + reach
+        if old is not None and old.start < zone_lo:
+            if old.end < start:
+                return 0  # it (and every earlier attempt) never saw the edit
+            # An unbounded match running into the edit: redo its attempt
+            self._rule_matches[i] = self._search_from(rule, old.start)
+            return len(self.text) - old.start
+        endpos = min(len(self.text), zone_hi + reach)
+        m = rule.regex.search(self.text, zone_lo, endpos)
+        scanned = endpos - zone_lo
+        if m is not None and m.start() < zone_hi:
+            self._rule_matches[i] = DetectorMatch(rule.category, rule.pattern_id, rule.pattern, m.start(), m.end(), m.group(0))
+        elif old is None:
+            pass  # every attempt past the zone failed before and still does
+        elif old.start >= old_end + reach:
+            self._rule_matches[i] = old._replace(start=old.start + shift, end=old.end + shift)
+        else:
+            # The old first match was in the zone and is gone: look past it
+            self.tail_searches += 1
+            self._rule_matches[i] = self._search_from(rule, zone_hi)
+            scanned += len(self.text) - zone_hi
+        return scanned
+
+    def _search_from(self, rule: DetectorRule, pos: int) -> t.Optional[DetectorMatch]:
+        m = rule.regex.search(self.text, pos)
+        if m is None:
+            return None
+        return DetectorMatch(rule.category, rule.pattern_id, rule.pattern, m.start(), m.end(), m.group(0))
+
+    def scan(self) -> ScanResult:
+        text = self.text
+        slang = [DetectorMatch("slang", "slang", h.keyword, h.start, h.end, text[h.start:h.end]) for h in self._hits if h.category == "slang"]
+        profane = next((h for h in self._hits if h.category == "profanity"), None)
+        profanity = None
+        if profane:
+            profanity = DetectorMatch("profanity", "profanity", profane.keyword, profane.start, profane.end, text[profane.start:profane.end])
+        costar_hits = [h for h in self._hits if h.category == "costar"]
+        keywords = KeywordScan(slang, profanity, costar_hits, self._kannada > 0)
+        return self.engine.assemble(text, keywords, self._rule_matches)
+
+
+def _keyword_entries(slang: t.Iterable[str], profanity: t.Iterable[str], costar_rules: list) -> t.List[KeywordEntry]:
+    entries = [KeywordEntry(w, "slang", None, True, True) for w in slang]
+    entries += [KeywordEntry(w, "profanity") for w in profanity]
+    for i, (_, _, words) in enumerate(costar_rules):
+        entries += [KeywordEntry(w, "costar", i, left, right) for w, left, right in words]
+    return entries
+
+
+def _compile_family(category: str, patterns: t.List[str], reports: t.List[PatternReport]) -> t.List[DetectorRule]:
+    rules = []
+    for i, p in enumerate(patterns):
+        # ReDoS lint: unsafe patterns are rewritten with bounded gaps or rejected
+        try:
+            regex, report = compile_pattern(p, re.I)
+        except ValueError as e:
+            raise ValueError(f"{category}[{i}] rejected, {e}: {p!r}")
+        impact = IMPACT_BLOCK if category in BLOCKING_CATEGORIES else IMPACT_ISSUE
+        rules.append(DetectorRule(f"{category}:{i}", category, p, regex, report.cost, impact))
+        reports.append(report)
+    return rules
+
+
+def _string_list(ruleset: dict, key: str) -> t.List[str]:
+    value = ruleset.get(key, [])
+    if not isinstance(value, list) or not all(isinstance(x, str) for x in value):
+        raise ValueError(f"ruleset '{key}' must be a list of strings")
+    return value
+
+
+def _costar_rules(ruleset: dict) -> list:
+    rules = []
+    for i, rule in enumerate(ruleset.get("costar", [])):
+        try:
+            words = [(k["text"], bool(k.get("left_boundary")), bool(k.get("right_boundary"))) for k in rule["keywords"]]
+            rules.append((rule["field"], rule["label"], words))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"costar[{i}] needs field, label and keywords[].text ({e})")
+    return rules
+
+
+def build_engine(ruleset: dict) -> DetectorEngine:
+    """Validate a parsed ruleset and compile all pattern families into one engine.
+
+    Match order follows the order findings are reported in highlights:
+    slang (keyword automaton), then the explicit, harmful, risky, ambiguous
+    and injection regex rules. Raises ValueError on a malformed ruleset.
+    """
+    if not isinstance(ruleset, dict) or not ruleset.get("version"):
+        raise ValueError("ruleset must be an object with a non-empty 'version'")
+    slang, profanity = (_string_list(ruleset, k) for k in KEYWORD_LISTS)
+    costar_rules = _costar_rules(ruleset)
+    keywords = KeywordAutomaton(_keyword_entries(slang, profanity, costar_rules))
+    rules: t.List[DetectorRule] = []
+    reports: t.List[PatternReport] = []
+    for family in PATTERN_FAMILIES:
+        # Pattern ids keep the singular category name, e.g. "system_token:0"
+        category = "system_token" if family == "system_tokens" else family
+        rules += _compile_family(category, _string_list(ruleset, family), reports)
+    content = hashlib.sha256(json.dumps(ruleset, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return DetectorEngine(str(ruleset["version"]), rules, keywords, profanity, costar_rules, reports, f"{ruleset['version']}+{content}")
+
+
+def load_ruleset(path: str = RULESET_PATH) -> dict:
+    """Parse a ruleset file: JSON, or YAML for .yaml/.yml (needs PyYAML)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"{path}: YAML rulesets need PyYAML installed (pip install pyyaml)")
+        return yaml.safe_load(raw)
+    return json.loads(raw)
+
+
+def build_engine_from_file(path: str = RULESET_PATH) -> DetectorEngine:
+    return build_engine(load_ruleset(path))
+
+
+# The engine requests scan with. Swapped wholesale by ruleset.RulesetManager;
+# a request that already holds a reference keeps using the engine it started with.
+_active_engine = build_engine_from_file()
+
+
+def active_engine() -> DetectorEngine:
+    return _active_engine
+
+
+def swap_engine(engine: DetectorEngine) -> DetectorEngine:
+    """Make `engine` the active one and return the previous engine."""
+    global _active_engine
+    previous, _active_engine = _active_engine, engine
+    return previous
+
+
+def scan_prompt(text: str, engine: t.Optional[DetectorEngine] = None) -> ScanResult:
+    return (engine or _active_engine).scan(text)
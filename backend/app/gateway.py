@@ -0,0 +1,278 @@
+# gateway.py - Adaptive concurrency limit, circuit breaker and retries for upstream LLM calls
+import time
+import random
+import asyncio
+import threading
+import typing as t
+from contextlib import asynccontextmanager
+
+import httpx
+
+from .utils import get_env
+from .metrics import REGISTRY, CallbackMetric, Counter
+
+# Adaptive concurrency (AIMD): grow by ~1 per window of fast successes, cut on overload
+LLM_LIMIT_INITIAL = float(get_env("LLM_LIMIT_INITIAL", "16"))
+LLM_LIMIT_MIN = float(get_env("LLM_LIMIT_MIN", "1"))
+LLM_LIMIT_MAX = float(get_env("LLM_LIMIT_MAX", get_env("LLM_MAX_CONNECTIONS", "32")))
+LLM_LIMIT_BACKOFF = float(get_env("LLM_LIMIT_BACKOFF", "0.7"))
+LLM_LATENCY_TARGET = float(get_env("LLM_LATENCY_TARGET", "5"))
+# Circuit breaker
+LLM_BREAKER_FAILURES = int(get_env("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(get_env("LLM_BREAKER_RESET_SECONDS", "30"))
+# Retries (429/503 only) with full-jitter exponential backoff
+LLM_RETRY_MAX = int(get_env("LLM_RETRY_MAX", "2"))
+LLM_RETRY_BASE_DELAY = float(get_env("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_RETRY_MAX_DELAY = float(get_env("LLM_RETRY_MAX_DELAY", "4"))
+
+RETRY_STATUSES = (429, 503)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling upstream; callers should use their local fallback."""
+
+    reason = "unavailable"
+
+
+class CircuitOpenError(LLMUnavailable):
+    reason = "circuit_open"
+
+
+class ConcurrencyLimited(LLMUnavailable):
+    reason = "limited"
+
+
+def _status(exc: BaseException) -> t.Optional[int]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    return None
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Timeouts, connection errors, 5xx and 429 count; other 4xx are our fault, not upstream's."""
+    status = _status(exc)
+    return status is None or status >= 500 or status == 429
+
+
+def is_overload(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.TimeoutException) or _status(exc) in RETRY_STATUSES
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit that adds 1/limit per fast success and multiplies by
+    `backoff` on overload (timeout, 429/503, or latency above target).
+    Calls over the limit are rejected immediately rather than queued.
+    """
+
+    def __init__(
+        self,
+        initial: float = LLM_LIMIT_INITIAL,
+        min_limit: float = LLM_LIMIT_MIN,
+        max_limit: float = LLM_LIMIT_MAX,
+        backoff: float = LLM_LIMIT_BACKOFF,
+        latency_target: float = LLM_LATENCY_TARGET,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, overloaded: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if overloaded or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures so calls fail fast.
+    After `reset_timeout` one probe is let through (half-open): success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET_SECONDS, clock: t.Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+            self._probing = False
+
+    def release_probe(self) -> None:
+        """An admitted call ended without an outcome (cancelled, or never sent)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self.trips += 1
+            self._probing = False
+
+
+class Attempt:
+    """
+    Timing of one guarded call. A stream calls first_byte() when its first
+    chunk arrives, so its latency is time to first byte rather than the
+    whole stream (which also includes however slowly the client reads).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.latency: t.Optional[float] = None
+
+    def first_byte(self) -> None:
+        if self.latency is None:
+            self.latency = time.perf_counter() - self.start
+
+    def elapsed(self) -> float:
+        return self.latency if self.latency is not None else time.perf_counter() - self.start
+
+
+class LLMGateway:
+    """Admission (breaker + limiter), outcome accounting and retries around one upstream."""
+
+    def __init__(
+        self,
+        name: str,
+        limiter: t.Optional[AIMDLimiter] = None,
+        breaker: t.Optional[CircuitBreaker] = None,
+        max_retries: int = LLM_RETRY_MAX,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+        rng: t.Callable[[], float] = random.random,
+        sleep: t.Callable[[float], t.Awaitable[None]] = asyncio.sleep,
+    ):
+        self.name = name
+        self.limiter = limiter or AIMDLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng
+        self.sleep = sleep
+
+    def _admit(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}: circuit open")
+        if not self.limiter.try_acquire():
+            self.breaker.release_probe()
+            raise ConcurrencyLimited(f"{self.name}: concurrency limit {int(self.limiter.limit)} reached")
+
+    @asynccontextmanager
+    async def guard(self) -> t.AsyncIterator[Attempt]:
+        """One upstream attempt: admit, then record its latency and outcome."""
+        self._admit()
+        attempt = Attempt()
+        try:
+            yield attempt
+        except BaseException as e:
+            self.limiter.release(attempt.elapsed(), overloaded=is_overload(e))
+            if not isinstance(e, Exception):
+                self.breaker.release_probe()
+            elif is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.limiter.release(attempt.elapsed(), overloaded=False)
+        self.breaker.record_success()
+
+    def _retry_delay(self, attempt: int, exc: BaseException) -> float:
+        retry_after = None
+        if isinstance(exc, httpx.HTTPStatusError):
+            try:
+                retry_after = float(exc.response.headers.get("retry-after", ""))
+            except ValueError:
+                pass
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self.rng() * min(self.max_delay, self.base_delay * (2 ** attempt))
+
+    async def call(self, fn: t.Callable[[], t.Awaitable[t.Any]]) -> t.Any:
+        """Run `fn` through the gateway, retrying 429/503 responses with jittered backoff."""
+        attempt = 0
+        while True:
+            try:
+                async with self.guard():
+                    return await fn()
+            except httpx.HTTPStatusError as e:
+                if _status(e) not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                LLM_RETRIES_TOTAL.inc(client=self.name, status=str(_status(e)))
+                await self.sleep(self._retry_delay(attempt, e))
+                attempt += 1
+
+    def status(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "trips": self.breaker.trips,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+        }
+
+
+LLM_RETRIES_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_llm_retries_total", "Upstream LLM calls retried after 429/503", ("client", "status"),
+))
+
+GATEWAY = LLMGateway("gemini")
+
+REGISTRY.register(CallbackMetric(
+    "prompt_review_llm_circuit_state", "Gemini circuit breaker state (0 closed, 1 half-open, 2 open)",
+    lambda: _STATE_VALUES[GATEWAY.breaker.state],
+))
+REGISTRY.register(CallbackMetric(
+    "prompt_review_llm_circuit_trips_total", "Times the Gemini circuit breaker opened",
+    lambda: GATEWAY.breaker.trips, type="counter",
+))
+REGISTRY.register(CallbackMetric(
+    "prompt_review_llm_concurrency_limit", "Current adaptive concurrency limit for Gemini",
+    lambda: GATEWAY.limiter.limit,
+))
+REGISTRY.register(CallbackMetric(
+    "prompt_review_llm_in_flight", "Gemini calls currently in flight",
+    lambda: GATEWAY.limiter.in_flight,
+))
@@ -0,0 +1,367 @@
+# history.py - Append-only analysis history in SQLite, written by a background thread
+import io
+import os
+import csv
+import json
+import zlib
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+import typing as t
+from datetime import datetime, timezone
+
+from .utils import get_env
+
+HISTORY_BACKEND = get_env("HISTORY_BACKEND", "sqlite")  # sqlite | off
+# backend/data/, not the working directory the server happens to start in
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "analysis_history.sqlite3")
+HISTORY_SQLITE_PATH = get_env("HISTORY_SQLITE_PATH", DEFAULT_HISTORY_PATH)
+HISTORY_BATCH_SIZE = int(get_env("HISTORY_BATCH_SIZE", "256"))
+HISTORY_FLUSH_MS = float(get_env("HISTORY_FLUSH_MS", "50"))
+# Records waiting for the writer; beyond this new records are dropped, never waited on
+HISTORY_QUEUE_MAX = int(get_env("HISTORY_QUEUE_MAX", "10000"))
+# Keep the prompt text itself, not just its hash
+HISTORY_STORE_PROMPTS = get_env("HISTORY_STORE_PROMPTS", "false").lower() in ("1", "true", "yes")
+
+HISTORY_MAX_PAGE = 500
+# Rows fetched per round trip while exporting
+HISTORY_EXPORT_CHUNK = int(get_env("HISTORY_EXPORT_CHUNK", "1000"))
+BUCKETS = {"hour": 3600, "day": 86400}
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Flat, fixed columns (nested fields as JSON text) so the CSV loads straight into Parquet/Arrow
+EXPORT_COLUMNS = (
+    "id", "created_at", "created_at_iso", "endpoint", "prompt_hash", "persona", "verdict", "score",
+    "ruleset_version", "cached", "highlight_count", "highlights", "timings", "prompt",
+)
+# Encoded output is handed to the response in pieces of about this size
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+def prompt_hash(prompt: str) -> str:
+    """Hash of the exact prompt text, the same identity the verdict cache keys on."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class HistoryRecord(t.NamedTuple):
+    created_at: float
+    endpoint: str
+    prompt_hash: str
+    persona: str
+    verdict: str
+    score: int
+    highlights: t.List[dict]
+    ruleset_version: t.Optional[str]
+    # Served from the verdict cache
+    cached: bool
+    # e.g. {"total_ms": 1.2, "detect_ms": 0.3}
+    timings: t.Dict[str, float]
+    prompt: t.Optional[str] = None
+
+
+_COLUMNS = ("created_at", "endpoint", "prompt_hash", "persona", "verdict", "score", "highlights", "ruleset_version", "cached", "timings", "prompt")
+
+
+class HistoryStore:
+    """
+    Request handlers only call record(), which puts the record on a bounded
+    queue and returns; a full queue drops the record (counted in `dropped`)
+    rather than making the request wait. One writer thread per process
+    drains the queue and inserts in batches, one transaction per batch of up
+    to `batch_size` records or `flush_ms` worth of arrivals. The database is
+    in WAL mode, so reads (query(), aggregates()) run alongside the writer
+    and prefork workers can share one file.
+    """
+
+    def __init__(self, path: str = HISTORY_SQLITE_PATH, batch_size: int = HISTORY_BATCH_SIZE, flush_ms: float = HISTORY_FLUSH_MS, queue_max: int = HISTORY_QUEUE_MAX, store_prompts: bool = HISTORY_STORE_PROMPTS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.queue_max = queue_max
+        self.store_prompts = store_prompts
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self._queue: "queue.Queue[t.Optional[HistoryRecord]]" = queue.Queue(maxsize=queue_max)
+        self._thread: t.Optional[threading.Thread] = None
+        self._reader: t.Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pid: t.Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        folder = os.path.dirname(self.path)
+        if folder and self.path != ":memory:":
+            os.makedirs(folder, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, endpoint TEXT NOT NULL, "
+            "prompt_hash TEXT NOT NULL, persona TEXT NOT NULL, verdict TEXT NOT NULL, score INTEGER NOT NULL, "
+            "highlights TEXT NOT NULL, ruleset_version TEXT, cached INTEGER NOT NULL, timings TEXT NOT NULL, prompt TEXT)"
+        )
+        # Index entries end with the rowid, so a verdict or persona filter walks
+        # its index already in id order and pages need no sort
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_created ON analysis_history(created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_verdict ON analysis_history(verdict)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_persona ON analysis_history(persona)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_prompt ON analysis_history(prompt_hash)")
+        return conn
+
+    # --- writing ---
+
+    def _ensure_started(self) -> None:
+        # Started lazily, and again after a fork, so each serving process owns its writer
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_max)
+            self._reader = None
+            self._read_lock = threading.Lock()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name="history-writer", daemon=True)
+            self._thread.start()
+            ready.wait(5)
+            self._pid = os.getpid()
+
+    def record(self, record: HistoryRecord) -> bool:
+        """Queue one record without blocking; False if it was dropped."""
+        self._ensure_started()
+        if not self.store_prompts and record.prompt is not None:
+            record = record._replace(prompt=None)
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self, ready: threading.Event) -> None:
+        conn = self._connect()
+        ready.set()
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            batch: t.List[HistoryRecord] = []
+            if first is None:
+                stopping = True
+            else:
+                batch.append(first)
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._write(conn, batch)
+            for _ in range(len(batch) + stopping):
+                self._queue.task_done()
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: t.List[HistoryRecord]) -> None:
+        rows = [
+            (r.created_at, r.endpoint, r.prompt_hash, r.persona, r.verdict, r.score,
+             json.dumps(r.highlights), r.ruleset_version, int(r.cached), json.dumps(r.timings), r.prompt)
+            for r in batch
+        ]
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(f"INSERT INTO analysis_history ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.errors += len(batch)
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every queued record is written (for tests and shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return not self._queue.unfinished_tasks
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+    # --- reading ---
+
+    def _read(self, sql: str, params: t.Sequence[t.Any]) -> t.List[sqlite3.Row]:
+        self._ensure_started()
+        with self._read_lock:
+            if self._reader is None:
+                self._reader = self._connect()
+                self._reader.row_factory = sqlite3.Row
+            return self._reader.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _where(verdict: t.Optional[str] = None, persona: t.Optional[str] = None, since: t.Optional[float] = None, until: t.Optional[float] = None) -> t.Tuple[t.List[str], t.List[t.Any]]:
+        clauses, params = [], []
+        for column, value in (("verdict", verdict), ("persona", persona)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return clauses, params
+
+    def query(self, limit: int = 50, before: t.Optional[int] = None, verdict: t.Optional[str] = None, persona: t.Optional[str] = None, since: t.Optional[float] = None, until: t.Optional[float] = None) -> dict:
+        """
+        Newest first. Pages are keyed on id: pass the returned `next_before`
+        as `before` for the next page (stable while new records arrive).
+        """
+        limit = max(1, min(limit, HISTORY_MAX_PAGE))
+        clauses, params = self._where(verdict, persona, since, until)
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._read(f"SELECT * FROM analysis_history {where} ORDER BY id DESC LIMIT ?", params + [limit + 1])
+        items = [self._item(row) for row in rows[:limit]]
+        return {"items": items, "next_before": items[-1]["id"] if len(rows) > limit else None}
+
+    def export(self, since: t.Optional[float] = None, until: t.Optional[float] = None, verdict: t.Optional[str] = None, persona: t.Optional[str] = None, chunk: int = HISTORY_EXPORT_CHUNK) -> t.Iterator[dict]:
+        """
+        Oldest first, lazily, `chunk` rows at a time, so memory stays flat
+        however many rows match. Walks the id index by keyset (`id > last`)
+        instead of holding one cursor open: each chunk is its own short read,
+        so a slow download never pins the WAL. Rows written after the export
+        starts are left out.
+        """
+        clauses, params = self._where(verdict, persona, since, until)
+        newest = self._read("SELECT MAX(id) AS id FROM analysis_history", ())[0]["id"]
+        if newest is None:
+            return
+        clauses.append("id > ? AND id <= ?")
+        where = f"WHERE {' AND '.join(clauses)}"
+        last = 0
+        while True:
+            rows = self._read(f"SELECT * FROM analysis_history {where} ORDER BY id LIMIT ?", params + [last, newest, chunk])
+            for row in rows:
+                yield self._item(row)
+            if len(rows) < chunk:
+                return
+            last = rows[-1]["id"]
+
+    @staticmethod
+    def _item(row: sqlite3.Row) -> dict:
+        item = dict(row)
+        item["highlights"] = json.loads(item["highlights"])
+        item["timings"] = json.loads(item["timings"])
+        item["cached"] = bool(item["cached"])
+        return item
+
+    def aggregates(self, since: t.Optional[float] = None, until: t.Optional[float] = None, bucket: str = "hour", persona: t.Optional[str] = None) -> dict:
+        """Totals by verdict and persona plus a per-bucket verdict series."""
+        clauses, params = self._where(persona=persona, since=since, until=until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        size = BUCKETS[bucket]
+        by_verdict = self._read(f"SELECT verdict, COUNT(*) AS n, AVG(score) AS avg_score FROM analysis_history {where} GROUP BY verdict", params)
+        by_persona = self._read(f"SELECT persona, verdict, COUNT(*) AS n FROM analysis_history {where} GROUP BY persona, verdict", params)
+        series = self._read(
+            f"SELECT CAST(created_at / ? AS INTEGER) * ? AS bucket, verdict, COUNT(*) AS n FROM analysis_history {where} "
+            "GROUP BY bucket, verdict ORDER BY bucket", [size, size] + params,
+        )
+        total = sum(r["n"] for r in by_verdict)
+        personas: t.Dict[str, t.Dict[str, int]] = {}
+        for r in by_persona:
+            personas.setdefault(r["persona"], {})[r["verdict"]] = r["n"]
+        buckets: t.Dict[int, t.Dict[str, int]] = {}
+        for r in series:
+            buckets.setdefault(r["bucket"], {})[r["verdict"]] = r["n"]
+        return {
+            "total": total,
+            "by_verdict": {r["verdict"]: r["n"] for r in by_verdict},
+            "avg_score": round(sum(r["avg_score"] * r["n"] for r in by_verdict) / total, 2) if total else None,
+            "by_persona": personas,
+            "bucket": bucket,
+            "series": [{"bucket": b, **counts} for b, counts in buckets.items()],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "batches": self.batches,
+            "queued": self._queue.qsize() if self._pid == os.getpid() else 0,
+        }
+
+
+def _csv_row(item: dict) -> list:
+    row = dict(item)
+    row["created_at_iso"] = datetime.fromtimestamp(item["created_at"], timezone.utc).isoformat()
+    row["cached"] = "true" if item["cached"] else "false"
+    row["highlight_count"] = len(item["highlights"])
+    row["highlights"] = json.dumps(item["highlights"], ensure_ascii=False)
+    row["timings"] = json.dumps(item["timings"])
+    return ["" if row[c] is None else row[c] for c in EXPORT_COLUMNS]
+
+
+def encode_export(items: t.Iterable[dict], fmt: str = "ndjson", compress: bool = False, flush_bytes: int = EXPORT_FLUSH_BYTES) -> t.Iterator[bytes]:
+    """
+    Encode history items as NDJSON or CSV (header first), optionally gzipped,
+    yielding bytes as soon as about `flush_bytes` is ready. The CSV header
+    goes out before the first row is read, so downloads start at once.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+
+    def out(text: str, final: bool = False) -> bytes:
+        data = text.encode("utf-8")
+        if gz is None:
+            return data
+        # Sync flush so every piece is decodable as it arrives
+        return gz.compress(data) + gz.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if fmt == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+        yield out(buf.getvalue())
+        buf.seek(0)
+        buf.truncate()
+    for item in items:
+        if fmt == "csv":
+            writer.writerow(_csv_row(item))
+        else:
+            buf.write(json.dumps(item, ensure_ascii=False) + "\n")
+        if buf.tell() >= flush_bytes:
+            yield out(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell() or gz is not None:
+        yield out(buf.getvalue(), final=True)
+
+
+def build_history(kind: str = HISTORY_BACKEND) -> t.Optional[HistoryStore]:
+    if (kind or "off").lower() == "sqlite":
+        return HistoryStore()
+    return None
@@ -0,0 +1,136 @@
+# jobs.py - Background jobs for deferred LLM rewrites
+import time
+import uuid
+import asyncio
+import threading
+import typing as t
+from collections import OrderedDict
+
+from .utils import get_env
+
+REWRITE_JOB_TTL_SECONDS = float(get_env("REWRITE_JOB_TTL_SECONDS", "600"))
+REWRITE_JOB_MAX = int(get_env("REWRITE_JOB_MAX", "10000"))
+REWRITE_WORKERS = int(get_env("REWRITE_WORKERS", "8"))
+
+PENDING, DONE, FAILED = "pending", "done", "error"
+
+
+class RewriteJob:
+    def __init__(self, key: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = PENDING
+        self.result: t.Optional[str] = None
+        self.error: t.Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: t.Optional[float] = None
+        self._waiters: t.List[t.Callable[[], None]] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "suggested_rewrite": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class RewriteJobStore:
+    """
+    Runs rewrite coroutines in the background with bounded concurrency and
+    keeps their results for a while so clients can fetch them later.
+    Submitting the same key while a job is pending returns that job. Waiters
+    may sit on any event loop; completion wakes them thread-safely.
+    """
+
+    def __init__(self, ttl: float = REWRITE_JOB_TTL_SECONDS, max_jobs: int = REWRITE_JOB_MAX, workers: int = REWRITE_WORKERS):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.workers = workers
+        self._jobs: "OrderedDict[str, RewriteJob]" = OrderedDict()
+        self._pending: t.Dict[str, RewriteJob] = {}
+        self._lock = threading.Lock()
+        self._tasks: t.Set[asyncio.Task] = set()
+        self._semaphore: t.Optional[asyncio.Semaphore] = None
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._loop = loop
+        return self._semaphore
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.status == PENDING or (job.created_at > cutoff and len(self._jobs) <= self.max_jobs):
+                break
+            del self._jobs[job.id]
+
+    def submit(self, key: str, work: t.Callable[[], t.Awaitable[str]], on_done: t.Optional[t.Callable[[str], None]] = None) -> RewriteJob:
+        """Schedule `work()` on the running loop unless a job for `key` is pending."""
+        with self._lock:
+            job = self._pending.get(key)
+            if job is not None:
+                return job
+            self._expire()
+            job = RewriteJob(key)
+            self._jobs[job.id] = job
+            self._pending[key] = job
+        task = asyncio.get_running_loop().create_task(self._run(job, work, on_done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: RewriteJob, work: t.Callable[[], t.Awaitable[str]], on_done: t.Optional[t.Callable[[str], None]]) -> None:
+        try:
+            async with self._get_semaphore():
+                result = await work()
+            if on_done is not None:
+                on_done(result)
+            self._finish(job, DONE, result=result)
+        except Exception as e:
+            self._finish(job, FAILED, error=f"{type(e).__name__}: {e}")
+
+    def _finish(self, job: RewriteJob, status: str, result: t.Optional[str] = None, error: t.Optional[str] = None) -> None:
+        with self._lock:
+            job.result, job.error, job.status = result, error, status
+            job.finished_at = time.time()
+            self._pending.pop(job.key, None)
+            waiters, job._waiters = job._waiters, []
+        for wake in waiters:
+            wake()
+
+    def get(self, job_id: str) -> t.Optional[RewriteJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    async def wait(self, job: RewriteJob, timeout: float) -> RewriteJob:
+        """Return once the job finished or `timeout` seconds passed."""
+        if job.status != PENDING or timeout <= 0:
+            return job
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+        with self._lock:
+            if job.status != PENDING:
+                return job
+            job._waiters.append(wake)
+        try:
+            await asyncio.wait_for(done, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if wake in job._waiters:
+                    job._waiters.remove(wake)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"jobs": len(self._jobs), "pending": len(self._pending)}
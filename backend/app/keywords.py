@@ -0,0 +1,127 @@
+# keywords.py - Aho-Corasick multi-keyword matcher for slang, profanity and COSTAR lists
+import typing as t
+from collections import deque
+
+
+class KeywordEntry(t.NamedTuple):
+    keyword: str
+    category: str
+    # Opaque payload handed back with every hit (e.g. a COSTAR rule index)
+    value: t.Any = None
+    # Require a non-word character (or text edge) before / after the keyword, like regex \b
+    left_boundary: bool = False
+    right_boundary: bool = False
+
+
+class KeywordHit(t.NamedTuple):
+    category: str
+    keyword: str
+    value: t.Any
+    start: int
+    end: int
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def fold(text: str) -> t.Tuple[str, t.Optional[t.List[int]]]:
+    """
+    Lowercase `text` for matching. If lowering changes the length (e.g. "İ"
+    becomes "i" + combining dot) also return a map from each lowered index
+    back to its index in `text`; otherwise the map is None.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered, None
+    return lowered, [i for i, ch in enumerate(text) for _ in ch.lower()]
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over every keyword list, built once and then
+    matched against a prompt in a single left-to-right pass. Matching is
+    case-insensitive; every hit is reported with its position, overlapping
+    hits included. Transitions are precomputed into a DFA so each input
+    character costs one dict lookup.
+    """
+
+    def __init__(self, entries: t.Iterable[KeywordEntry]):
+        self.entries: t.List[KeywordEntry] = [e._replace(keyword=e.keyword.lower()) for e in entries if e.keyword]
+        self._delta: t.List[t.Dict[str, int]] = [{}]
+        self._out: t.List[t.Tuple[int, ...]] = [()]
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _build(self) -> None:
+        goto = self._delta
+        out: t.List[t.List[int]] = [[]]
+        for idx, entry in enumerate(self.entries):
+            state = 0
+            for ch in entry.keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(idx)
+
+        # Breadth-first: fail links, merged outputs, then fill in the DFA
+        # transitions each state inherits from its fail state
+        fail = [0] * len(goto)
+        queue = deque()
+        for ch, nxt in goto[0].items():
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            out[state].extend(out[fail[state]])
+            inherited = goto[fail[state]] if state else {}
+            for ch, nxt in list(goto[state].items()):
+                queue.append(nxt)
+                f = fail[state]
+                fail[nxt] = goto[f].get(ch, 0) if state else 0
+                if fail[nxt] == nxt:
+                    fail[nxt] = 0
+            for ch, nxt in inherited.items():
+                goto[state].setdefault(ch, nxt)
+        self._out = [tuple(o) for o in out]
+
+    def _boundary_ok(self, entry: KeywordEntry, text: str, start: int, end: int) -> bool:
+        if entry.left_boundary and start > 0 and _is_word(text[start - 1]):
+            return False
+        if entry.right_boundary and end < len(text) and _is_word(text[end]):
+            return False
+        return True
+
+    def scan(self, text: str, offset: int = 0, original_boundaries: bool = False) -> t.List[KeywordHit]:
+        """
+        All hits in `text`, sorted by start position. Word boundaries are
+        judged on the lowercased text, like a regex run over text.lower();
+        pass original_boundaries=True to judge them on `text` instead, like
+        a re.I regex over the original.
+        """
+        hits: t.List[KeywordHit] = []
+        delta, out, entries = self._delta, self._out, self.entries
+        folded, index = fold(text)
+        state = 0
+        for i, ch in enumerate(folded):
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                end = i + 1
+                for idx in out[state]:
+                    entry = entries[idx]
+                    start = end - len(entry.keyword)
+                    if index is None:
+                        s, e = start, end
+                        ok = self._boundary_ok(entry, text, s, e)
+                    else:
+                        s, e = index[start], index[end - 1] + 1
+                        ok = self._boundary_ok(entry, text, s, e) if original_boundaries else self._boundary_ok(entry, folded, start, end)
+                    if ok:
+                        hits.append(KeywordHit(entry.category, entry.keyword, entry.value, s + offset, e + offset))
+        hits.sort(key=lambda h: (h.start, h.end))
+        return hits
@@ -1,157 +1,186 @@
-import os
 import json
-from typing import Any, Dict
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 
-import requests
+import httpx
 
 from .utils import get_env
-from .rules_prompt import RULE_ENGINE_SYSTEM_PROMPT
+from .metrics import LLM_COALESCED_TOTAL
+from .gateway import GATEWAY, LLMGateway
 
-GEMINI_API_KEY = get_env("GEMINI_API_KEY")
-GEMINI_API_URL = get_env(
-    "GEMINI_API_URL",
-    "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent",
-)
+# Connection pool / timeout settings for every LLM call (see providers.py)
+LLM_TIMEOUT = float(get_env("LLM_TIMEOUT", "20"))
+LLM_CONNECT_TIMEOUT = float(get_env("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(get_env("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE = int(get_env("LLM_MAX_KEEPALIVE", "16"))
+LLM_KEEPALIVE_EXPIRY = float(get_env("LLM_KEEPALIVE_EXPIRY", "60"))
+# Share one upstream request between concurrent identical calls
+LLM_COALESCE = get_env("LLM_COALESCE", "true").lower() in ("1", "true", "yes")
 
 
-def _call_external_llm(payload: Dict[str, Any], is_rule_engine: bool = False) -> Dict[str, Any]:
+class SingleFlight:
     """
-    Generic HTTP POST to Gemini API.
-    Stub mode returns canned JSON if API key is missing.
+    Collapses concurrent calls with the same key into one: the first caller
+    starts the work, later callers await the same task and get its result
+    (or exception). The task is shielded, so a caller that gives up does
+    not cancel it for the others. Results are shared objects; treat them
+    as read-only.
     """
-    if not GEMINI_API_KEY or "REPLACE" in (GEMINI_API_KEY or ""):
-        # Stub mode for development
-        if is_rule_engine:
-            return {
-                "candidates": [{
-                    "content": {
-                        "parts": [{
-                            "text": json.dumps({
-                                "verdict": "ALLOW",
-                                "reasons": ["stubbed - no API key"],
-                                "costar": {
-                                    "Context": "Development testing",
-                                    "Objective": "Verify system functionality",
-                                    "Style": "Professional",
-                                    "Tone": "Neutral",
-                                    "Audience": "Developer",
-                                    "Response": "Test response"
-                                },
-                                "sanitized_prompt": "Explain the concept of artificial intelligence."
-                            })
-                        }]
-                    }
-                }]
-            }
-        else:
-            return {
-                "candidates": [{
-                    "content": {
-                        "parts": [{
-                            "text": "This is a stub response since no API key was provided."
-                        }]
-                    }
-                }]
-            }
-
-    headers = {"Content-Type": "application/json"}
-    
-    # Gemini API uses key as query parameter
-    url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
-    
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=30)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        if is_rule_engine:
-            # Return a safe fallback for rule engine
-            return {
-                "candidates": [{
-                    "content": {
-                        "parts": [{
-                            "text": json.dumps({
-                                "verdict": "NEEDS_FIX",
-                                "reasons": [f"API call failed: {str(e)}"],
-                                "costar": {},
-                                "sanitized_prompt": ""
-                            })
-                        }]
-                    }
-                }]
-            }
-        raise e
-
-def run_rule_check(user_prompt: str) -> Dict[str, Any]:
-    """
-    Send the rule-engine prompt to Gemini and parse JSON response.
-    """
-    combined_prompt = RULE_ENGINE_SYSTEM_PROMPT + "\n\nUser prompt:\n" + user_prompt
-
-    payload = {
-        "contents": [{
-            "parts": [{"text": combined_prompt}]
-        }],
-        "generationConfig": {
-            "temperature": 0.0,
-            "maxOutputTokens": 512
-        }
-    }
-
-    raw = _call_external_llm(payload, is_rule_engine=True)
-    text = _extract_text_from_response(raw)
-
-    try:
-        # Find JSON in the response
-        start = text.find("{")
-        end = text.rfind("}") + 1
-        if start >= 0 and end > start:
-            json_text = text[start:end]
-            parsed = json.loads(json_text)
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        slot = (loop, key)
+        task = self._calls.get(slot)
+        if task is None:
+            task = loop.create_task(fn())
+            self._calls[slot] = task
+            task.add_done_callback(lambda done: self._done(slot, done))
         else:
-            raise ValueError("No JSON found in response")
-    except Exception as e:
-        parsed = {
-            "verdict": "NEEDS_FIX",
-            "reasons": [f"Failed to parse LLM output: {str(e)}"],
-            "costar": {},
-            "sanitized_prompt": user_prompt
-        }
-
-    parsed["verdict"] = parsed.get("verdict", "NEEDS_FIX").upper()
-    return parsed
-
-def run_inference(sanitized_prompt: str) -> str:
-    """
-    Forward sanitized prompt to Gemini to get final answer.
-    """
-    payload = {
-        "contents": [{
-            "parts": [{"text": sanitized_prompt}]
-        }],
-        "generationConfig": {
-            "temperature": 0.7,
-            "maxOutputTokens": 800
-        }
-    }
-
-    raw = _call_external_llm(payload)
-    return _extract_text_from_response(raw)
-
-def _extract_text_from_response(raw: Dict[str, Any]) -> str:
+            LLM_COALESCED_TOTAL.inc(client=self.name)
+        return await asyncio.shield(task)
+
+    def _done(self, slot: Tuple[asyncio.AbstractEventLoop, str], task: asyncio.Task) -> None:
+        self._calls.pop(slot, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller gave up
+
+
+def request_key(url: str, payload: Dict[str, Any]) -> str:
+    """Identity of an upstream call: endpoint (which names the model) plus the full body."""
+    raw = json.dumps([url, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AsyncLLMClient:
     """
-    Parse Gemini response to extract text.
+    Async HTTP client for the LLM API with a persistent, size-limited pool.
+    Connections are kept alive between calls so each request skips the
+    TCP+TLS handshake. The pool is bound to the event loop it was created in.
     """
-    try:
-        # Standard Gemini response format
-        if "candidates" in raw and raw["candidates"]:
-            candidate = raw["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                if parts and "text" in parts[0]:
-                    return parts[0]["text"]
-        
-        # Fallback: return the whole response as string
-        return json.dumps(raw)
-    except Exception as e:
-        return f"Error extracting text: {str(e)}"
\ No newline at end of file
+
+    def __init__(
+        self,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive: int = LLM_MAX_KEEPALIVE,
+        keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+        timeout: float = LLM_TIMEOUT,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        coalesce: bool = LLM_COALESCE,
+        gateway: Optional[LLMGateway] = None,
+    ):
+        self.transport = transport
+        self.coalesce = coalesce
+        self.gateway = gateway
+        self._inflight = SingleFlight("async_client")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        return httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # A pool cannot be shared across event loops (e.g. test clients)
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self._timeout(None), transport=self.transport)
+            self._loop = loop
+        return self._client
+
+    async def post_json(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        POST a JSON payload and return the decoded JSON response. Identical
+        concurrent calls (same url and payload) share one upstream request.
+        """
+        if not self.coalesce:
+            return await self._gated_post_json(url, payload, headers, timeout)
+        return await self._inflight.do(request_key(url, payload), lambda: self._gated_post_json(url, payload, headers, timeout))
+
+    async def _gated_post_json(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        timeout: Optional[float],
+    ) -> Dict[str, Any]:
+        if self.gateway is None:
+            return await self._post_json(url, payload, headers, timeout)
+        return await self.gateway.call(lambda: self._post_json(url, payload, headers, timeout))
+
+    async def _post_json(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        timeout: Optional[float],
+    ) -> Dict[str, Any]:
+        client = self._get_client()
+        resp = await client.post(url, json=payload, headers=headers, timeout=self._timeout(timeout))
+        resp.raise_for_status()
+        return resp.json()
+
+    async def stream_sse(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """POST a JSON payload and yield each JSON object from a `data:` SSE line."""
+        if self.gateway is None:
+            async for data in self._stream_sse(url, payload, headers, timeout):
+                yield data
+            return
+        # Streams are admitted and accounted like any call, but never retried;
+        # their latency is time to first chunk, not how long the reader takes
+        async with self.gateway.guard() as attempt:
+            async for data in self._stream_sse(url, payload, headers, timeout):
+                attempt.first_byte()
+                yield data
+
+    async def _stream_sse(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        timeout: Optional[float],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        client = self._get_client()
+        async with client.stream("POST", url, json=payload, headers=headers, timeout=self._timeout(timeout)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data and data != "[DONE]":
+                    yield json.loads(data)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+
+ASYNC_CLIENT = AsyncLLMClient(gateway=GATEWAY)
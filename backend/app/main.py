@@ -1,66 +1,101 @@
 # main.py - Comprehensive Prompt Review Engine Backend
 import os
 import re
+import hmac
+import codecs
+import hashlib
 import json
 import time
+import asyncio
 import typing as t
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
+from .llm_client import ASYNC_CLIENT
+from .gateway import GATEWAY
+from .providers import PROVIDER, USE_STUB, Budget, gemini_configured, stub_llm_response
+from .providers import generate as llm_generate, stream as llm_stream
+from .tokens import fit_to_budget, tokens_for_chars
+from .detectors import DetectorEngine, ScanResult, StreamScanner, active_engine, scan_prompt
+from .ruleset import RULESETS
+from . import workers
+from .cache import build_cache, cache_key
+from .jobs import PENDING, RewriteJobStore
+from .sessions import Edit, SessionStore
+from .ws import Multiplexer
+from .detect_pool import DETECT_POOL
+from .classifier import CLASSIFIER
+from .history import BUCKETS, EXPORT_FORMATS, HISTORY_MAX_PAGE, HistoryRecord, build_history, encode_export, prompt_hash
+from .metrics import (
+    REGISTRY,
+    STAGE_SECONDS,
+    CallbackMetric,
+    MetricsMiddleware,
+    record_verdict,
+)
+
 # Load environment variables
 load_dotenv()
 
 # --- Config from env ---
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash")
-GEMINI_ENDPOINT = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent")
-USE_STUB = os.getenv("USE_STUB", "false").lower() in ("1", "true", "yes")
-
-# Simple slang and suspicious patterns (extend for hackathon)
-COMMON_SLANG = {"oi", "bruh", "wtf", "wanna", "gonna", "sus", "lol", "yeet", "slay", "fire", "bet", "fuck", "fucking", "shit", "damn"}
-# a few Kannada Unicode words example: (you can extend)
-KANNADA_UNICODE_REGEX = re.compile(r"[\u0C80-\u0CFF]")
-
-# Prompt injection patterns (simple heuristics)
-INJECTION_PATTERNS = [
-    r"ignore (the )?above",
-    r"ignore previous instructions",
-    r"disregard.*above",
-    r"follow only the instructions below",
-    r"override system prompt",
-    r"do anything now",
-    r"jailbreak",
-    r"pretend you are",
-    r"act as if you are not an ai",
-]
-
-# Explicit content patterns (strict filtering)
-EXPLICIT_PATTERNS = [
-    r"\bf+u+c+k+\b",
-    r"\bs+e+x+\b", 
-    r"\bp+o+r+n+\b",
-    r"\bn+u+d+e+\b",
-    r"\bg+i+r+l+s?\s+.*(hard|fuck|sex)",
-    r"hard.*fuck.*with.*\d+.*girls?",
-    r"\b(sexual|erotic|xxx|adult)\b",
-    r"\b(prostitut|escort|hookup)\b",
-    r"\b(masturbat|orgasm|climax)\b",
-    r"\b(penis|vagina|breast|ass|dick|cock|pussy)\b",
-    r"want.*to.*(fuck|have sex|sleep with)",
-    r"looking for.*(sex|hookup|adult fun)",
-]
-
-# Violent/harmful content patterns
-HARMFUL_PATTERNS = [
-    r"\b(kill|murder|suicide|self.?harm)\b",
-    r"\b(bomb|explosive|weapon|gun)\b",
-    r"\b(drug|cocaine|heroin|meth)\b",
-    r"how to (hurt|harm|attack|assault)",
-    r"ways to (die|kill|harm)",
-]
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Upper bound for GET /api/rewrite/{job_id}?wait=
+REWRITE_MAX_WAIT = float(os.getenv("REWRITE_MAX_WAIT", "30"))
+# LLM rewrites longer than this are discarded for the local one
+REWRITE_MAX_CHARS = 200
+# Input budget for the user prompt quoted in the rewrite instruction
+REWRITE_INPUT_TOKENS = int(os.getenv("REWRITE_INPUT_TOKENS", "1024"))
+# Largest request body /api/analyze/stream accepts
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(50 * 1024 * 1024)))
+# Required in X-Admin-Token for /api/admin/*; admin endpoints are off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Verdict cache for repeated prompts (CACHE_BACKEND=memory|sqlite|off)
+VERDICT_CACHE = build_cache()
+for _stat, _type in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("entries", "gauge"), ("bytes", "gauge")):
+    REGISTRY.register(CallbackMetric(
+        f"prompt_review_cache_{_stat}" + ("_total" if _type == "counter" else ""),
+        f"Verdict cache {_stat}",
+        lambda _stat=_stat: VERDICT_CACHE.stats().get(_stat, 0),
+        type=_type,
+    ))
+
+# Every analysis is appended here by a background writer (HISTORY_BACKEND=sqlite|off)
+HISTORY = build_history()
+if HISTORY is not None:
+    for _stat in ("written", "dropped"):
+        REGISTRY.register(CallbackMetric(
+            f"prompt_review_history_{_stat}_total", f"Analysis history records {_stat}",
+            lambda _stat=_stat: HISTORY.stats()[_stat], type="counter",
+        ))
+
+# LLM rewrites deferred by /api/analyze (options.defer_rewrite)
+REWRITE_JOBS = RewriteJobStore()
+REGISTRY.register(CallbackMetric(
+    "prompt_review_rewrite_jobs_pending", "Deferred rewrite jobs not finished yet",
+    lambda: REWRITE_JOBS.stats()["pending"],
+))
+# Edit sessions for /api/analyze/session (incremental re-analysis while typing)
+SESSIONS = SessionStore()
+REGISTRY.register(CallbackMetric(
+    "prompt_review_edit_sessions", "Open incremental analysis sessions",
+    lambda: SESSIONS.stats()["sessions"],
+))
+# CLASSIFIER_MODE=hybrid sends uncertain local verdicts to the LLM rule check
+for _stat in ("decisions", "escalated", "overridden", "failed"):
+    REGISTRY.register(CallbackMetric(
+        f"prompt_review_classifier_{_stat}_total", f"Verdict decisions {_stat} (tiered classifier)",
+        lambda _stat=_stat: CLASSIFIER.stats()[_stat], type="counter",
+    ))
+REGISTRY.register(CallbackMetric(
+    "prompt_review_classifier_escalation_ratio", "Share of verdicts escalated to the LLM rule check",
+    lambda: CLASSIFIER.stats()["escalation_rate"],
+))
 
 app = FastAPI(title="Prompt Review Engine - Backend")
 
@@ -72,6 +107,7 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # --- Pydantic models ---
 class AnalyzeRequest(BaseModel):
@@ -86,6 +122,59 @@ class AnalyzeResponse(BaseModel):
     highlights: t.List[dict]
     suggested_rewrite: str
     reasons: t.List[str]
+    ruleset_version: t.Optional[str] = None
+    # Set when the LLM rewrite was deferred; fetch it from /api/rewrite/{id}
+    rewrite_job: t.Optional[str] = None
+    # Regex detection hit DETECT_BUDGET_MS; some rules did not run
+    detection_truncated: bool = False
+    # Detection stopped once the verdict was decided (options.detail="full" runs every rule)
+    early_exit: bool = False
+    # Fields built from that partial scan: what was found, not everything there is
+    partial: t.List[str] = []
+    # "llm" when the local verdict was unsure and the LLM rule check decided (CLASSIFIER_MODE=hybrid)
+    classified_by: str = "local"
+
+class StreamAnalyzeResponse(AnalyzeResponse):
+    # early_exit here means a blocking match ended the scan before the whole body was read
+    chars_scanned: int
+
+class SessionOpenRequest(BaseModel):
+    prompt: str
+    persona: t.Optional[str] = "Professor"
+    # Build suggested_rewrite (a pass over the whole prompt); off while typing
+    rewrite: bool = False
+
+class SessionEdit(BaseModel):
+    offset: int
+    delete: int = 0
+    insert: str = ""
+
+class SessionEditRequest(BaseModel):
+    # The revision the edits were made against (from the last response)
+    revision: int
+    edits: t.List[SessionEdit]
+    rewrite: bool = False
+
+class SessionAnalyzeResponse(AnalyzeResponse):
+    session_id: str
+    revision: int
+    # Characters the detectors read for this request (the whole prompt when the session opened)
+    chars_scanned: int
+
+class BatchAnalyzeRequest(BaseModel):
+    items: t.List[AnalyzeRequest]
+    max_concurrency: t.Optional[int] = None  # capped at BATCH_CONCURRENCY
+
+class BatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    result: t.Optional[AnalyzeResponse] = None
+    error: t.Optional[str] = None
+
+class BatchAnalyzeResponse(BaseModel):
+    results: t.List[BatchItemResult]
+    unique_prompts: int
+    cache_hits: int
 
 class ChatRequest(BaseModel):
     prompt: str
@@ -99,97 +188,58 @@ class ChatResponse(BaseModel):
 
 # --- Helper utilities ---
 
-def detect_mixed_language(text: str) -> dict:
+def detect_mixed_language(text: str, scan: t.Optional[ScanResult] = None) -> dict:
     """Detect presence of Kannada (unicode) and return flags."""
-    has_kannada = bool(KANNADA_UNICODE_REGEX.search(text))
+    if scan is None:
+        scan = scan_prompt(text)
     # naive transliteration detection: presence of common transliterated tokens like 'nanna','nimm' etc could be added
-    return {"has_kannada": has_kannada}
+    return {"has_kannada": scan.has_kannada}
 
-def detect_slang_and_ambiguity(text: str) -> t.List[dict]:
-    words = re.findall(r"\b\w+\b", text.lower())
+def detect_slang_and_ambiguity(text: str, scan: t.Optional[ScanResult] = None) -> t.List[dict]:
+    if scan is None:
+        scan = scan_prompt(text)
     findings = []
-    for w in words:
-        if w in COMMON_SLANG:
-            findings.append({"type":"slang","token":w,"reason":"inappropriate_language"})
-    
-    # Check for explicit content
-    for pattern in EXPLICIT_PATTERNS:
-        if re.search(pattern, text, re.I):
-            findings.append({"type":"explicit","token":"[BLOCKED]","reason":"sexual_or_explicit_content"})
-    
-    # Check for harmful content
-    for pattern in HARMFUL_PATTERNS:
-        if re.search(pattern, text, re.I):
-            findings.append({"type":"harmful","token":"[BLOCKED]","reason":"violent_or_harmful_content"})
-    
+    for m in scan.by_category("slang"):
+        findings.append({"type":"slang","token":m.text.lower(),"reason":"inappropriate_language"})
+    # explicit and harmful content is reported once per matching pattern
+    for m in scan.by_category("explicit"):
+        findings.append({"type":"explicit","token":"[BLOCKED]","reason":"sexual_or_explicit_content"})
+    for m in scan.by_category("harmful"):
+        findings.append({"type":"harmful","token":"[BLOCKED]","reason":"violent_or_harmful_content"})
     # double-meaning heuristics: presence of "hack" + "how to" etc.
-    if re.search(r"\bhack\b", text, re.I):
+    if scan.has("risky"):
         findings.append({"type":"risky","token":"hack","reason":"potential_illicit_intent"})
     # ambiguous question like "is it ok to..." - low confidence marker
-    if re.search(r"\bis it ok to\b", text, re.I):
+    if scan.has("ambiguous"):
         findings.append({"type":"ambiguous","token":"is it ok to","reason":"ambiguous_intent"})
-    
     return findings
 
-def detect_injection(text: str) -> t.List[dict]:
-    matches = []
-    for p in INJECTION_PATTERNS:
-        if re.search(p, text, re.I):
-            matches.append({"pattern":p, "match": re.search(p, text, re.I).group(0)})
+def detect_injection(text: str, scan: t.Optional[ScanResult] = None) -> t.List[dict]:
+    if scan is None:
+        scan = scan_prompt(text)
+    matches = [{"pattern": m.pattern, "match": m.text} for m in scan.by_category("injection")]
     # also detect overt system tokens like "<system>" or "SYSTEM:"
-    if re.search(r"<system>|system:", text, re.I):
+    if scan.has("system_token"):
         matches.append({"pattern":"system_token","match":"contains system token"})
     return matches
 
-def simple_costar_extract(text: str) -> dict:
+def simple_costar_extract(text: str, scan: t.Optional[ScanResult] = None) -> dict:
     # Very light heuristics; for hackathon this is acceptable. You can improve with an LLM call.
-    lower = text.lower()
-    context = ""
-    objective = ""
-    style = ""
-    tone = ""
-    audience = ""
-    response = ""
-
-    # Context: keywords
-    if "ai" in lower or "artificial intelligence" in lower or "machine learning" in lower:
-        context = "AI"
-    if "wifi" in lower or "wi-fi" in lower or "network" in lower:
-        context = (context + ", Network").strip(", ")
-
-    # Objective
-    if re.search(r"\bexplain|describe|what is\b", lower):
-        objective = "Explain"
-    if re.search(r"\bgenerate|write|create|compose\b", lower):
-        objective = "Generate"
-
-    # Style & tone
-    if "tweet" in lower:
-        style = "Tweet-length"
-    if "funny" in lower or "humor" in lower or "joke" in lower:
-        tone = "Humorous"
-    if "formal" in lower or "professional" in lower:
-        tone = "Professional"
-    # Audience
-    if "students" in lower or "student" in lower:
-        audience = "Students"
-    if "twitter" in lower or "tweet" in lower:
-        audience = "Twitter readers"
-
-    # Response type
-    if re.search(r"\bcode\b|\bscript\b|\bprogram\b", lower):
-        response = "Code"
-    if re.search(r"\bsummary|summarize\b", lower):
-        response = "Summary"
+    # Keyword hits come from the same automaton pass that finds slang (see the "costar" rules in rules/default.json)
+    if scan is None:
+        scan = scan_prompt(text)
+    fields = scan.engine.extract_costar(scan)
+    objective = fields.get("Objective", "")
+    response = fields.get("Response", "")
     if response == "" and objective:
         response = objective
 
     return {
-        "Context": context or "None",
+        "Context": fields.get("Context") or "None",
         "Objective": objective or "None",
-        "Style": style or "None",
-        "Tone": tone or "None",
-        "Audience": audience or "General",
+        "Style": fields.get("Style") or "None",
+        "Tone": fields.get("Tone") or "None",
+        "Audience": fields.get("Audience") or "General",
         "Response": response or "Text"
     }
 
@@ -201,14 +251,13 @@ def compute_score(issues: int, costar: dict) -> int:
         score -= 5
     return max(0, min(100, score))
 
-def decide_verdict(issues_count: int, injection_found: bool, highlights: t.List[dict]) -> str:
+def decide_verdict(issues_count: int, scan: ScanResult, highlights: t.List[dict]) -> str:
     # Check for explicit or harmful content - always BLOCK
-    for highlight in highlights:
-        if highlight.get("type") in ["explicit", "harmful"]:
-            return "BLOCK"
-    
+    if scan.has("explicit", "harmful"):
+        return "BLOCK"
+
     # Check for injection attacks
-    if injection_found:
+    if scan.injection_found:
         return "BLOCK"
     
     # Check for multiple slang words - stricter enforcement
@@ -222,16 +271,13 @@ def decide_verdict(issues_count: int, injection_found: bool, highlights: t.List[
         return "NEEDS_FIX"
     return "BLOCK"
 
-def build_sanitized_rewrite(prompt: str, costar: dict, persona: str) -> str:
+def build_sanitized_rewrite(prompt: str, costar: dict, persona: str, scan: t.Optional[ScanResult] = None) -> str:
     # For inappropriate content, provide completely different professional prompts
     # Never try to sanitize explicit/harmful content - replace entirely
-    
-    # Check if original prompt contains explicit or harmful content
-    contains_explicit = any(re.search(pattern, prompt, re.I) for pattern in EXPLICIT_PATTERNS)
-    contains_harmful = any(re.search(pattern, prompt, re.I) for pattern in HARMFUL_PATTERNS)
-    contains_profanity = any(word in prompt.lower() for word in COMMON_SLANG if word in ['fuck', 'fucking', 'shit', 'damn'])
-    
-    if contains_explicit or contains_harmful or contains_profanity:
+    if scan is None:
+        scan = scan_prompt(prompt)
+
+    if scan.needs_replacement:
         # Return professional alternatives based on persona
         if persona == "Professor":
             return "Could you help me understand a complex topic in a clear and educational way?"
@@ -247,10 +293,8 @@ def build_sanitized_rewrite(prompt: str, costar: dict, persona: str) -> str:
     base = re.sub(r"\bcrack\b", "understand the security of", base, flags=re.I)
     base = re.sub(r"\bsteal\b", "learn about protecting", base, flags=re.I)
     
-    # Remove any remaining slang
-    for word in COMMON_SLANG:
-        if word not in ['fuck', 'fucking', 'shit', 'damn']:  # These should trigger full replacement above
-            base = re.sub(r"\b" + re.escape(word) + r"\b", "", base, flags=re.I)
+    # Remove any remaining slang (profanity triggers full replacement above)
+    base = scan.engine.strip_slang(base)
     
     # Clean up extra spaces
     base = re.sub(r'\s+', ' ', base).strip()
@@ -261,187 +305,87 @@ def build_sanitized_rewrite(prompt: str, costar: dict, persona: str) -> str:
     
     return base
 
-# --- Gemini client (simple wrapper) ---
-def call_gemini_generate(prompt: str, model: str = GEMINI_MODEL, max_tokens: int = 512) -> str:
-    """
-    Calls Google Generative Language API (Gemini) v1beta generateContent endpoint.
-    """
-    if USE_STUB or not GEMINI_API_KEY:
-        # Local stub
-        return stub_llm_response(prompt)
-    
-    # Build endpoint
-    endpoint = GEMINI_ENDPOINT
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": GEMINI_API_KEY
-    }
-    
-    body = {
-        "contents": [{
-            "parts": [{
-                "text": prompt
-            }]
-        }],
-        "generationConfig": {
-            "maxOutputTokens": max_tokens,
-            "temperature": 0.7
-        }
-    }
-    
-    try:
-        r = requests.post(endpoint, headers=headers, json=body, timeout=20)
-        r.raise_for_status()
-        data = r.json()
-        
-        # Extract response from Gemini API format
-        if "candidates" in data and data["candidates"]:
-            candidate = data["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                if parts and "text" in parts[0]:
-                    return parts[0]["text"]
-        
-        # Fallback
-        return json.dumps(data)[:2000]
-        
-    except Exception as e:
-        # fallback to stub
-        print("Gemini call failed:", str(e))
-        return stub_llm_response(prompt)
-
-def stub_llm_response(prompt: str) -> str:
-    # Intelligent stub responses based on content analysis
-    prompt_lower = prompt.lower()
-    
-    # Educational content
-    if any(term in prompt_lower for term in ['explain', 'teach', 'learn', 'understand', 'concept']):
-        if 'quantum' in prompt_lower and 'physics' in prompt_lower:
-            return """**Quantum Physics Simplified for High School Students**
-
-**What is Quantum Physics?**
-Quantum physics is the study of matter and energy at the tiniest scale - smaller than atoms! At this microscopic level, particles behave in strange and fascinating ways that are completely different from our everyday experience.
-
-**Key Concepts:**
-
-1. **Wave-Particle Duality**
-   - Light and particles can act like both waves and particles
-   - Think of it like a coin that's spinning - it's both heads AND tails until it lands
-
-2. **Uncertainty Principle** 
-   - We can't know both the exact position and speed of a particle at the same time
-   - It's like trying to photograph a hummingbird - the more precisely you capture its location, the blurrier its motion becomes
-
-3. **Quantum Superposition**
-   - Particles can exist in multiple states simultaneously
-   - Famous example: Schrödinger's cat being both alive and dead until observed
+# --- LLM calls (every one goes through the configured provider, see providers.py) ---
+async def call_gemini_generate(prompt: str, max_tokens: int = 512, timeout: t.Optional[float] = None) -> str:
+    """One completion from the configured provider; the stub answers if it fails."""
+    return await llm_generate(prompt, Budget(max_tokens=max_tokens, timeout=timeout))
 
-4. **Quantum Entanglement**
-   - Two particles can be mysteriously connected across vast distances
-   - Einstein called this "spooky action at a distance"
+async def stream_gemini_generate(prompt: str, max_tokens: int = 800, timeout: t.Optional[float] = None) -> t.AsyncIterator[str]:
+    """Streamed completion; falls back to the streamed stub if it fails before any text arrives."""
+    async for chunk in llm_stream(prompt, Budget(max_tokens=max_tokens, timeout=timeout)):
+        yield chunk
 
-**Why Does This Matter?**
-Quantum physics enables technologies like lasers, MRI machines, computer processors, and could lead to quantum computers that solve problems impossible for regular computers.
-
-**Analysis Reasoning:** This prompt was educational, appropriate, and requested clear explanations for students - exactly the type of content our system is designed to support and encourage."""
-
-        elif any(term in prompt_lower for term in ['ai', 'artificial intelligence', 'machine learning']):
-            return """**Artificial Intelligence Explained Simply**
-
-**What is AI?**
-Artificial Intelligence is technology that enables computers to perform tasks that typically require human intelligence, such as learning, reasoning, and problem-solving.
-
-**Key Types:**
-
-1. **Narrow AI** - Specialized for specific tasks (like chess, image recognition)
-2. **Machine Learning** - Systems that improve through experience
-3. **Deep Learning** - AI inspired by how human brains process information
-
-**Real-World Applications:**
-- Voice assistants (Siri, Alexa)
-- Recommendation systems (Netflix, YouTube)
-- Medical diagnosis assistance
-- Autonomous vehicles
-
-**Analysis Reasoning:** This educational request about AI concepts is appropriate and aligns with promoting understanding of important technologies."""
-
-    # Programming/coding requests
-    if any(term in prompt_lower for term in ['code', 'programming', 'software', 'algorithm']):
-        return """**Programming Concepts Explained**
-
-Programming is the art of giving computers step-by-step instructions to solve problems. Here are key concepts:
-
-**Fundamental Principles:**
-1. **Variables** - Storage containers for data
-2. **Functions** - Reusable blocks of code
-3. **Loops** - Repeating actions efficiently
-4. **Conditionals** - Making decisions in code
-
-**Best Practices:**
-- Write clean, readable code
-- Plan before you code
-- Test your programs thoroughly
-- Learn from errors and debugging
-
-**Analysis Reasoning:** Educational programming content promotes learning and skill development in technology."""
+# --- Pipeline endpoint implementations ---
 
-    # Professional communication
-    if any(term in prompt_lower for term in ['professional', 'business', 'email', 'communication']):
-        return """**Professional Communication Guidelines**
+class LocalAnalysis(t.NamedTuple):
+    """Everything analyze() computes without calling the LLM."""
+    scan: ScanResult
+    costar: dict
+    highlights: t.List[dict]
+    reasons: t.List[str]
+    score: int
+    verdict: str
+    detect_ms: float = 0.0
+    classified_by: str = "local"
 
-**Key Principles:**
-1. **Clarity** - Be clear and direct in your message
-2. **Courtesy** - Use polite and respectful language
-3. **Conciseness** - Keep messages focused and brief
-4. **Correctness** - Check grammar and factual accuracy
 
-**Structure for Professional Emails:**
-- Clear subject line
-- Polite greeting
-- Specific purpose/request
-- Next steps or timeline
-- Professional closing
+# options.detail: "verdict" stops detection once the verdict is decided,
+# "full" runs every rule so all highlights are reported
+DETAIL_LEVELS = ("verdict", "full")
+# Response fields that only cover what an early-exit scan got to
+EARLY_EXIT_PARTIAL = ["highlights", "reasons", "costar"]
 
-**Analysis Reasoning:** This request for professional communication guidance promotes workplace skills and appropriate conduct."""
 
-    # General educational response
-    return """**Educational Response**
+def parse_detail(options: t.Optional[dict]) -> str:
+    detail = (options or {}).get("detail", "verdict")
+    if detail not in DETAIL_LEVELS:
+        raise HTTPException(status_code=400, detail=f"options.detail must be one of {list(DETAIL_LEVELS)}")
+    return detail
 
-I'd be happy to help you learn! For the most comprehensive and accurate information on this topic, I recommend:
 
-**Learning Strategies:**
-1. Break complex topics into smaller parts
-2. Use multiple sources to verify information
-3. Apply concepts through practice and examples
-4. Ask specific questions for targeted learning
+def verdict_settled(scan: ScanResult) -> bool:
+    """True once no further match can change the verdict (BLOCK is final)."""
+    highlights, _ = build_highlights("", scan)
+    return decide_verdict(len(highlights), scan, highlights) == "BLOCK"
 
-**Quality Resources:**
-- Educational websites (.edu domains)
-- Peer-reviewed academic sources
-- Established educational institutions
-- Professional learning platforms
 
-**Analysis Reasoning:** This prompt requested educational content, which aligns with promoting learning and knowledge sharing - core values our system is designed to support."""
+def run_local_analysis(prompt: str, engine: t.Optional[DetectorEngine] = None, scan: t.Optional[ScanResult] = None, detail: str = "verdict") -> LocalAnalysis:
+    started = time.perf_counter()
+    with STAGE_SECONDS.time(stage="detect"):
+        # One pass of the detector patterns, cheapest first, stopping once the
+        # verdict is decided unless full detail was asked for; all later steps
+        # read from this result. Long prompts run in the detection process
+        # pool under a time budget (always every rule).
+        if scan is None:
+            scan = DETECT_POOL.scan(prompt, engine, verdict_settled if detail == "verdict" else None)
+        highlights, reasons = build_highlights(prompt, scan)
+    detect_ms = round((time.perf_counter() - started) * 1000, 3)
 
-# --- Pipeline endpoint implementations ---
-
-@app.post("/api/analyze", response_model=AnalyzeResponse)
-def analyze(req: AnalyzeRequest):
-    prompt = req.prompt or ""
-    persona = req.persona or "Professor"
+    # Step 4: costar extraction
+    with STAGE_SECONDS.time(stage="costar"):
+        costar = simple_costar_extract(prompt, scan)
 
+    # Score & verdict
+    with STAGE_SECONDS.time(stage="verdict"):
+        issues_count = len(highlights)
+        score = compute_score(issues_count, costar)
+        verdict = decide_verdict(issues_count, scan, highlights)
+        if scan.stopped_early:
+            # Only a BLOCK ends a scan early, and a score counted from the
+            # issues found so far would read as a real one
+            score = 0
+    return LocalAnalysis(scan, costar, highlights, reasons, score, verdict, detect_ms)
+
+
+def build_highlights(prompt: str, scan: ScanResult) -> t.Tuple[t.List[dict], t.List[str]]:
     # Step 1: language detection / mixed-language
-    lang_info = detect_mixed_language(prompt)
+    lang_info = detect_mixed_language(prompt, scan)
 
     # Step 2: slang & ambiguity detection
-    slang_hits = detect_slang_and_ambiguity(prompt)
+    slang_hits = detect_slang_and_ambiguity(prompt, scan)
 
     # Step 3: injection detection
-    injection_hits = detect_injection(prompt)
-    injection_found = len(injection_hits) > 0
-
-    # Step 4: costar extraction
-    costar = simple_costar_extract(prompt)
+    injection_hits = detect_injection(prompt, scan)
 
     # Step 5: build highlights & reasons
     highlights = []
@@ -458,80 +402,636 @@ def analyze(req: AnalyzeRequest):
         highlights.append({"type":"mixed_language","match":"kannada_unicode_present"})
         reasons.append("Mixed-language: Kannada characters detected")
 
-    # Score & verdict
-    issues_count = len(highlights)
-    score = compute_score(issues_count, costar)
-    verdict = decide_verdict(issues_count, injection_found, highlights)
+    # Unchecked rules count as an issue, so a truncated scan is never a clean ALLOW
+    if scan.truncated:
+        highlights.append({"type":"detection_truncated","match":f"{len(scan.skipped_rules)} rules not checked"})
+        reasons.append(f"Detection truncated: time budget exceeded, {len(scan.skipped_rules)} rules not checked")
+    return highlights, reasons
 
-    # Suggested rewrite (always use safe fallback for inappropriate content)
-    suggested_rewrite = ""
-    
+
+async def analyze_locally(prompt: str, engine: t.Optional[DetectorEngine] = None, detail: str = "verdict") -> LocalAnalysis:
+    """
+    run_local_analysis (moved off the event loop when it waits on the
+    detection pool), then the LLM rule check if the verdict is uncertain.
+    """
+    if DETECT_POOL.offloads(prompt):
+        local = await run_in_threadpool(run_local_analysis, prompt, engine, None, detail)
+    else:
+        local = run_local_analysis(prompt, engine, detail=detail)
+    return await classify(prompt, local)
+
+
+async def classify(prompt: str, local: LocalAnalysis) -> LocalAnalysis:
+    """Hybrid mode: confident local verdicts stand, the rest are decided by the LLM rule check."""
+    if not CLASSIFIER.should_escalate(local.verdict, local.score, local.scan):
+        return local
+    with STAGE_SECONDS.time(stage="classify"):
+        review = await CLASSIFIER.review(prompt, local.verdict)
+    if review is None:
+        return local
+    # The LLM only fills COSTAR fields the local extractor left empty
+    costar = {k: (review.costar.get(k) or v) if v in ("", "None") else v for k, v in local.costar.items()}
+    return local._replace(verdict=review.verdict, reasons=local.reasons + review.reasons, costar=costar, classified_by="llm")
+
+
+async def run_rewrite(prompt: str, persona: str, local: LocalAnalysis) -> str:
+    with STAGE_SECONDS.time(stage="rewrite"):
+        return await _run_rewrite(prompt, persona, local)
+
+
+async def _run_rewrite(prompt: str, persona: str, local: LocalAnalysis) -> str:
     # Check if content is inappropriate - if so, skip Gemini and use safe fallback
-    contains_inappropriate = any([
-        any(re.search(pattern, prompt, re.I) for pattern in EXPLICIT_PATTERNS),
-        any(re.search(pattern, prompt, re.I) for pattern in HARMFUL_PATTERNS),
-        any(word in prompt.lower() for word in COMMON_SLANG if word in ['fuck', 'fucking', 'shit', 'damn'])
-    ])
-    
-    if contains_inappropriate or verdict == "BLOCK":
+    if local.scan.needs_replacement or local.verdict == "BLOCK":
         # For blocked content, always use safe local rewrite
-        suggested_rewrite = build_sanitized_rewrite(prompt, costar, persona)
-    else:
-        # Only call Gemini for appropriate content
-        try:
-            rewrite_prompt = (
-                f"Rewrite the following user prompt to be more professional and clear.\n"
-                f"Original prompt: '''{prompt}'''\n"
-                f"Persona: {persona}\n"
-                f"Provide only a clean, professional version (one sentence)."
-            )
-            suggested_rewrite = call_gemini_generate(rewrite_prompt, max_tokens=256)
-
-            # If gemini returned stub, empty, or malformed JSON, fallback
-            if (not suggested_rewrite or 
-                suggested_rewrite.startswith("STUB LLM RESPONSE") or 
-                suggested_rewrite.startswith("{") or
-                len(suggested_rewrite) > 200):
-                suggested_rewrite = build_sanitized_rewrite(prompt, costar, persona)
-        except:
-            suggested_rewrite = build_sanitized_rewrite(prompt, costar, persona)
+        return build_sanitized_rewrite(prompt, local.costar, persona, local.scan)
 
+    # Only call Gemini for appropriate content
+    try:
+        # A one-sentence rewrite needs the gist, not a whole pasted document
+        rewrite_prompt = (
+            f"Rewrite the following user prompt to be more professional and clear.\n"
+            f"Original prompt: '''{fit_to_budget(prompt, REWRITE_INPUT_TOKENS)}'''\n"
+            f"Persona: {persona}\n"
+            f"Provide only a clean, professional version (one sentence)."
+        )
+        # Ask for no more than would be kept
+        suggested_rewrite = await call_gemini_generate(rewrite_prompt, max_tokens=tokens_for_chars(REWRITE_MAX_CHARS))
+
+        # If gemini returned stub, empty, or malformed JSON, fallback
+        if (not suggested_rewrite or
+            suggested_rewrite.startswith("STUB LLM RESPONSE") or
+            suggested_rewrite.startswith("{") or
+            len(suggested_rewrite) > REWRITE_MAX_CHARS):
+            suggested_rewrite = build_sanitized_rewrite(prompt, local.costar, persona, local.scan)
+    except:
+        suggested_rewrite = build_sanitized_rewrite(prompt, local.costar, persona, local.scan)
+    return suggested_rewrite
+
+
+async def run_answer(prompt: str) -> str:
+    with STAGE_SECONDS.time(stage="answer"):
+        return await call_gemini_generate(prompt, max_tokens=800)
+
+
+def build_analyze_response(local: LocalAnalysis, suggested_rewrite: str) -> AnalyzeResponse:
     return AnalyzeResponse(
-        verdict=verdict,
-        score=score,
-        costar=costar,
-        highlights=highlights,
+        verdict=local.verdict,
+        score=local.score,
+        costar=local.costar,
+        highlights=local.highlights,
         suggested_rewrite=suggested_rewrite,
-        reasons=reasons
+        reasons=local.reasons,
+        ruleset_version=local.scan.engine.version,
+        detection_truncated=local.scan.truncated,
+        early_exit=local.scan.stopped_early,
+        partial=list(EARLY_EXIT_PARTIAL) if local.scan.stopped_early else [],
+        classified_by=local.classified_by,
     )
 
-@app.post("/api/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    # Run analysis first
-    analyze_req = AnalyzeRequest(prompt=req.prompt, persona=req.persona)
-    analysis = analyze(analyze_req)
 
-    # If blocked, return analysis only
-    if analysis.verdict == "BLOCK":
+def cache_analysis(key: str, response: AnalyzeResponse) -> None:
+    # Truncation depends on load at the time, so truncated results are not reused
+    if not response.detection_truncated:
+        VERDICT_CACHE.set(key, response.model_dump_json())
+
+
+def record_history(endpoint: str, persona: str, response: AnalyzeResponse, started: float, prompt: str = "", digest: t.Optional[str] = None, cached: bool = False, local: t.Optional[LocalAnalysis] = None) -> None:
+    """Queue the analysis for the history store; never waits on the database."""
+    if HISTORY is None:
+        return
+    timings = {"total_ms": round((time.perf_counter() - started) * 1000, 3)}
+    if local is not None:
+        timings["detect_ms"] = local.detect_ms
+    HISTORY.record(HistoryRecord(
+        time.time(), endpoint, digest or prompt_hash(prompt), persona, response.verdict, response.score,
+        response.highlights, response.ruleset_version, cached, timings, prompt or None,
+    ))
+
+
+# Pipeline stages: "detect" and "verdict" are local and always run; "rewrite"
+# (LLM suggested_rewrite) and "answer" (LLM chat answer) are optional.
+PIPELINE_STAGES = ("detect", "verdict", "rewrite", "answer")
+ANALYZE_DEFAULT_STAGES = ("detect", "verdict", "rewrite")
+
+
+def parse_stages(options: t.Optional[dict], default: t.Iterable[str]) -> t.FrozenSet[str]:
+    """Read options["stages"]; the local stages are always included."""
+    stages = (options or {}).get("stages")
+    if stages is None:
+        return frozenset(default)
+    if not isinstance(stages, list) or not all(isinstance(x, str) for x in stages):
+        raise HTTPException(status_code=400, detail="options.stages must be a list of stage names")
+    unknown = set(stages) - set(PIPELINE_STAGES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown stages: {sorted(unknown)} (valid: {list(PIPELINE_STAGES)})")
+    return frozenset(stages) | {"detect", "verdict"}
+
+
+def analysis_cache_key(prompt: str, persona: str, llm_rewrite: bool, engine: DetectorEngine, detail: str = "verdict") -> str:
+    # Keyed on what shapes the response, not on the raw options dict; changed
+    # rules (bumped version or not) get fresh entries while old ones age out by TTL/LRU
+    options = {"rewrite": llm_rewrite, "detail": detail}
+    if CLASSIFIER.enabled:
+        options["classifier"] = CLASSIFIER.mode
+    return cache_key(prompt, persona, engine.digest, options)
+
+
+def local_rewrite(prompt: str, persona: str, local: LocalAnalysis) -> str:
+    """suggested_rewrite when the LLM rewrite stage is skipped."""
+    return build_sanitized_rewrite(prompt, local.costar, persona, local.scan)
+
+
+@app.post("/api/analyze", response_model=AnalyzeResponse)
+async def analyze(req: AnalyzeRequest):
+    """
+    With options.defer_rewrite the local verdict returns immediately along
+    with a local suggested_rewrite and a rewrite_job id; the LLM rewrite runs
+    in the background and is fetched from /api/rewrite/{rewrite_job}.
+    """
+    started = time.perf_counter()
+    prompt = req.prompt or ""
+    persona = req.persona or "Professor"
+
+    stages = parse_stages(req.options, ANALYZE_DEFAULT_STAGES)
+    llm_rewrite = "rewrite" in stages
+    defer = llm_rewrite and bool((req.options or {}).get("defer_rewrite"))
+    detail = parse_detail(req.options)
+    # Pin one ruleset for the whole request, even if a reload lands mid-way
+    engine = active_engine()
+
+    # Identical prompts (after whitespace normalization) reuse the stored response
+    key = analysis_cache_key(prompt, persona, llm_rewrite, engine, detail)
+    cached = VERDICT_CACHE.get(key)
+    if cached is not None:
+        response = AnalyzeResponse.model_validate_json(cached)
+        record_verdict("analyze", response.verdict, persona)
+        record_history("analyze", persona, response, started, prompt, cached=True)
+        return response
+
+    local = await analyze_locally(prompt, engine, detail)
+    # Blocked or replaced prompts never reach the LLM, so there is nothing to defer
+    if defer and not (local.scan.needs_replacement or local.verdict == "BLOCK"):
+        # The finished job fills the cache, so a repeat request gets the full analysis
+        def store(rewrite: str) -> None:
+            cache_analysis(key, build_analyze_response(local, rewrite))
+
+        job = REWRITE_JOBS.submit(key, lambda: run_rewrite(prompt, persona, local), on_done=store)
+        response = build_analyze_response(local, local_rewrite(prompt, persona, local))
+        response.rewrite_job = job.id
+        record_verdict("analyze", response.verdict, persona)
+        record_history("analyze", persona, response, started, prompt, local=local)
+        return response
+    if llm_rewrite:
+        suggested_rewrite = await run_rewrite(prompt, persona, local)
+    else:
+        suggested_rewrite = local_rewrite(prompt, persona, local)
+
+    response = build_analyze_response(local, suggested_rewrite)
+    cache_analysis(key, response)
+    record_verdict("analyze", response.verdict, persona)
+    record_history("analyze", persona, response, started, prompt, local=local)
+    return response
+
+@app.post("/api/analyze/stream", response_model=StreamAnalyzeResponse)
+async def analyze_stream(request: Request, persona: str = "Professor"):
+    """
+    Analyze a raw (UTF-8) request body of up to STREAM_MAX_BYTES without
+    holding it in memory: the body is scanned in overlapping windows as it
+    arrives and reading stops at the first blocking match. There is no LLM
+    rewrite and no cache; suggested_rewrite is the persona's replacement
+    prompt for explicit/harmful/profane documents and empty otherwise.
+    """
+    started = time.perf_counter()
+    engine = active_engine()
+    scanner = StreamScanner(engine)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # History keys streamed documents by a hash of the raw bytes read
+    digest = hashlib.sha256()
+    received = 0
+    early_exit = False
+    async for chunk in request.stream():
+        received += len(chunk)
+        digest.update(chunk)
+        if received > STREAM_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Body exceeds {STREAM_MAX_BYTES} bytes")
+        # A window scan is CPU work; keep it off the event loop
+        if await run_in_threadpool(scanner.feed, decoder.decode(chunk)):
+            early_exit = True
+            break
+    if not early_exit:
+        scanner.feed(decoder.decode(b"", final=True))
+    scan = await run_in_threadpool(scanner.finish)
+
+    local = run_local_analysis("", engine, scan)
+    analysis = build_analyze_response(local, local_rewrite("", persona, local) if scan.needs_replacement else "")
+    response = StreamAnalyzeResponse(**{**analysis.model_dump(), "early_exit": early_exit}, chars_scanned=scanner.scanned)
+    record_verdict("analyze_stream", response.verdict, persona)
+    record_history("analyze_stream", persona, response, started, digest=digest.hexdigest(), local=local)
+    return response
+
+def session_response(session, rewrite: bool = False) -> SessionAnalyzeResponse:
+    """Local analysis of the session's current text from its incremental scan; the rewrite only on request."""
+    scanner = session.scanner
+    local = run_local_analysis(scanner.text, scanner.engine, scanner.scan())
+    analysis = build_analyze_response(local, local_rewrite(scanner.text, session.persona, local) if rewrite else "")
+    return SessionAnalyzeResponse(**analysis.model_dump(), session_id=session.id, revision=session.revision, chars_scanned=scanner.last_scanned)
+
+
+@app.post("/api/analyze/session", response_model=SessionAnalyzeResponse)
+async def open_analyze_session(req: SessionOpenRequest):
+    """
+    Start an edit session for a prompt being typed. Later edits go to
+    /api/analyze/session/{session_id}/edits and only the text around each
+    edit is re-scanned. Analysis is local only (no LLM rewrite, no cache,
+    no history) and suggested_rewrite stays empty unless `rewrite` is set,
+    since building it reads the whole prompt; send the final prompt to
+    /api/analyze as usual.
+    """
+    persona = req.persona or "Professor"
+
+    def start() -> SessionAnalyzeResponse:
+        try:
+            # The first full scan happens here, off the event loop
+            session = SESSIONS.open(active_engine(), req.prompt or "", persona)
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        return session_response(session, req.rewrite)
+
+    response = await run_in_threadpool(start)
+    record_verdict("analyze_session", response.verdict, persona)
+    return response
+
+@app.post("/api/analyze/session/{session_id}/edits", response_model=SessionAnalyzeResponse)
+async def edit_analyze_session(session_id: str, req: SessionEditRequest):
+    """
+    Apply edits (in order, each against the text left by the previous one)
+    and return the updated analysis. 409 when `revision` is not the
+    session's current one; 404 when the session expired or lives in another
+    worker, in which case the client opens a new one.
+    """
+    session = SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    edits = [Edit(e.offset, e.delete, e.insert) for e in req.edits]
+
+    def apply() -> SessionAnalyzeResponse:
+        with session.lock:
+            if req.revision != session.revision:
+                raise HTTPException(status_code=409, detail={"error": "revision mismatch", "revision": session.revision})
+            try:
+                session.apply(edits, active_engine())
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return session_response(session, req.rewrite)
+
+    response = await run_in_threadpool(apply)
+    record_verdict("analyze_session", response.verdict, session.persona)
+    return response
+
+@app.delete("/api/analyze/session/{session_id}")
+async def close_analyze_session(session_id: str):
+    if not SESSIONS.close(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"closed": session_id}
+
+@app.get("/api/rewrite/{job_id}")
+async def get_rewrite(job_id: str, wait: float = 0):
+    """Deferred rewrite status; `wait` long-polls up to REWRITE_MAX_WAIT seconds."""
+    job = REWRITE_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired rewrite job")
+    job = await REWRITE_JOBS.wait(job, min(max(wait, 0), REWRITE_MAX_WAIT))
+    return job.to_dict()
+
+@app.post("/api/analyze/batch", response_model=BatchAnalyzeResponse)
+async def analyze_batch(req: BatchAnalyzeRequest):
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(req.items)} items (max {BATCH_MAX_ITEMS})")
+    started = time.perf_counter()
+    concurrency = max(1, min(req.max_concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    engine = active_engine()
+
+    # Deduplicate: identical prompts (same cache key) are analyzed once
+    groups: t.Dict[str, t.List[int]] = {}
+    item_rewrite: t.Dict[str, bool] = {}
+    item_detail: t.Dict[str, str] = {}
+    # Items whose options do not validate fail on their own, not the whole batch
+    invalid: t.Dict[int, HTTPException] = {}
+    for i, item in enumerate(req.items):
+        try:
+            llm_rewrite = "rewrite" in parse_stages(item.options, ANALYZE_DEFAULT_STAGES)
+            detail = parse_detail(item.options)
+        except HTTPException as e:
+            invalid[i] = e
+            continue
+        key = analysis_cache_key(item.prompt or "", item.persona or "Professor", llm_rewrite, engine, detail)
+        groups.setdefault(key, []).append(i)
+        item_rewrite[key] = llm_rewrite
+        item_detail[key] = detail
+
+    outcomes: t.Dict[str, t.Union[AnalyzeResponse, Exception]] = {}
+    analyzed: t.Dict[str, LocalAnalysis] = {}
+    todo = []
+    cache_hits = 0
+    for key, indexes in groups.items():
+        cached = VERDICT_CACHE.get(key)
+        if cached is not None:
+            outcomes[key] = AnalyzeResponse.model_validate_json(cached)
+            cache_hits += 1
+        else:
+            todo.append((key, req.items[indexes[0]]))
+
+    # Local detectors for the whole batch in one go, off the event loop
+    def local_stage() -> t.List[t.Union[LocalAnalysis, Exception]]:
+        results = []
+        for key, item in todo:
+            try:
+                results.append(run_local_analysis(item.prompt or "", engine, detail=item_detail[key]))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    locals_ = await run_in_threadpool(local_stage)
+
+    # Fan out the rewrite stage (Gemini calls) with bounded concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def finish(key: str, item: AnalyzeRequest, local: LocalAnalysis) -> None:
+        try:
+            async with semaphore:
+                local = await classify(item.prompt or "", local)
+            analyzed[key] = local
+            if item_rewrite[key]:
+                async with semaphore:
+                    rewrite = await run_rewrite(item.prompt or "", item.persona or "Professor", local)
+            else:
+                rewrite = local_rewrite(item.prompt or "", item.persona or "Professor", local)
+            response = build_analyze_response(local, rewrite)
+            cache_analysis(key, response)
+            outcomes[key] = response
+        except Exception as e:
+            outcomes[key] = e
+
+    tasks = []
+    for (key, item), local in zip(todo, locals_):
+        if isinstance(local, Exception):
+            outcomes[key] = local
+        else:
+            tasks.append(finish(key, item, local))
+    await asyncio.gather(*tasks)
+
+    # Results in input order, one entry per item
+    results: t.List[BatchItemResult] = [None] * len(req.items)  # type: ignore
+    for i, e in invalid.items():
+        results[i] = BatchItemResult(index=i, ok=False, error=f"{type(e).__name__}: {e.status_code}: {e.detail}")
+    for key, indexes in groups.items():
+        outcome = outcomes[key]
+        for i in indexes:
+            if isinstance(outcome, Exception):
+                results[i] = BatchItemResult(index=i, ok=False, error=f"{type(outcome).__name__}: {outcome}")
+            else:
+                results[i] = BatchItemResult(index=i, ok=True, result=outcome)
+                persona = req.items[i].persona or "Professor"
+                record_verdict("batch", outcome.verdict, persona)
+                local = analyzed.get(key)
+                record_history("batch", persona, outcome, started, req.items[i].prompt or "", cached=local is None, local=local)
+    return BatchAnalyzeResponse(results=results, unique_prompts=len(groups), cache_hits=cache_hits)
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    """
+    Runs the local stages first and only the LLM stages the verdict needs:
+    BLOCK -> none, NEEDS_FIX -> rewrite, ALLOW -> answer. If options.stages
+    explicitly asks for "rewrite", an ALLOW prompt gets rewrite and answer
+    concurrently. Leaving "answer" out of options.stages skips the answer.
+    """
+    started = time.perf_counter()
+    prompt = req.prompt or ""
+    persona = req.persona or "Professor"
+    explicit = (req.options or {}).get("stages") is not None
+    stages = parse_stages(req.options, ("detect", "verdict", "answer"))
+    want_rewrite = explicit and "rewrite" in stages
+    want_answer = "answer" in stages
+    detail = parse_detail(req.options)
+    engine = active_engine()
+
+    # A cached full analysis already carries the LLM rewrite
+    full_key = analysis_cache_key(prompt, persona, True, engine, detail)
+    cached = VERDICT_CACHE.get(full_key)
+    if cached is not None:
+        analysis = AnalyzeResponse.model_validate_json(cached)
+        record_verdict("chat", analysis.verdict, persona)
+        record_history("chat", persona, analysis, started, prompt, cached=True)
+        if analysis.verdict != "ALLOW":
+            return ChatResponse(allowed=False, analysis=analysis, llm_response=None)
+        llm_resp = await run_answer(prompt) if want_answer else None
+        return ChatResponse(allowed=True, analysis=analysis, llm_response=llm_resp)
+
+    local = await analyze_locally(prompt, engine, detail)
+    record_verdict("chat", local.verdict, persona)
+
+    # If blocked, return analysis only (the safe rewrite is always local)
+    if local.verdict == "BLOCK":
+        analysis = build_analyze_response(local, local_rewrite(prompt, persona, local))
+        record_history("chat", persona, analysis, started, prompt, local=local)
         return ChatResponse(allowed=False, analysis=analysis, llm_response=None)
 
-    if analysis.verdict == "NEEDS_FIX":
-        # Optionally auto-rewrite and return rewrite with allowed=False
+    if local.verdict == "NEEDS_FIX":
+        # Rewrite is what the user needs next; no answer until the prompt is fixed
+        analysis = build_analyze_response(local, await run_rewrite(prompt, persona, local))
+        cache_analysis(full_key, analysis)
+        record_history("chat", persona, analysis, started, prompt, local=local)
         return ChatResponse(allowed=False, analysis=analysis, llm_response=None)
 
     # ALLOW: forward to LLM (Gemini or stub) with original prompt for better context matching
-    llm_resp = call_gemini_generate(req.prompt, max_tokens=800)
+    if want_rewrite and want_answer:
+        rewrite, llm_resp = await asyncio.gather(
+            run_rewrite(prompt, persona, local),
+            run_answer(prompt),
+        )
+    elif want_rewrite:
+        rewrite, llm_resp = await run_rewrite(prompt, persona, local), None
+    else:
+        rewrite = local_rewrite(prompt, persona, local)
+        llm_resp = await run_answer(prompt) if want_answer else None
+    analysis = build_analyze_response(local, rewrite)
+    if want_rewrite:
+        cache_analysis(full_key, analysis)
+    record_history("chat", persona, analysis, started, prompt, local=local)
     return ChatResponse(allowed=True, analysis=analysis, llm_response=llm_resp)
 
+def _stream_event(event: str, data: dict, fmt: str) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+async def chat_events(prompt: str, persona: str, detail: str) -> t.AsyncIterator[t.Tuple[str, dict]]:
+    """
+    (event, data) pairs of a streamed chat: `analysis` as soon as the local
+    detectors finish, then either `rewrite` (NEEDS_FIX) or `chunk` events
+    with the model output (ALLOW), then `done`.
+    """
+    started = time.perf_counter()
+    engine = active_engine()
+    key = analysis_cache_key(prompt, persona, True, engine, detail)
+    cached = VERDICT_CACHE.get(key)
+    if cached is not None:
+        analysis = AnalyzeResponse.model_validate_json(cached)
+        local = None
+    else:
+        local = await analyze_locally(prompt, engine, detail)
+        # Local rewrite only; the LLM rewrite follows as its own event if needed
+        analysis = build_analyze_response(local, local_rewrite(prompt, persona, local))
+    allowed = analysis.verdict == "ALLOW"
+    record_verdict("chat_stream", analysis.verdict, persona)
+    record_history("chat_stream", persona, analysis, started, prompt, cached=local is None, local=local)
+    yield "analysis", {"allowed": allowed, "analysis": analysis.model_dump()}
+
+    try:
+        if analysis.verdict == "NEEDS_FIX" and local is not None:
+            rewrite = await run_rewrite(prompt, persona, local)
+            cache_analysis(key, build_analyze_response(local, rewrite))
+            yield "rewrite", {"suggested_rewrite": rewrite}
+        elif allowed:
+            async for chunk in stream_gemini_generate(prompt, max_tokens=800):
+                yield "chunk", {"text": chunk}
+    except Exception as e:
+        yield "error", {"detail": str(e)}
+    yield "done", {}
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest, format: str = "ndjson"):
+    """Streaming variant of /api/chat (format=ndjson or sse); see chat_events for the events."""
+    fmt = "sse" if format == "sse" else "ndjson"
+    detail = parse_detail(req.options)
+
+    async def events() -> t.AsyncIterator[str]:
+        async for event, data in chat_events(req.prompt or "", req.persona or "Professor", detail):
+            yield _stream_event(event, data, fmt)
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+# --- WebSocket: analyze and chat multiplexed over one connection ---
+async def ws_analyze(message: dict) -> t.AsyncIterator[t.Tuple[str, dict]]:
+    """`result` with the analysis; a deferred LLM rewrite is pushed later as `rewrite`."""
+    response = await analyze(AnalyzeRequest.model_validate(message))
+    yield "result", response.model_dump()
+    job = REWRITE_JOBS.get(response.rewrite_job) if response.rewrite_job else None
+    if job is not None:
+        while job.status == PENDING:
+            job = await REWRITE_JOBS.wait(job, REWRITE_MAX_WAIT)
+        yield "rewrite", job.to_dict()
+
+async def ws_chat(message: dict) -> t.AsyncIterator[t.Tuple[str, dict]]:
+    response = await chat(ChatRequest.model_validate(message))
+    yield "result", response.model_dump()
+
+async def ws_chat_stream(message: dict) -> t.AsyncIterator[t.Tuple[str, dict]]:
+    req = ChatRequest.model_validate(message)
+    async for event in chat_events(req.prompt or "", req.persona or "Professor", parse_detail(req.options)):
+        yield event
+
+WS_HANDLERS = {"analyze": ws_analyze, "chat": ws_chat, "chat_stream": ws_chat_stream}
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """
+    One connection, many requests: send {"id", "type": "analyze" | "chat" |
+    "chat_stream", "prompt", "persona", "options"} and get back messages
+    tagged with the same id. analyze and chat end with `result` (plus a
+    pushed `rewrite` when options.defer_rewrite is set), chat_stream with
+    `done`; failures come back as `error` with an HTTP-style status.
+    """
+    await Multiplexer(websocket, WS_HANDLERS).run()
+
+@app.get("/api/history")
+async def get_history(limit: int = 50, before: t.Optional[int] = None, verdict: t.Optional[str] = None, persona: t.Optional[str] = None, since: t.Optional[float] = None, until: t.Optional[float] = None):
+    """
+    Past analyses, newest first (prompt hashes, not prompts, unless
+    HISTORY_STORE_PROMPTS is set). `since`/`until` are unix timestamps; pass
+    `next_before` from a page as `before` to get the next one.
+    """
+    if HISTORY is None:
+        raise HTTPException(status_code=404, detail="History is disabled (HISTORY_BACKEND=off)")
+    if not 1 <= limit <= HISTORY_MAX_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_PAGE}")
+    return await run_in_threadpool(HISTORY.query, limit, before, verdict, persona, since, until)
+
+@app.get("/api/history/stats")
+async def get_history_stats(since: t.Optional[float] = None, until: t.Optional[float] = None, bucket: str = "hour", persona: t.Optional[str] = None):
+    """Counts by verdict and persona, average score and a per-hour (or per-day) verdict series."""
+    if HISTORY is None:
+        raise HTTPException(status_code=404, detail="History is disabled (HISTORY_BACKEND=off)")
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {list(BUCKETS)}")
+    return await run_in_threadpool(HISTORY.aggregates, since, until, bucket, persona)
+
+@app.get("/api/history/export")
+async def export_history(format: str = "ndjson", since: t.Optional[float] = None, until: t.Optional[float] = None, verdict: t.Optional[str] = None, persona: t.Optional[str] = None, gzip: bool = False):
+    """
+    Every stored analysis in the range, oldest first, as NDJSON or CSV,
+    streamed straight from the database (optionally gzipped) so exports of
+    any size use constant memory. Rows written after the export starts are
+    not included.
+    """
+    if HISTORY is None:
+        raise HTTPException(status_code=404, detail="History is disabled (HISTORY_BACKEND=off)")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(EXPORT_FORMATS)}")
+    filename = f"analysis_history.{format}" + (".gz" if gzip else "")
+    # A sync iterator, so Starlette pulls each chunk from the database in the threadpool
+    body = encode_export(HISTORY.export(since, until, verdict, persona), format, compress=gzip)
+    return StreamingResponse(
+        body,
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-cache"},
+    )
+
+@app.on_event("startup")
+def watch_ruleset():
+    RULESETS.start()
+    workers.mark_ready()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    workers.mark_draining()
+    RULESETS.stop()
+    DETECT_POOL.close()
+    if HISTORY is not None:
+        HISTORY.close()
+    await ASYNC_CLIENT.aclose()
+
+def require_admin(token: t.Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/api/admin/ruleset/reload")
+async def reload_ruleset(x_admin_token: t.Optional[str] = Header(None)):
+    """Recompile the ruleset file off the event loop and swap it in atomically."""
+    require_admin(x_admin_token)
+    reloaded, version = await run_in_threadpool(RULESETS.reload, "admin")
+    if not reloaded:
+        raise HTTPException(status_code=422, detail={"error": RULESETS.last_error, "active_version": version})
+    return RULESETS.status()
+
 # --- Simple health endpoint ---
 @app.get("/health")
 def health():
-    return {"status":"ok", "use_stub": USE_STUB, "gemini_configured": bool(GEMINI_API_KEY)}
+    return {"status":"ok", "use_stub": USE_STUB, "gemini_configured": gemini_configured(), "llm_provider": PROVIDER.name, "classifier": CLASSIFIER.stats(), "cache": VERDICT_CACHE.stats(), "ruleset": RULESETS.status(), "rewrite_jobs": REWRITE_JOBS.stats(), "edit_sessions": SESSIONS.stats(), "llm_gateway": GATEWAY.status(), "worker": workers.status(), "detect_pool": DETECT_POOL.stats(), "history": HISTORY.stats() if HISTORY is not None else {"backend": "off"}}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of request, stage, LLM and cache metrics."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
-    return {"message": "Prompt Review Engine API is running", "endpoints": ["/api/analyze", "/api/chat", "/health"]}
+    return {"message": "Prompt Review Engine API is running", "endpoints": ["/api/analyze", "/api/analyze/batch", "/api/analyze/stream", "/api/analyze/session", "/api/history", "/api/history/stats", "/api/history/export", "/api/chat", "/api/chat/stream", "/ws", "/api/rewrite/{job_id}", "/api/admin/ruleset/reload", "/health", "/metrics"]}
 
 if __name__ == "__main__":
+    # Development server with auto-reload; for production use `python -m app.server`
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
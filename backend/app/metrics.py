@@ -0,0 +1,262 @@
+# metrics.py - Prometheus-style metrics with per-thread sharded counters
+import time
+import bisect
+import threading
+import typing as t
+from contextlib import contextmanager
+
+# Seconds; spans sub-millisecond detector stages up to slow LLM round trips
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+KNOWN_PERSONAS = ("Professor", "Guardian", "Shield")
+
+
+def persona_label(persona: t.Optional[str]) -> str:
+    """Clamp user-supplied persona to a fixed set to bound label cardinality."""
+    return persona if persona in KNOWN_PERSONAS else "other"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: t.Sequence[str], values: t.Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Sharded:
+    """
+    Per-thread shards: each thread only ever writes its own dict, so updates
+    need no lock. Readers sum across shards at scrape time.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: t.List[dict] = []
+
+    def shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            self._shards.append(shard)  # list.append is atomic under the GIL
+        return shard
+
+    def snapshots(self) -> t.List[t.List[tuple]]:
+        return [list(shard.items()) for shard in list(self._shards)]
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: t.Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: t.Dict[str, str]) -> t.Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> t.List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> t.List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: t.Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values = _Sharded()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        shard = self._values.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def values(self) -> t.Dict[t.Tuple[str, ...], float]:
+        totals: t.Dict[t.Tuple[str, ...], float] = {}
+        for items in self._values.snapshots():
+            for key, value in items:
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def value(self, **labels: str) -> float:
+        return self.values().get(self._key(labels), 0.0)
+
+    def render(self) -> t.List[str]:
+        lines = self.header()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    """Up/down gauge kept as summed per-thread deltas."""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(Metric):
+    """Value read from a callable at scrape time (e.g. cache stats)."""
+
+    def __init__(self, name: str, help: str, fn: t.Callable[[], float], type: str = "gauge"):
+        super().__init__(name, help)
+        self.fn = fn
+        self.type = type
+
+    def render(self) -> t.List[str]:
+        try:
+            value = float(self.fn())
+        except Exception:
+            return []
+        return self.header() + [f"{self.name} {value:g}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: t.Sequence[str] = (), buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = _Sharded()
+
+    def observe(self, value: float, **labels: str) -> None:
+        shard = self._values.shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> t.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def totals(self) -> t.Dict[t.Tuple[str, ...], list]:
+        merged: t.Dict[t.Tuple[str, ...], list] = {}
+        for items in self._values.snapshots():
+            for key, (counts, total, count) in items:
+                into = merged.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                into[0] = [a + b for a, b in zip(into[0], counts)]
+                into[1] += total
+                into[2] += count
+        return merged
+
+    def render(self) -> t.List[str]:
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: t.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: t.List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_requests_total", "Analyzed prompts by endpoint, verdict and persona",
+    ("endpoint", "verdict", "persona"),
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "prompt_review_stage_seconds", "Latency of each analysis pipeline stage", ("stage",),
+))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "prompt_review_llm_request_seconds", "Latency of upstream LLM calls", ("client", "outcome"),
+))
+LLM_FALLBACKS_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_llm_fallbacks_total", "LLM calls answered by the local stub", ("client", "reason"),
+))
+LLM_INPUT_TRIMMED_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_llm_input_trimmed_total", "LLM prompts trimmed to their input token budget", ("client",),
+))
+LLM_COALESCED_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_llm_coalesced_total", "LLM calls that joined an identical in-flight request", ("client",),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "prompt_review_http_requests_in_flight", "HTTP requests currently being served",
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "prompt_review_http_request_seconds", "End-to-end HTTP request latency", ("path", "status"),
+))
+WS_CONNECTIONS = REGISTRY.register(Gauge(
+    "prompt_review_ws_connections", "Open /ws connections",
+))
+WS_MESSAGES_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_ws_messages_total", "Messages received on /ws by request type", ("type",),
+))
+WS_BACKPRESSURE_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_ws_backpressure_total", "Times a /ws connection stopped reading or a producer waited on a slow client", ("reason",),
+))
+
+
+def record_verdict(endpoint: str, verdict: str, persona: t.Optional[str]) -> None:
+    REQUESTS_TOTAL.inc(endpoint=endpoint, verdict=verdict, persona=persona_label(persona))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware tracking in-flight requests and latency per route.
+    Unlike BaseHTTPMiddleware it stays in flight until a streamed body ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": "500"}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = str(message["status"])
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in scope; use its template so
+            # unknown paths share one label and cannot blow up cardinality
+            route = scope.get("route")
+            path = getattr(route, "path", "other")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, path=path, status=status["code"])
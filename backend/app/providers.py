@@ -0,0 +1,449 @@
+# providers.py - One interface for every LLM call: Gemini, a deterministic stub, or a local mock server
+import re
+import json
+import hashlib
+import time
+import asyncio
+import typing as t
+
+from .utils import get_env
+from .gateway import LLMUnavailable
+from .llm_client import ASYNC_CLIENT, AsyncLLMClient
+from .metrics import LLM_FALLBACKS_TOTAL, LLM_INPUT_TRIMMED_TOTAL, LLM_REQUEST_SECONDS
+from .tokens import LLM_MAX_INPUT_TOKENS, fit_to_budget
+from .rules_prompt import RULE_ENGINE_SYSTEM_PROMPT
+
+GEMINI_API_KEY = get_env("GEMINI_API_KEY", "")
+GEMINI_API_URL = get_env("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent")
+GEMINI_STREAM_URL = get_env("GEMINI_STREAM_URL", GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent") + "?alt=sse")
+USE_STUB = get_env("USE_STUB", "false").lower() in ("1", "true", "yes")
+# gemini | stub | mock; unset picks gemini when a key is configured and USE_STUB is off
+LLM_PROVIDER = get_env("LLM_PROVIDER", "")
+# Gemini-compatible endpoint of benchmarks/mock_llm_server.py, for load tests without quota
+LLM_MOCK_URL = get_env("LLM_MOCK_URL", "http://127.0.0.1:8099/v1beta/models/mock:generateContent")
+# Upload system instructions once as cachedContents instead of with every call
+GEMINI_CONTEXT_CACHE = get_env("GEMINI_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL = int(get_env("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# Thinking tokens count against maxOutputTokens on 2.5 models, so budgets sized for
+# the answer would end in MAX_TOKENS; 0 turns thinking off, empty leaves the model default
+_THINKING = get_env("GEMINI_THINKING_BUDGET", "0").strip()
+GEMINI_THINKING_BUDGET = int(_THINKING) if _THINKING else None
+
+
+def gemini_configured() -> bool:
+    return bool(GEMINI_API_KEY) and "REPLACE" not in GEMINI_API_KEY
+
+
+class Budget(t.NamedTuple):
+    """
+    Per-call limits. `max_tokens` caps the output (set it to what the caller
+    keeps); the prompt is trimmed to `max_input_tokens` (None means
+    LLM_MAX_INPUT_TOKENS); `timeout` of None means LLM_TIMEOUT.
+    """
+    max_tokens: int = 512
+    timeout: t.Optional[float] = None
+    temperature: float = 0.7
+    max_input_tokens: t.Optional[int] = None
+
+
+def gemini_body(prompt: str, budget: Budget, system: t.Optional[str] = None, cached_content: t.Optional[str] = None, thinking_budget: t.Optional[int] = GEMINI_THINKING_BUDGET) -> dict:
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"maxOutputTokens": budget.max_tokens, "temperature": budget.temperature},
+    }
+    if thinking_budget is not None:
+        body["generationConfig"]["thinkingConfig"] = {"thinkingBudget": thinking_budget}
+    if cached_content:
+        body["cachedContent"] = cached_content
+    elif system:
+        body["systemInstruction"] = {"parts": [{"text": system}]}
+    return body
+
+
+def response_texts(data: dict) -> t.Iterator[str]:
+    """Text parts of a generateContent response (or one streamed event), in order."""
+    for candidate in data.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if part.get("text"):
+                yield part["text"]
+
+
+def finish_reason(data: dict) -> t.Optional[str]:
+    for candidate in data.get("candidates") or []:
+        return candidate.get("finishReason")
+    return None
+
+
+class LLMProvider:
+    """
+    generate() returns the completion, stream() yields it in pieces; both
+    raise on failure. `system` is the static instruction for the call, kept
+    apart from the (budgeted) prompt. Trimming, fallback and metrics live in
+    generate()/stream() below, so every provider is accounted the same way.
+    """
+
+    name = "base"
+
+    async def generate(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> t.AsyncIterator[str]:
+        yield await self.generate(prompt, budget, system)
+
+
+class StubProvider(LLMProvider):
+    """Canned answers picked from the prompt; no network, same output every time."""
+
+    name = "stub"
+
+    async def generate(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> str:
+        return stub_llm_response(prompt, system)
+
+    async def stream(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> t.AsyncIterator[str]:
+        async for chunk in stream_stub_response(prompt, system=system):
+            yield chunk
+
+
+class GeminiProvider(LLMProvider):
+    """
+    generateContent / streamGenerateContent over the shared pooled client
+    (and its gateway). System instructions go in `systemInstruction`; with
+    `context_cache` each distinct one is uploaded once as a cachedContents
+    resource and later calls reference it by name. Where caching is not
+    available (model without it, instruction under the minimum size) the
+    call falls back to `systemInstruction` and does not retry until the TTL
+    has passed.
+    """
+
+    name = "gemini"
+
+    def __init__(self, url: str = GEMINI_API_URL, stream_url: t.Optional[str] = None, api_key: str = GEMINI_API_KEY, client: AsyncLLMClient = ASYNC_CLIENT, context_cache: bool = GEMINI_CONTEXT_CACHE, cache_ttl: int = GEMINI_CONTEXT_CACHE_TTL):
+        self.url = url
+        self.stream_url = stream_url or url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+        self.client = client
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["x-goog-api-key"] = api_key
+        # e.g. .../v1beta/models/gemini-2.5-flash:generateContent -> models/gemini-2.5-flash
+        found = re.search(r"^(.*)/(models/[^/:]+):", url)
+        self.model = found.group(2) if found else None
+        self.cache_url = f"{found.group(1)}/cachedContents" if found else None
+        self.context_cache = context_cache and self.model is not None
+        self.cache_ttl = cache_ttl
+        # sha256(system) -> (cachedContents name or None when unavailable, expiry)
+        self._contexts: t.Dict[str, t.Tuple[t.Optional[str], float]] = {}
+
+    async def _cached_content(self, system: t.Optional[str]) -> t.Optional[str]:
+        if not self.context_cache or not system:
+            return None
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        entry = self._contexts.get(key)
+        # Renew a minute early so a reference never outlives the resource
+        if entry is not None and entry[1] - 60 > time.time():
+            return entry[0]
+        payload = {"model": self.model, "systemInstruction": {"parts": [{"text": system}]}, "ttl": f"{self.cache_ttl}s"}
+        try:
+            name = (await self.client.post_json(self.cache_url, payload, headers=self.headers)).get("name")
+        except Exception:
+            name = None
+        self._contexts[key] = (name, time.time() + self.cache_ttl)
+        return name
+
+    async def _body(self, prompt: str, budget: Budget, system: t.Optional[str]) -> dict:
+        return gemini_body(prompt, budget, system, await self._cached_content(system))
+
+    async def generate(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> str:
+        body = await self._body(prompt, budget, system)
+        data = await self.client.post_json(self.url, body, headers=self.headers, timeout=budget.timeout)
+        reason = finish_reason(data)
+        # A cut-off answer is as unusable as none (half a rewrite, unparseable JSON)
+        if reason == "MAX_TOKENS":
+            raise ValueError(f"Response hit maxOutputTokens ({budget.max_tokens})")
+        for text in response_texts(data):
+            return text
+        raise ValueError(f"Response has no text (finishReason {reason})")
+
+    async def stream(self, prompt: str, budget: Budget, system: t.Optional[str] = None) -> t.AsyncIterator[str]:
+        body = await self._body(prompt, budget, system)
+        async for data in self.client.stream_sse(self.stream_url, body, headers=self.headers, timeout=budget.timeout):
+            for text in response_texts(data):
+                yield text
+
+
+class MockServerProvider(GeminiProvider):
+    """The Gemini wire protocol against a local mock server (no key, no quota)."""
+
+    name = "mock"
+
+    def __init__(self, url: str = LLM_MOCK_URL, client: AsyncLLMClient = ASYNC_CLIENT, context_cache: bool = GEMINI_CONTEXT_CACHE):
+        super().__init__(url, api_key="", client=client, context_cache=context_cache)
+
+
+def build_provider(kind: str = LLM_PROVIDER) -> LLMProvider:
+    kind = (kind or "").lower() or ("gemini" if gemini_configured() and not USE_STUB else "stub")
+    if kind == "mock":
+        return MockServerProvider()
+    if kind == "gemini" and gemini_configured():
+        return GeminiProvider(GEMINI_API_URL, GEMINI_STREAM_URL)
+    if kind in ("gemini", "stub"):
+        return StubProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER {kind!r} (expected gemini, stub or mock)")
+
+
+PROVIDER = build_provider()
+FALLBACK = StubProvider()
+
+
+def fit_prompt(prompt: str, budget: Budget, client: str) -> str:
+    """Trim the prompt to the call's input budget."""
+    fitted = fit_to_budget(prompt, budget.max_input_tokens or LLM_MAX_INPUT_TOKENS)
+    if fitted is not prompt:
+        LLM_INPUT_TRIMMED_TOTAL.inc(client=client)
+    return fitted
+
+
+async def generate(prompt: str, budget: Budget = Budget(), provider: t.Optional[LLMProvider] = None, fallback: bool = True, system: t.Optional[str] = None) -> str:
+    """
+    One completion from `provider` (default PROVIDER), with the prompt
+    trimmed to the budget. On failure the stub answers instead, unless
+    `fallback` is False, in which case the error is raised.
+    """
+    provider = provider or PROVIDER
+    prompt = fit_prompt(prompt, budget, provider.name)
+    if isinstance(provider, StubProvider):
+        LLM_FALLBACKS_TOTAL.inc(client=provider.name, reason="stub_mode")
+        return await provider.generate(prompt, budget, system)
+    start = time.perf_counter()
+    try:
+        text = await provider.generate(prompt, budget, system)
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, client=provider.name, outcome="ok")
+        return text
+    except LLMUnavailable as e:
+        # Circuit open or over the concurrency limit: nothing was sent
+        if not fallback:
+            raise
+        LLM_FALLBACKS_TOTAL.inc(client=provider.name, reason=e.reason)
+    except Exception as e:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, client=provider.name, outcome="error")
+        print(f"{provider.name} call failed:", str(e))
+        if not fallback:
+            raise
+        LLM_FALLBACKS_TOTAL.inc(client=provider.name, reason="error")
+    return await FALLBACK.generate(prompt, budget, system)
+
+
+async def stream(prompt: str, budget: Budget = Budget(max_tokens=800), provider: t.Optional[LLMProvider] = None, system: t.Optional[str] = None) -> t.AsyncIterator[str]:
+    """Streamed completion; falls back to the streamed stub if it fails before any text arrives."""
+    provider = provider or PROVIDER
+    client = f"{provider.name}_stream"
+    prompt = fit_prompt(prompt, budget, client)
+    if isinstance(provider, StubProvider):
+        LLM_FALLBACKS_TOTAL.inc(client=client, reason="stub_mode")
+        async for chunk in provider.stream(prompt, budget, system):
+            yield chunk
+        return
+    sent_any = False
+    start = time.perf_counter()
+    try:
+        async for chunk in provider.stream(prompt, budget, system):
+            sent_any = True
+            yield chunk
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, client=client, outcome="ok")
+        return
+    except LLMUnavailable as e:
+        LLM_FALLBACKS_TOTAL.inc(client=client, reason=e.reason)
+    except Exception as e:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, client=client, outcome="error")
+        print(f"{provider.name} stream failed:", str(e))
+        if sent_any:
+            raise
+        LLM_FALLBACKS_TOTAL.inc(client=client, reason="error")
+    async for chunk in FALLBACK.stream(prompt, budget, system):
+        yield chunk
+
+
+# --- Rule engine / inference helpers ---
+
+# The verdict JSON (verdict, a few reasons, COSTAR, a sanitized prompt) fits well within this
+RULE_CHECK_MAX_TOKENS = int(get_env("RULE_CHECK_MAX_TOKENS", "512"))
+RULE_CHECK_INPUT_TOKENS = int(get_env("RULE_CHECK_INPUT_TOKENS", "2048"))
+
+def parse_rule_check(text: str, user_prompt: str) -> dict:
+    try:
+        start = text.find("{")
+        end = text.rfind("}") + 1
+        if start < 0 or end <= start:
+            raise ValueError("No JSON found in response")
+        parsed = json.loads(text[start:end])
+    except Exception as e:
+        parsed = {
+            "verdict": "NEEDS_FIX",
+            "reasons": [f"Failed to parse LLM output: {str(e)}"],
+            "costar": {},
+            "sanitized_prompt": user_prompt,
+        }
+    parsed["verdict"] = parsed.get("verdict", "NEEDS_FIX").upper()
+    return parsed
+
+
+async def run_rule_check(user_prompt: str, provider: t.Optional[LLMProvider] = None, fail_closed: bool = True) -> dict:
+    """
+    Ask the model for a COSTAR verdict as JSON. The static rule prompt goes
+    as the system instruction (cached upstream when possible), only the user
+    prompt is budgeted per call. A failed call gives NEEDS_FIX, never the
+    stub's ALLOW, or raises when `fail_closed` is False.
+    """
+    prompt = "User prompt:\n" + user_prompt
+    budget = Budget(max_tokens=RULE_CHECK_MAX_TOKENS, temperature=0.0, max_input_tokens=RULE_CHECK_INPUT_TOKENS)
+    try:
+        text = await generate(prompt, budget, provider, fallback=False, system=RULE_ENGINE_SYSTEM_PROMPT)
+    except Exception as e:
+        if not fail_closed:
+            raise
+        return {"verdict": "NEEDS_FIX", "reasons": [f"API call failed: {str(e)}"], "costar": {}, "sanitized_prompt": ""}
+    return parse_rule_check(text, user_prompt)
+
+
+async def run_inference(sanitized_prompt: str, provider: t.Optional[LLMProvider] = None) -> str:
+    """Forward a sanitized prompt for the final answer."""
+    return await generate(sanitized_prompt, Budget(max_tokens=800), provider)
+
+
+# --- Stub responses ---
+
+_STUB_RULE_CHECK = json.dumps({
+    "verdict": "ALLOW",
+    "reasons": ["stubbed - no API key"],
+    "costar": {
+        "Context": "Development testing",
+        "Objective": "Verify system functionality",
+        "Style": "Professional",
+        "Tone": "Neutral",
+        "Audience": "Developer",
+        "Response": "Test response",
+    },
+    "sanitized_prompt": "Explain the concept of artificial intelligence.",
+})
+
+
+def stub_llm_response(prompt: str, system: t.Optional[str] = None) -> str:
+    if system == RULE_ENGINE_SYSTEM_PROMPT or prompt.startswith(RULE_ENGINE_SYSTEM_PROMPT):
+        return _STUB_RULE_CHECK
+    # Intelligent stub responses based on content analysis
+    prompt_lower = prompt.lower()
+    
+    # Educational content
+    if any(term in prompt_lower for term in ['explain', 'teach', 'learn', 'understand', 'concept']):
+        if 'quantum' in prompt_lower and 'physics' in prompt_lower:
+            return """**Quantum Physics Simplified for High School Students**
+
+**What is Quantum Physics?**
+Quantum physics is the study of matter and energy at the tiniest scale - smaller than atoms! At this microscopic level, particles behave in strange and fascinating ways that are completely different from our everyday experience.
+
+**Key Concepts:**
+
+1. **Wave-Particle Duality**
+   - Light and particles can act like both waves and particles
+   - Think of it like a coin that's spinning - it's both heads AND tails until it lands
+
+2. **Uncertainty Principle** 
+   - We can't know both the exact position and speed of a particle at the same time
+   - It's like trying to photograph a hummingbird - the more precisely you capture its location, the blurrier its motion becomes
+
+3. **Quantum Superposition**
+   - Particles can exist in multiple states simultaneously
+   - Famous example: Schrödinger's cat being both alive and dead until observed
+
+4. **Quantum Entanglement**
+   - Two particles can be mysteriously connected across vast distances
+   - Einstein called this "spooky action at a distance"
+
+**Why Does This Matter?**
+Quantum physics enables technologies like lasers, MRI machines, computer processors, and could lead to quantum computers that solve problems impossible for regular computers.
+
+**Analysis Reasoning:** This prompt was educational, appropriate, and requested clear explanations for students - exactly the type of content our system is designed to support and encourage."""
+
+        elif any(term in prompt_lower for term in ['ai', 'artificial intelligence', 'machine learning']):
+            return """**Artificial Intelligence Explained Simply**
+
+**What is AI?**
+Artificial Intelligence is technology that enables computers to perform tasks that typically require human intelligence, such as learning, reasoning, and problem-solving.
+
+**Key Types:**
+
+1. **Narrow AI** - Specialized for specific tasks (like chess, image recognition)
+2. **Machine Learning** - Systems that improve through experience
+3. **Deep Learning** - AI inspired by how human brains process information
+
+**Real-World Applications:**
+- Voice assistants (Siri, Alexa)
+- Recommendation systems (Netflix, YouTube)
+- Medical diagnosis assistance
+- Autonomous vehicles
+
+**Analysis Reasoning:** This educational request about AI concepts is appropriate and aligns with promoting understanding of important technologies."""
+
+    # Programming/coding requests
+    if any(term in prompt_lower for term in ['code', 'programming', 'software', 'algorithm']):
+        return """**Programming Concepts Explained**
+
+Programming is the art of giving computers step-by-step instructions to solve problems. Here are key concepts:
+
+**Fundamental Principles:**
+1. **Variables** - Storage containers for data
+2. **Functions** - Reusable blocks of code
+3. **Loops** - Repeating actions efficiently
+4. **Conditionals** - Making decisions in code
+
+**Best Practices:**
+- Write clean, readable code
+- Plan before you code
+- Test your programs thoroughly
+- Learn from errors and debugging
+
+**Analysis Reasoning:** Educational programming content promotes learning and skill development in technology."""
+
+    # Professional communication
+    if any(term in prompt_lower for term in ['professional', 'business', 'email', 'communication']):
+        return """**Professional Communication Guidelines**
+
+**Key Principles:**
+1. **Clarity** - Be clear and direct in your message
+2. **Courtesy** - Use polite and respectful language
+3. **Conciseness** - Keep messages focused and brief
+4. **Correctness** - Check grammar and factual accuracy
+
+**Structure for Professional Emails:**
+- Clear subject line
+- Polite greeting
+- Specific purpose/request
+- Next steps or timeline
+- Professional closing
+
+**Analysis Reasoning:** This request for professional communication guidance promotes workplace skills and appropriate conduct."""
+
+    # General educational response
+    return """**Educational Response**
+
+I'd be happy to help you learn! For the most comprehensive and accurate information on this topic, I recommend:
+
+**Learning Strategies:**
+1. Break complex topics into smaller parts
+2. Use multiple sources to verify information
+3. Apply concepts through practice and examples
+4. Ask specific questions for targeted learning
+
+**Quality Resources:**
+- Educational websites (.edu domains)
+- Peer-reviewed academic sources
+- Established educational institutions
+- Professional learning platforms
+
+**Analysis Reasoning:** This prompt requested educational content, which aligns with promoting learning and knowledge sharing - core values our system is designed to support."""
+
+async def stream_stub_response(prompt: str, words_per_chunk: int = 8, system: t.Optional[str] = None) -> t.AsyncIterator[str]:
+    """Yield stub_llm_response a few words at a time, like a streamed completion."""
+    pieces = re.findall(r"\S+\s*", stub_llm_response(prompt, system))
+    for i in range(0, len(pieces), words_per_chunk):
+        yield "".join(pieces[i:i + words_per_chunk])
+        await asyncio.sleep(0)
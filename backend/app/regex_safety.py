@@ -0,0 +1,342 @@
+# regex_safety.py - ReDoS lint and safe compilation for ruleset patterns
+"""
+Every ruleset regex goes through compile_pattern() at load time:
+
+- exponential risk (a quantifier nested inside an unbounded quantifier,
+  e.g. "(x+x+)+y") is rejected outright;
+- polynomial risk (an unbounded ".*" gap with more pattern after it, e.g.
+  "hard.*fuck.*with") is rewritten so each gap is bounded and, where the
+  next piece is a plain literal or a single run (and not the last), wrapped
+  in an atomic group that commits to its earliest-ending occurrence. The
+  k-th gap is bounded to k x RULE_MAX_GAP characters: committing early can
+  only leave the later gaps longer by what the earlier gaps allowed, so
+  every match whose gaps are all up to RULE_MAX_GAP is still found, while
+  the work per input byte stays around gaps^2 x RULE_MAX_GAP steps;
+- RULE_REGEX_ENGINE=re2 compiles with the linear-time re2 engine instead
+  when the `google-re2` package is installed and the pattern is supported.
+
+Run `python -m app.regex_safety [ruleset.json]` to print the lint report.
+"""
+import re
+import sys
+import json
+import typing as t
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+
+from .utils import get_env
+
+RULE_MAX_GAP = int(get_env("RULE_MAX_GAP", "300"))
+RULE_REGEX_ENGINE = get_env("RULE_REGEX_ENGINE", "re").lower()  # re | re2
+
+SAFE, POLYNOMIAL, EXPONENTIAL = "safe", "polynomial", "exponential"
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+# Repeats above this count are treated like unbounded ones
+_LARGE_REPEAT = 4096
+
+
+class PatternReport(t.NamedTuple):
+    pattern: str
+    risk: str
+    issues: t.List[str]
+    # What actually got compiled (differs from `pattern` when rewritten)
+    compiled: str
+    engine: str
+    # Rough worst-case steps per input position, see pattern_cost()
+    cost: int = 1
+
+
+def _is_unbounded(hi: int) -> bool:
+    return hi == sre_parse.MAXREPEAT or hi > _LARGE_REPEAT
+
+
+def _children(op, av) -> t.List[list]:
+    """Sub-sequences of one parsed node."""
+    if op in _REPEATS:
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return list(av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_parse.GROUPREF_EXISTS:
+        return [b for b in av[1:] if b is not None]
+    return []
+
+
+def _has_backtracking_repeat(items) -> bool:
+    for op, av in items:
+        if op in _REPEATS and av[1] > 1:
+            return True
+        # Atomic groups and possessive repeats never give characters back
+        if op in (sre_parse.ATOMIC_GROUP, sre_parse.POSSESSIVE_REPEAT):
+            continue
+        if any(_has_backtracking_repeat(c) for c in _children(op, av)):
+            return True
+    return False
+
+
+def _is_wide(items) -> bool:
+    """A repeat body that matches (almost) any character, like `.` or `[^x]`."""
+    if len(items) != 1:
+        return False
+    op, av = items[0]
+    return op == sre_parse.ANY or (op == sre_parse.IN and av and av[0][0] == sre_parse.NEGATE)
+
+
+def _lint_sequence(items, issues: t.List[str], top: bool) -> None:
+    items = list(items)
+    for i, (op, av) in enumerate(items):
+        if op in _REPEATS:
+            _, hi, body = av
+            if _is_unbounded(hi) and _has_backtracking_repeat(body):
+                issues.append(f"{EXPONENTIAL}: quantifier nested inside an unbounded quantifier")
+            if _is_unbounded(hi) and _is_wide(body) and i < len(items) - 1:
+                issues.append(f"{POLYNOMIAL}: unbounded wildcard gap followed by more pattern")
+            if i + 1 < len(items) and items[i + 1][0] in _REPEATS:
+                nxt = items[i + 1][1]
+                if _is_unbounded(hi) and _is_unbounded(nxt[1]) and _is_wide(nxt[2]):
+                    issues.append(f"{POLYNOMIAL}: adjacent unbounded quantifiers can match the same text")
+        if op == sre_parse.POSSESSIVE_REPEAT:
+            continue
+        for child in _children(op, av):
+            _lint_sequence(child, issues, top=False)
+
+
+def lint(pattern: str, flags: int = re.I) -> t.Tuple[str, t.List[str]]:
+    """(risk, issues) for one pattern; raises re.error if it does not parse."""
+    issues: t.List[str] = []
+    _lint_sequence(sre_parse.parse(pattern, flags), issues, top=True)
+    issues = list(dict.fromkeys(issues))
+    if any(i.startswith(EXPONENTIAL) for i in issues):
+        return EXPONENTIAL, issues
+    if issues:
+        return POLYNOMIAL, issues
+    return SAFE, issues
+
+
+def _cost(items) -> int:
+    total = 0
+    for op, av in items:
+        if op in _REPEATS or op == sre_parse.POSSESSIVE_REPEAT:
+            lo, hi, body = av
+            # A bounded gap like .{0,300} may be walked to its end at every position
+            total += _cost(body) * (16 if _is_unbounded(hi) else max(1, min(hi, _LARGE_REPEAT)))
+        elif op == sre_parse.BRANCH:
+            total += sum(_cost(b) for b in av[1])
+        else:
+            children = _children(op, av) or ([av] if op == sre_parse.ATOMIC_GROUP else [])
+            total += sum(_cost(c) for c in children) if children else 1
+    return total
+
+
+def pattern_cost(pattern: str, flags: int = re.I) -> int:
+    """
+    Static cost estimate used to order rule evaluation cheapest-first:
+    roughly how many steps the matcher may take per input position.
+    """
+    return max(1, _cost(sre_parse.parse(pattern, flags)))
+
+
+_ONE_CHAR = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN)
+
+
+def _max_width(items) -> t.Optional[int]:
+    """Most characters one match attempt can look at past its start (lookarounds included), or None."""
+    total = 0
+    for op, av in items:
+        if op in _ONE_CHAR:
+            width = 1
+        elif op == sre_parse.AT:
+            width = 0
+        elif op in _REPEATS or op == sre_parse.POSSESSIVE_REPEAT:
+            body = _max_width(av[2])
+            if body is None or av[1] == sre_parse.MAXREPEAT:
+                return None
+            width = body * av[1]
+        elif op == sre_parse.BRANCH:
+            widths = [_max_width(b) for b in av[1]]
+            if None in widths:
+                return None
+            width = max(widths)
+        elif op in (sre_parse.SUBPATTERN, sre_parse.ATOMIC_GROUP, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            width = _max_width(_children(op, av)[0] if op != sre_parse.ATOMIC_GROUP else av)
+            if width is None:
+                return None
+        else:
+            # Backreferences and anything unusual: no static bound
+            return None
+        total += width
+    return total
+
+
+def match_reach(pattern: str, flags: int = re.I) -> t.Optional[int]:
+    """
+    How far around its start position one match attempt can read: the
+    widest match plus lookarounds, plus one character for \\b, ^ and $.
+    None when unbounded (e.g. `.*`). An edit further away than this from an
+    attempt's start cannot change that attempt's outcome.
+    """
+    width = _max_width(sre_parse.parse(pattern, flags))
+    return None if width is None else width + 1
+
+
+def _top_level(pattern: str) -> t.Tuple[t.List[int], t.List[t.Tuple[int, int, int]]]:
+    """Indexes of top-level `|` and top-level `.*` / `.+` gaps as (start, end, min)."""
+    bars: t.List[int] = []
+    gaps: t.List[t.Tuple[int, int, int]] = []
+    depth, i, n = 0, 0, len(pattern)
+    in_class = False
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if in_class:
+            if ch == "]":
+                in_class = False
+        elif ch == "[":
+            in_class = True
+            # A leading "]" (or "^]") is a literal inside the class
+            if pattern[i + 1:i + 2] == "^":
+                i += 1
+            if pattern[i + 1:i + 2] == "]":
+                i += 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and ch == "|":
+            bars.append(i)
+        elif depth == 0 and ch == "." and pattern[i + 1:i + 2] in ("*", "+"):
+            end = i + 2
+            if pattern[end:end + 1] in ("?", "+"):
+                end += 1
+            gaps.append((i, end, 1 if pattern[i + 1] == "+" else 0))
+            i = end
+            continue
+        i += 1
+    return bars, gaps
+
+
+def _is_literal(segment: str, flags: int) -> bool:
+    """No repeats or alternation: the first match is also the earliest-ending one."""
+    def plain(items) -> bool:
+        for op, av in items:
+            if op in _REPEATS or op in (sre_parse.BRANCH, sre_parse.POSSESSIVE_REPEAT, sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                return False
+            if not all(plain(c) for c in _children(op, av)):
+                return False
+        return True
+
+    try:
+        items = sre_parse.parse(segment, flags)
+    except re.error:
+        return False
+    if len(items) == 1 and items[0][0] == sre_parse.MAX_REPEAT and len(items[0][1][2]) == 1:
+        # A run like `\d+` or `\s+`: committing to the first run only shortens
+        # the room left for the next gap by that run's length
+        return plain(items[0][1][2])
+    return plain(items)
+
+
+def _shortest_run(segment: str, flags: int) -> str:
+    """`\\d+` -> `\\d+?`: a single greedy run made lazy; anything else unchanged."""
+    items = sre_parse.parse(segment, flags)
+    if len(items) == 1 and items[0][0] == sre_parse.MAX_REPEAT and segment[-1:] in "+*}" and segment[-2:-1] != "\\":
+        return segment + "?"
+    return segment
+
+
+def _rewrite_branch(branch: str, max_gap: int, flags: int) -> str:
+    _, gaps = _top_level(branch)
+    if not gaps:
+        return branch
+    pieces = [branch[:gaps[0][0]]]
+    for k, (start, end, lo) in enumerate(gaps):
+        segment = branch[end:gaps[k + 1][0] if k + 1 < len(gaps) else len(branch)]
+        # Room for the slack left by earlier commits (see module docstring)
+        gap = f".{{{lo},{(k + 1) * max_gap}}}"
+        final = k == len(gaps) - 1
+        if not segment or final:
+            # Greedy like the original, so the reported match text is unchanged
+            pieces.append(f"{gap}(?:{segment})" if segment else gap)
+        elif _is_literal(segment, flags):
+            # Commit to the earliest-ending occurrence; a run is taken at its
+            # shortest so the next gap starts no later than any other choice
+            pieces.append(f"(?>{gap}?(?:{_shortest_run(segment, flags)}))")
+        else:
+            pieces.append(f"{gap}?(?:{segment})")
+    return "".join(pieces)
+
+
+def rewrite_gaps(pattern: str, max_gap: int = RULE_MAX_GAP, flags: int = re.I) -> str:
+    """Bound every top-level `.*`/`.+` gap (see module docstring)."""
+    bars, _ = _top_level(pattern)
+    bounds = [-1] + bars + [len(pattern)]
+    branches = [pattern[bounds[i] + 1:bounds[i + 1]] for i in range(len(bounds) - 1)]
+    return "|".join(_rewrite_branch(b, max_gap, flags) for b in branches)
+
+
+def _compile_re2(pattern: str, flags: int):
+    try:
+        import re2  # optional: pip install google-re2
+    except ImportError:
+        return None
+    try:
+        return re2.compile(("(?i)" if flags & re.I else "") + pattern)
+    except Exception:
+        return None
+
+
+def compile_pattern(pattern: str, flags: int = re.I, max_gap: int = RULE_MAX_GAP, engine: str = RULE_REGEX_ENGINE) -> t.Tuple[t.Any, PatternReport]:
+    """
+    Lint, rewrite if needed and compile one pattern. Raises ValueError for
+    patterns that cannot be made safe (or do not parse).
+    """
+    try:
+        risk, issues = lint(pattern, flags)
+    except re.error as e:
+        raise ValueError(f"invalid regex ({e})")
+    if risk == EXPONENTIAL:
+        raise ValueError("catastrophic backtracking risk: " + "; ".join(issues))
+
+    if engine == "re2":
+        compiled = _compile_re2(pattern, flags)
+        if compiled is not None:
+            return compiled, PatternReport(pattern, risk, issues, pattern, "re2", pattern_cost(pattern, flags))
+
+    source = pattern
+    if risk == POLYNOMIAL:
+        source = rewrite_gaps(pattern, max_gap, flags)
+        new_risk, _ = lint(source, flags)
+        if new_risk != SAFE:
+            raise ValueError("backtracking risk that cannot be rewritten: " + "; ".join(issues))
+    return re.compile(source, flags), PatternReport(pattern, risk, issues, source, "re", pattern_cost(source, flags))
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    from .detectors import PATTERN_FAMILIES, RULESET_PATH, load_ruleset
+
+    argv = sys.argv[1:] if argv is None else argv
+    ruleset = load_ruleset(argv[0] if argv else RULESET_PATH)
+    failed = 0
+    for family in PATTERN_FAMILIES:
+        for i, pattern in enumerate(ruleset.get(family, [])):
+            try:
+                _, report = compile_pattern(pattern)
+                line = {"id": f"{family}:{i}", **report._asdict()}
+            except ValueError as e:
+                failed += 1
+                line = {"id": f"{family}:{i}", "pattern": pattern, "rejected": str(e)}
+            print(json.dumps(line, ensure_ascii=False))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# ruleset.py - Hot reloading of the detector ruleset file
+import os
+import time
+import threading
+import typing as t
+
+from .utils import get_env
+from .detectors import RULESET_PATH, DetectorEngine, active_engine, build_engine_from_file, swap_engine
+from .metrics import REGISTRY, Counter
+
+# Seconds between mtime checks of the ruleset file; 0 disables the watcher
+RULESET_WATCH_INTERVAL = float(get_env("RULESET_WATCH_INTERVAL", "2"))
+
+RULESET_RELOADS_TOTAL = REGISTRY.register(Counter(
+    "prompt_review_ruleset_reloads_total", "Ruleset reload attempts by trigger and outcome", ("trigger", "outcome"),
+))
+
+
+def _file_stamp(path: str) -> t.Optional[t.Tuple[float, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+class RulesetManager:
+    """
+    Owns the ruleset file and swaps freshly compiled engines into
+    detectors.active_engine(). Compilation happens on the caller's thread
+    (the watcher thread or a threadpool worker), never on a request; the
+    swap itself is a single reference assignment, so in-flight requests
+    finish on the engine they started with. A broken file is reported and
+    the previous engine stays active.
+    """
+
+    def __init__(self, path: str = RULESET_PATH, watch_interval: float = RULESET_WATCH_INTERVAL):
+        self.path = path
+        self.watch_interval = watch_interval
+        self.last_error: t.Optional[str] = None
+        self.loaded_at = time.time()
+        self._stamp = _file_stamp(path)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: t.Optional[threading.Thread] = None
+
+    @property
+    def engine(self) -> DetectorEngine:
+        return active_engine()
+
+    def reload(self, trigger: str = "manual") -> t.Tuple[bool, str]:
+        """Recompile the file and swap it in. Returns (swapped, active version)."""
+        with self._lock:
+            stamp = _file_stamp(self.path)
+            try:
+                engine = build_engine_from_file(self.path)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                RULESET_RELOADS_TOTAL.inc(trigger=trigger, outcome="error")
+                return False, active_engine().version
+            self._stamp = stamp
+            self.last_error = None
+            self.loaded_at = time.time()
+            swap_engine(engine)
+            RULESET_RELOADS_TOTAL.inc(trigger=trigger, outcome="ok")
+            return True, engine.version
+
+    def check(self) -> bool:
+        """Reload if the file changed since the last attempt."""
+        stamp = _file_stamp(self.path)
+        if stamp is None or stamp == self._stamp:
+            return False
+        swapped, _ = self.reload(trigger="watch")
+        # Don't retry a broken file every tick; wait for the next edit
+        self._stamp = stamp
+        return swapped
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self.check()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        if self.watch_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="ruleset-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "version": active_engine().version,
+            "digest": active_engine().digest,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "watching": bool(self._thread and self._thread.is_alive()),
+            "last_error": self.last_error,
+            "rewritten_patterns": [r.pattern for r in active_engine().reports if r.compiled != r.pattern],
+        }
+
+
+RULESETS = RulesetManager()
@@ -0,0 +1,205 @@
+# server.py - Production launcher: prefork workers sharing one listening socket
+"""
+Run from backend/:
+
+    python -m app.server --workers 4 --port 8000
+
+The parent imports the app once, so the ruleset regexes and keyword
+automaton are compiled before forking and shared copy-on-write by every
+worker. Signals to the parent:
+
+    SIGHUP           rolling restart, one worker at a time
+    SIGTERM, SIGINT  graceful shutdown (in-flight requests finish)
+
+Workers that die unexpectedly are replaced. Per-worker stats are on
+/health under "worker".
+"""
+import os
+import gc
+import sys
+import time
+import socket
+import signal
+import argparse
+import typing as t
+
+import uvicorn
+
+from .utils import get_env
+from . import workers
+
+SERVER_HOST = get_env("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(get_env("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(get_env("SERVER_WORKERS", "0"))  # 0 = one per CPU
+SERVER_GRACEFUL_TIMEOUT = float(get_env("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_READY_TIMEOUT = float(get_env("SERVER_READY_TIMEOUT", "30"))
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks and watches the workers; the parent itself never serves requests."""
+
+    def __init__(self, app: t.Any, sock: socket.socket, count: int, graceful_timeout: float = SERVER_GRACEFUL_TIMEOUT, ready_timeout: float = SERVER_READY_TIMEOUT, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.count = count
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.log_level = log_level
+        # Twice the workers so a rolling restart can run old and new side by side
+        self.table = workers.WorkerTable(count * 2)
+        self.generation = 0
+        self.children: t.Dict[int, int] = {}  # pid -> slot
+        self._retiring: t.Set[int] = set()
+        self._stopping = False
+        self._reload = False
+
+    # --- worker side ---
+
+    def _run_worker(self, slot: int) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        workers.attach(self.table, slot, self.generation)
+        from . import main as app_module
+        # Connections opened in the parent (e.g. SQLite) must not be shared
+        app_module.VERDICT_CACHE.after_fork()
+        config = uvicorn.Config(self.app, log_level=self.log_level, timeout_graceful_shutdown=self.graceful_timeout)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    # --- parent side ---
+
+    def spawn(self) -> int:
+        used = set(self.children.values())
+        slot = next(i for i in range(self.table.slots) if i not in used)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(slot)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        return pid
+
+    def reap(self) -> None:
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is not None:
+                self.table.clear(slot)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+            elif not self._stopping:
+                print(f"[server] worker {pid} exited unexpectedly; replacing it", file=sys.stderr)
+                self.spawn()
+
+    def wait_ready(self, pid: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            slot = self.children.get(pid)
+            if slot is None:
+                return False
+            row = self.table.read(slot)
+            if row["pid"] == pid and row["state"] == workers.READY:
+                return True
+            time.sleep(0.05)
+            self.reap()
+        return False
+
+    def retire(self, *pids: int) -> None:
+        """SIGTERM the workers (uvicorn drains them) and wait for all of them against one deadline."""
+        for pid in pids:
+            self._retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while any(pid in self.children for pid in pids) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self.reap()
+        for pid in pids:
+            if pid in self.children:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self.reap()
+
+    def rolling_restart(self) -> None:
+        """Replace workers one at a time: start the new one, wait for ready, then drain the old."""
+        self.generation += 1
+        for old in list(self.children):
+            if self._stopping:
+                return
+            new = self.spawn()
+            if not self.wait_ready(new, self.ready_timeout):
+                print(f"[server] replacement worker {new} not ready; keeping {old}", file=sys.stderr)
+                continue
+            self.retire(old)
+
+    def stop(self) -> None:
+        self._stopping = True
+        # All at once: draining one by one would take up to N graceful timeouts
+        self.retire(*self.children)
+
+    def run(self) -> None:
+        def on_hup(*_):
+            self._reload = True
+
+        def on_stop(*_):
+            self._stopping = True
+
+        signal.signal(signal.SIGHUP, on_hup)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        for _ in range(self.count):
+            self.spawn()
+        print(f"[server] {self.count} workers on pid {os.getpid()}", file=sys.stderr)
+        while not self._stopping:
+            time.sleep(0.2)
+            self.reap()
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+        self.stop()
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the Prompt Review backend with prefork workers.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    # Import (and so compile every detector) once, before forking
+    from .main import app
+    # Move everything allocated so far out of the GC's reach so collections in
+    # the workers don't touch (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    Supervisor(app, sock, max(1, args.workers), log_level=args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# sessions.py - Edit sessions for incremental re-analysis of a prompt being typed
+import time
+import uuid
+import threading
+import typing as t
+from collections import OrderedDict
+
+from .detectors import DetectorEngine, IncrementalScanner
+from .utils import get_env
+
+SESSION_TTL_SECONDS = float(get_env("SESSION_TTL_SECONDS", "900"))
+SESSION_MAX = int(get_env("SESSION_MAX", "10000"))
+# Longest text a session may grow to through edits
+SESSION_MAX_CHARS = int(get_env("SESSION_MAX_CHARS", "200000"))
+
+
+class Edit(t.NamedTuple):
+    """Replace text[offset:offset + delete] with `insert`."""
+    offset: int
+    delete: int
+    insert: str
+
+
+class EditSession:
+    """One prompt under edit: its incremental scanner plus a revision counter."""
+
+    def __init__(self, engine: DetectorEngine, text: str, persona: str):
+        self.id = uuid.uuid4().hex
+        self.persona = persona
+        self.scanner = IncrementalScanner(engine, text)
+        self.revision = 0
+        self.touched_at = time.monotonic()
+        # Edits to one session are applied one request at a time
+        self.lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        return self.scanner.text
+
+    def apply(self, edits: t.Sequence[Edit], engine: DetectorEngine) -> None:
+        """Apply edits in order and bump the revision; ValueError if one does not fit the text."""
+        if engine is not self.scanner.engine:
+            # The ruleset was reloaded: start over from the current text
+            self.scanner = IncrementalScanner(engine, self.scanner.text)
+        size = len(self.scanner.text)
+        for e in edits:
+            if not 0 <= e.offset <= size or e.delete < 0 or e.offset + e.delete > size:
+                raise ValueError(f"edit [{e.offset}:{e.offset + e.delete}] outside text of length {size}")
+            size += len(e.insert) - e.delete
+            if size > SESSION_MAX_CHARS:
+                raise ValueError(f"text would exceed {SESSION_MAX_CHARS} characters")
+        # Every edit was checked against the running length, so none fails half-way
+        for e in edits:
+            self.scanner.edit(e.offset, e.delete, e.insert)
+        self.revision += 1
+
+
+class SessionStore:
+    """
+    In-process edit sessions, dropped after SESSION_TTL_SECONDS without
+    use or when more than SESSION_MAX are open (least recently used
+    first). Sessions live in the worker that created them; with several
+    workers a client whose session is not found simply opens a new one.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX, clock: t.Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self._sessions: "OrderedDict[str, EditSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def _expire(self) -> None:
+        cutoff = self.clock() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched_at > cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session.id]
+            self.expired += 1
+
+    def open(self, engine: DetectorEngine, text: str, persona: str) -> EditSession:
+        if len(text) > SESSION_MAX_CHARS:
+            raise ValueError(f"prompt exceeds {SESSION_MAX_CHARS} characters")
+        session = EditSession(engine, text, persona)
+        session.touched_at = self.clock()
+        with self._lock:
+            self._sessions[session.id] = session
+            self._expire()
+        return session
+
+    def get(self, session_id: str) -> t.Optional[EditSession]:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched_at = self.clock()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "expired": self.expired}
@@ -0,0 +1,39 @@
+# tokens.py - Local token estimates and input trimming for LLM calls
+import math
+
+from .utils import get_env
+
+# Largest prompt sent upstream for any call; longer input is trimmed
+LLM_MAX_INPUT_TOKENS = int(get_env("LLM_MAX_INPUT_TOKENS", "8192"))
+# Roughly 4 bytes of UTF-8 per token: ~4 chars of English, ~1.3 chars of Kannada
+BYTES_PER_TOKEN = 4.0
+# Extra output room for a caller that keeps at most N chars (tokens split unevenly)
+OUTPUT_HEADROOM = 1.5
+_ELISION = "\n[... {} characters omitted ...]\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Upper-leaning estimate without a tokenizer; good enough for budgets."""
+    return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN) if text else 0
+
+
+def tokens_for_chars(chars: int) -> int:
+    """maxOutputTokens for a caller that keeps at most `chars` characters."""
+    return max(16, math.ceil(chars / BYTES_PER_TOKEN * OUTPUT_HEADROOM))
+
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Trim `text` to about `max_tokens`, keeping the start and the end (where
+    the request and any sign-off usually are) around an elision marker.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Work in bytes so multi-byte scripts are budgeted like the estimate
+    keep = int(max_tokens * BYTES_PER_TOKEN) - len(_ELISION.format(len(text)))
+    if keep <= 0:
+        return text.encode("utf-8")[:int(max_tokens * BYTES_PER_TOKEN)].decode("utf-8", "ignore")
+    raw = text.encode("utf-8")
+    head = raw[:keep * 2 // 3].decode("utf-8", "ignore")
+    tail = raw[len(raw) - (keep - keep * 2 // 3):].decode("utf-8", "ignore")
+    return head + _ELISION.format(len(text) - len(head) - len(tail)) + tail
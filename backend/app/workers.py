@@ -0,0 +1,118 @@
+# workers.py - Per-worker stats shared between prefork workers (see server.py)
+import os
+import mmap
+import time
+import struct
+import resource
+import threading
+import typing as t
+
+from .metrics import HTTP_REQUESTS_IN_FLIGHT, HTTP_REQUEST_SECONDS
+
+# pid, state, generation, started_at, heartbeat_at, requests, in_flight, max_rss_kb
+_SLOT = struct.Struct("<qqqddqqq")
+STARTING, READY, DRAINING = 1, 2, 3
+_STATE_NAMES = {STARTING: "starting", READY: "ready", DRAINING: "draining"}
+HEARTBEAT_SECONDS = 1.0
+
+
+class WorkerTable:
+    """
+    Fixed-size table in anonymous shared memory, created by the launcher
+    before forking so every worker maps the same pages. Each worker only
+    writes its own slot; any worker can read all of them.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._buf = mmap.mmap(-1, _SLOT.size * slots)
+
+    def write(self, index: int, pid: int, state: int, generation: int, started_at: float, heartbeat_at: float = 0.0, requests: int = 0, in_flight: int = 0, max_rss_kb: int = 0) -> None:
+        _SLOT.pack_into(self._buf, index * _SLOT.size, pid, state, generation, started_at, heartbeat_at, requests, in_flight, max_rss_kb)
+
+    def update(self, index: int, **fields: t.Any) -> None:
+        row = self.read(index)
+        row.update(fields)
+        self.write(index, row["pid"], row["state"], row["generation"], row["started_at"], row["heartbeat_at"], row["requests"], row["in_flight"], row["max_rss_kb"])
+
+    def read(self, index: int) -> dict:
+        pid, state, generation, started_at, heartbeat_at, requests, in_flight, max_rss_kb = _SLOT.unpack_from(self._buf, index * _SLOT.size)
+        return {
+            "pid": pid, "state": state, "generation": generation, "started_at": started_at,
+            "heartbeat_at": heartbeat_at, "requests": requests, "in_flight": in_flight, "max_rss_kb": max_rss_kb,
+        }
+
+    def clear(self, index: int) -> None:
+        self.write(index, 0, 0, 0, 0.0)
+
+    def snapshot(self) -> t.List[dict]:
+        now = time.time()
+        rows = []
+        for i in range(self.slots):
+            row = self.read(i)
+            if row["pid"] == 0:
+                continue
+            row["slot"] = i
+            row["state"] = _STATE_NAMES.get(row["state"], "unknown")
+            row["uptime_seconds"] = round(now - row["started_at"], 1)
+            rows.append(row)
+        return rows
+
+
+# Set in each forked worker by server.py; None when running a single process
+TABLE: t.Optional[WorkerTable] = None
+SLOT: t.Optional[int] = None
+_stop = threading.Event()
+
+
+def attach(table: WorkerTable, slot: int, generation: int) -> None:
+    """Claim `slot` for this (freshly forked) worker; only the worker writes its slot."""
+    global TABLE, SLOT
+    TABLE, SLOT = table, slot
+    table.write(slot, os.getpid(), STARTING, generation, time.time())
+
+
+def _publish(state: t.Optional[int] = None) -> None:
+    if TABLE is None or SLOT is None:
+        return
+    served = sum(count for _, _, count in HTTP_REQUEST_SECONDS.totals().values())
+    fields = {
+        "heartbeat_at": time.time(),
+        "requests": served,
+        "in_flight": int(HTTP_REQUESTS_IN_FLIGHT.value()),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if state is not None:
+        fields["state"] = state
+    TABLE.update(SLOT, **fields)
+
+
+def _heartbeat() -> None:
+    while not _stop.wait(HEARTBEAT_SECONDS):
+        _publish()
+
+
+def mark_ready() -> None:
+    """Called from the app's startup hook: flag the slot ready and start publishing stats."""
+    if TABLE is None:
+        return
+    _publish(READY)
+    _stop.clear()
+    threading.Thread(target=_heartbeat, name="worker-heartbeat", daemon=True).start()
+
+
+def mark_draining() -> None:
+    _stop.set()
+    _publish(DRAINING)
+
+
+def status() -> dict:
+    """This worker plus, under the prefork launcher, every live worker's stats."""
+    info: dict = {"pid": os.getpid(), "slot": SLOT}
+    if TABLE is not None:
+        rows = TABLE.snapshot()
+        info["count"] = sum(1 for r in rows if r["state"] == "ready")
+        info["workers"] = rows
+    else:
+        info["count"] = 1
+    return info
@@ -0,0 +1,150 @@
+# ws.py - Request multiplexing over one WebSocket connection
+import json
+import asyncio
+import typing as t
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from .metrics import WS_BACKPRESSURE_TOTAL, WS_CONNECTIONS, WS_MESSAGES_TOTAL
+from .utils import get_env
+
+# Requests one connection may have running; past this the server stops reading
+WS_MAX_INFLIGHT = int(get_env("WS_MAX_INFLIGHT", "16"))
+# Outgoing messages buffered per connection; past this producers wait for the client
+WS_SEND_QUEUE = int(get_env("WS_SEND_QUEUE", "64"))
+WS_MAX_MESSAGE_BYTES = int(get_env("WS_MAX_MESSAGE_BYTES", str(1024 * 1024)))
+
+# A handler gets the decoded request and yields (event, data) pairs to send back
+Handler = t.Callable[[dict], t.AsyncIterator[t.Tuple[str, dict]]]
+
+
+class Multiplexer:
+    """
+    Serves one WebSocket connection carrying many concurrent requests.
+
+    Clients send JSON messages {"id": ..., "type": ..., ...}; each runs its
+    handler in its own task and every message sent back carries the
+    request's id plus an "event". The first event of a started request is
+    "accepted": before it a client may safely retry elsewhere, after it the
+    request is running and a retry would repeat it. Backpressure is per connection: with
+    max_inflight requests running the reader stops taking messages (so the
+    client's sends stall in the socket buffers), and when the client reads
+    slower than results arrive the bounded send queue makes handlers wait
+    on it, which also pauses LLM streams mid-way. {"type": "cancel",
+    "id": ...} stops a running request.
+    """
+
+    def __init__(self, websocket: WebSocket, handlers: t.Dict[str, Handler], max_inflight: int = WS_MAX_INFLIGHT,
+                 send_queue: int = WS_SEND_QUEUE, max_message_bytes: int = WS_MAX_MESSAGE_BYTES):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.max_message_bytes = max_message_bytes
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._outbox: "asyncio.Queue[dict]" = asyncio.Queue(send_queue)
+        self._tasks: t.Dict[t.Any, asyncio.Task] = {}
+        # Requests the client cancelled (as opposed to the connection closing)
+        self._cancelled: t.Set[asyncio.Task] = set()
+        # "cancelled" notices waiting for room in the send queue
+        self._notices: t.Set[asyncio.Task] = set()
+        self._closed = False
+
+    async def run(self) -> None:
+        """Serve until the client disconnects; running requests are cancelled then."""
+        await self.websocket.accept()
+        WS_CONNECTIONS.inc()
+        reader = asyncio.create_task(self._read_loop())
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            # The reader ends on disconnect, the sender when a send fails
+            await asyncio.wait({reader, sender}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._closed = True
+            tasks = [reader, sender, *self._tasks.values(), *self._cancelled, *self._notices]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            WS_CONNECTIONS.dec()
+
+    async def send(self, request_id: t.Any, event: str, data: t.Optional[dict] = None) -> None:
+        if self._outbox.full():
+            WS_BACKPRESSURE_TOTAL.inc(reason="send_queue_full")
+        await self._outbox.put({"id": request_id, "event": event, **(data or {})})
+
+    async def _send_loop(self) -> None:
+        while True:
+            message = await self._outbox.get()
+            await self.websocket.send_text(json.dumps(message, default=str))
+
+    async def _read_loop(self) -> None:
+        while True:
+            if self._slots.locked():
+                WS_BACKPRESSURE_TOTAL.inc(reason="max_inflight")
+            await self._slots.acquire()
+            try:
+                raw = await self.websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+            if not await self._dispatch(raw):
+                self._slots.release()
+
+    async def _dispatch(self, raw: str) -> bool:
+        """Start the request in `raw`; False when no task took the slot."""
+        if len(raw) > self.max_message_bytes:
+            await self.send(None, "error", {"status": 413, "detail": f"Message exceeds {self.max_message_bytes} bytes"})
+            return False
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self.send(None, "error", {"status": 400, "detail": "Messages must be JSON objects"})
+            return False
+        request_id, kind = message.get("id"), message.get("type")
+        WS_MESSAGES_TOTAL.inc(type=kind if kind == "cancel" or kind in self.handlers else "invalid")
+        if not isinstance(request_id, (str, int)) or isinstance(request_id, bool):
+            await self.send(None, "error", {"status": 400, "detail": "Every message needs a string or integer id"})
+            return False
+        if kind == "cancel":
+            task = self._tasks.get(request_id)
+            if task is not None and task.cancel():
+                # The id is free again at once, even before the task unwinds
+                del self._tasks[request_id]
+                self._cancelled.add(task)
+            return False
+        handler = self.handlers.get(kind)
+        if handler is None:
+            await self.send(request_id, "error", {"status": 400, "detail": f"Unknown type {kind!r} (valid: {sorted(self.handlers) + ['cancel']})"})
+            return False
+        if request_id in self._tasks:
+            await self.send(request_id, "error", {"status": 409, "detail": "A request with this id is still running"})
+            return False
+        # Queued ahead of anything the handler sends
+        await self.send(request_id, "accepted")
+        task = self._tasks[request_id] = asyncio.create_task(self._run(request_id, handler, message))
+        # Cleanup lives in a done callback: a task cancelled before its first
+        # step never runs any of _run, not even a finally block
+        task.add_done_callback(lambda task: self._finished(request_id, task))
+        return True
+
+    def _finished(self, request_id: t.Any, task: asyncio.Task) -> None:
+        if self._tasks.get(request_id) is task:
+            del self._tasks[request_id]
+        self._slots.release()
+        if task in self._cancelled:
+            self._cancelled.discard(task)
+            if task.cancelled() and not self._closed:
+                notice = asyncio.create_task(self.send(request_id, "cancelled"))
+                self._notices.add(notice)
+                notice.add_done_callback(self._notices.discard)
+
+    async def _run(self, request_id: t.Any, handler: Handler, message: dict) -> None:
+        try:
+            async for event, data in handler(message):
+                await self.send(request_id, event, data)
+        except HTTPException as e:
+            await self.send(request_id, "error", {"status": e.status_code, "detail": e.detail})
+        except ValidationError as e:
+            await self.send(request_id, "error", {"status": 422, "detail": e.errors(include_url=False)})
+        except Exception as e:
+            await self.send(request_id, "error", {"status": 500, "detail": f"{type(e).__name__}: {e}"})
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the analyze pipeline.
+
+Runs the detector functions, analyze() and the full FastAPI app in-process
+(stub LLM forced via USE_STUB, verdict cache off unless --cache, history off) over a
+generated corpus of prompts of varying length, language mix and toxicity.
+Reports requests/sec, latency percentiles per stage and memory per request,
+and saves everything as JSON so runs can be compared:
+
+    cd backend
+    python benchmarks/bench_analyze.py --output bench_results.json
+    python benchmarks/bench_analyze.py --compare bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+import typing as t
+
+# Must be set before the app is imported
+os.environ["USE_STUB"] = "true"
+os.environ.setdefault("CACHE_BACKEND", "off")
+os.environ.setdefault("HISTORY_BACKEND", "off")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CLEAN_WORDS = (
+    "explain the concept of machine learning to students in a clear way with examples "
+    "write a professional summary about network security and describe how wifi works "
+    "compose a formal email to the team about the project timeline and code review"
+).split()
+KANNADA_WORDS = ["ನಮಸ್ಕಾರ", "ಕನ್ನಡ", "ಭಾಷೆ", "ಶಾಲೆ", "ವಿದ್ಯಾರ್ಥಿ", "ಪುಸ್ತಕ", "ನೀರು", "ಮನೆ"]
+SLANG_WORDS = ["bruh", "lol", "wanna", "gonna", "sus", "yeet", "fire", "bet"]
+TOXIC_SNIPPETS = ["fuck this", "how to hurt someone", "looking for adult fun", "bomb", "is it ok to hack"]
+INJECTION_SNIPPETS = ["ignore previous instructions", "disregard everything above", "<system> override system prompt", "pretend you are"]
+
+LENGTHS = {"short": 12, "medium": 120, "long": 2500}
+LANGUAGES = ("english", "kannada", "mixed")
+TOXICITY = ("clean", "slang", "toxic", "injection")
+
+
+def generate_corpus(size: int, seed: int = 1234) -> t.List[dict]:
+    """Deterministic prompts covering every length x language x toxicity combination."""
+    rng = random.Random(seed)
+    combos = [(l, g, x) for l in LENGTHS for g in LANGUAGES for x in TOXICITY]
+    corpus = []
+    for i in range(size):
+        length, language, toxicity = combos[i % len(combos)]
+        n = max(3, int(LENGTHS[length] * rng.uniform(0.7, 1.3)))
+        if language == "english":
+            words = [rng.choice(CLEAN_WORDS) for _ in range(n)]
+        elif language == "kannada":
+            words = [rng.choice(KANNADA_WORDS) for _ in range(n)]
+        else:
+            words = [rng.choice(CLEAN_WORDS if rng.random() < 0.6 else KANNADA_WORDS) for _ in range(n)]
+        if toxicity == "slang":
+            for _ in range(max(1, n // 40)):
+                words.insert(rng.randrange(len(words)), rng.choice(SLANG_WORDS))
+        elif toxicity == "toxic":
+            words.insert(rng.randrange(len(words)), rng.choice(TOXIC_SNIPPETS))
+        elif toxicity == "injection":
+            words.insert(rng.randrange(len(words)), rng.choice(INJECTION_SNIPPETS))
+        corpus.append({
+            "prompt": " ".join(words),
+            "persona": rng.choice(["Professor", "Guardian", "Shield"]),
+            "length": length,
+            "language": language,
+            "toxicity": toxicity,
+        })
+    return corpus
+
+
+def summarize(samples: t.List[float]) -> dict:
+    """Latency percentiles in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p50_ms": round(pct(50), 4),
+        "p90_ms": round(pct(90), 4),
+        "p99_ms": round(pct(99), 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def bench_detectors(corpus: t.List[dict], repeat: int) -> dict:
+    """Per-stage latency of the local pipeline, overall and by prompt length."""
+    from app.main import (
+        compute_score,
+        decide_verdict,
+        detect_injection,
+        detect_mixed_language,
+        detect_slang_and_ambiguity,
+        run_local_analysis,
+        scan_prompt,
+        simple_costar_extract,
+    )
+
+    stages: t.Dict[str, t.List[float]] = {"scan": [], "detect": [], "costar": [], "verdict": [], "local_total": []}
+    by_length: t.Dict[str, t.List[float]] = {k: [] for k in LENGTHS}
+    for _ in range(repeat):
+        for item in corpus:
+            prompt = item["prompt"]
+            t0 = time.perf_counter()
+            scan = scan_prompt(prompt)
+            t1 = time.perf_counter()
+            detect_mixed_language(prompt, scan)
+            hits = detect_slang_and_ambiguity(prompt, scan)
+            detect_injection(prompt, scan)
+            t2 = time.perf_counter()
+            costar = simple_costar_extract(prompt)
+            t3 = time.perf_counter()
+            decide_verdict(len(hits), scan, hits)
+            compute_score(len(hits), costar)
+            t4 = time.perf_counter()
+            run_local_analysis(prompt)
+            t5 = time.perf_counter()
+            stages["scan"].append(t1 - t0)
+            stages["detect"].append(t2 - t0)
+            stages["costar"].append(t3 - t2)
+            stages["verdict"].append(t4 - t3)
+            stages["local_total"].append(t5 - t4)
+            by_length[item["length"]].append(t5 - t4)
+    total = sum(stages["local_total"])
+    return {
+        "stages": {k: summarize(v) for k, v in stages.items()},
+        "local_total_by_length": {k: summarize(v) for k, v in by_length.items()},
+        "local_prompts_per_sec": round(len(stages["local_total"]) / total, 1) if total else None,
+    }
+
+
+def bench_analyze(corpus: t.List[dict], repeat: int) -> dict:
+    """analyze() called directly on one event loop (no HTTP)."""
+    from app.main import AnalyzeRequest, analyze
+
+    requests_ = [AnalyzeRequest(prompt=i["prompt"], persona=i["persona"]) for i in corpus]
+
+    async def run() -> t.List[float]:
+        samples = []
+        for _ in range(repeat):
+            for req in requests_:
+                t0 = time.perf_counter()
+                await analyze(req)
+                samples.append(time.perf_counter() - t0)
+        return samples
+
+    start = time.perf_counter()
+    samples = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return {"latency": summarize(samples), "requests_per_sec": round(len(samples) / elapsed, 1)}
+
+
+def bench_app(corpus: t.List[dict], concurrency: int, path: str) -> dict:
+    """Full FastAPI app through an in-process ASGI transport with N concurrent clients."""
+    import httpx
+    from app.main import app
+
+    async def run() -> t.Tuple[t.List[float], int, float]:
+        samples: t.List[float] = []
+        errors = 0
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in corpus:
+            queue.put_nowait({"prompt": item["prompt"], "persona": item["persona"]})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def worker():
+                nonlocal errors
+                while not queue.empty():
+                    body = queue.get_nowait()
+                    t0 = time.perf_counter()
+                    resp = await client.post(path, json=body)
+                    samples.append(time.perf_counter() - t0)
+                    if resp.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return samples, errors, time.perf_counter() - start
+
+    samples, errors, elapsed = asyncio.run(run())
+    return {
+        "latency": summarize(samples),
+        "requests_per_sec": round(len(samples) / elapsed, 1),
+        "errors": errors,
+        "concurrency": concurrency,
+    }
+
+
+def bench_memory(corpus: t.List[dict], sample: int) -> dict:
+    """Peak traced allocation per analyze() call, overall and by prompt length."""
+    from app.main import AnalyzeRequest, analyze
+
+    peaks: t.Dict[str, t.List[int]] = {k: [] for k in LENGTHS}
+
+    async def run():
+        tracemalloc.start()
+        try:
+            for item in corpus[:sample]:
+                req = AnalyzeRequest(prompt=item["prompt"], persona=item["persona"])
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                await analyze(req)
+                peaks[item["length"]].append(tracemalloc.get_traced_memory()[1] - base)
+        finally:
+            tracemalloc.stop()
+
+    asyncio.run(run())
+    every = [p for v in peaks.values() for p in v]
+    return {
+        "mean_peak_bytes": int(statistics.fmean(every)) if every else 0,
+        "max_peak_bytes": max(every) if every else 0,
+        "mean_peak_bytes_by_length": {k: int(statistics.fmean(v)) for k, v in peaks.items() if v},
+    }
+
+
+def _git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _flatten(data: t.Any, prefix: str = "") -> t.Dict[str, float]:
+    out: t.Dict[str, float] = {}
+    if isinstance(data, dict):
+        for k, v in data.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else k))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        out[prefix] = float(data)
+    return out
+
+
+def compare(current: dict, baseline: dict) -> t.List[str]:
+    """One line per shared metric: baseline -> current and the relative change."""
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(current.get("results", {}))
+    lines = []
+    for key in sorted(set(old) & set(new)):
+        if key.endswith(".count") or key.endswith("concurrency") or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        lines.append(f"{key:60s} {old[key]:>12.4f} -> {new[key]:>12.4f}  ({change:+.1f}%)")
+    return lines
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the prompt analyze pipeline in-process.")
+    parser.add_argument("--size", type=int, default=360, help="number of generated prompts")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus for detector/analyze benches")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients for the app bench")
+    parser.add_argument("--memory-sample", type=int, default=120, help="prompts traced for memory per request")
+    parser.add_argument("--cache", action="store_true", help="leave the verdict cache on (default: off)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    if args.cache:
+        os.environ["CACHE_BACKEND"] = "memory"
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    corpus = generate_corpus(args.size, args.seed)
+
+    results = {
+        "detectors": bench_detectors(corpus, args.repeat),
+        "analyze": bench_analyze(corpus, args.repeat),
+        "app_analyze": bench_app(corpus, args.concurrency, "/api/analyze"),
+        "app_chat": bench_app(corpus, args.concurrency, "/api/chat"),
+        "memory": bench_memory(corpus, args.memory_sample),
+    }
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "corpus_chars": sum(len(i["prompt"]) for i in corpus),
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"\nSaved results to {args.output}")
+
+    if baseline is not None:
+        print(f"\nComparison against {args.compare} ({baseline.get('meta', {}).get('git_commit')}):")
+        for line in compare(report, baseline):
+            print(line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
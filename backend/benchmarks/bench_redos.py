@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Worst-case match time for every ruleset regex on adversarial inputs.
+
+For each pattern the harness builds inputs designed to make a backtracking
+engine work hard: the pattern's own literal words repeated without the one
+that completes a match, long runs of spaces, digits and letters. It times
+search() on each at several sizes (up to 100KB by default) and reports the
+worst time and ns per input byte, for the compiled (linted/rewritten)
+pattern and, up to --original-max-bytes, for the original one:
+
+    cd backend
+    python benchmarks/bench_redos.py --output redos_results.json
+    python benchmarks/bench_redos.py --max-ns-per-byte 2000   # exit 1 if exceeded
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import typing as t
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.detectors import PATTERN_FAMILIES, RULESET_PATH, load_ruleset  # noqa: E402
+from app.regex_safety import compile_pattern  # noqa: E402
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+
+def _fill(unit: str, size: int) -> str:
+    return (unit * (size // max(1, len(unit)) + 1))[:size]
+
+
+def adversarial_inputs(pattern: str, size: int) -> t.Dict[str, str]:
+    """Named inputs of `size` chars that match a prefix of `pattern` over and over."""
+    words = re.findall(r"[A-Za-z]{2,}", pattern)
+    inputs = {
+        "spaces": _fill(" ", size),
+        "digits": _fill("7", size),
+        "letters": _fill("a", size),
+    }
+    if words:
+        # Everything but the last word: each start position runs to the end of the text
+        inputs["prefix_words"] = _fill(" ".join(words[:-1] or words) + " 1 ", size)
+        inputs["first_word"] = _fill(words[0] + " ", size)
+        inputs["first_word_tail"] = _fill(words[0], size // 2) + _fill(" ", size - size // 2)
+    return inputs
+
+
+def worst_case(regex: t.Any, pattern: str, size: int) -> dict:
+    worst = {"input": None, "seconds": 0.0}
+    for name, text in adversarial_inputs(pattern, size).items():
+        start = time.perf_counter()
+        regex.search(text)
+        elapsed = time.perf_counter() - start
+        if elapsed >= worst["seconds"]:
+            worst = {"input": name, "seconds": elapsed}
+    worst["ns_per_byte"] = round(worst["seconds"] * 1e9 / size, 1)
+    worst["seconds"] = round(worst["seconds"], 6)
+    return worst
+
+
+def bench_patterns(ruleset: dict, sizes: t.Sequence[int], original_max_bytes: int) -> t.List[dict]:
+    rows = []
+    for family in PATTERN_FAMILIES:
+        for i, pattern in enumerate(ruleset.get(family, [])):
+            row: dict = {"id": f"{family}:{i}", "pattern": pattern}
+            try:
+                regex, report = compile_pattern(pattern)
+            except ValueError as e:
+                row["rejected"] = str(e)
+                rows.append(row)
+                continue
+            row.update(risk=report.risk, compiled=report.compiled, engine=report.engine)
+            row["compiled_worst"] = {str(n): worst_case(regex, pattern, n) for n in sizes}
+            if report.compiled != report.pattern:
+                original = re.compile(pattern, re.I)
+                row["original_worst"] = {str(n): worst_case(original, pattern, n) for n in sizes if n <= original_max_bytes}
+            rows.append(row)
+    return rows
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time every ruleset regex on adversarial inputs.")
+    parser.add_argument("ruleset", nargs="?", default=RULESET_PATH)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated input sizes in chars")
+    parser.add_argument("--original-max-bytes", type=int, default=10_000, help="largest input tried on un-rewritten patterns")
+    parser.add_argument("--max-ns-per-byte", type=float, default=0, help="fail if any compiled pattern is slower (0 = report only)")
+    parser.add_argument("--output", default="redos_results.json")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    rows = bench_patterns(load_ruleset(args.ruleset), sizes, args.original_max_bytes)
+    largest = str(max(sizes))
+    worst = max((r for r in rows if "compiled_worst" in r), key=lambda r: r["compiled_worst"][largest]["ns_per_byte"], default=None)
+    report = {
+        "ruleset": args.ruleset,
+        "sizes": sizes,
+        "worst_ns_per_byte": worst and worst["compiled_worst"][largest]["ns_per_byte"],
+        "worst_pattern": worst and worst["id"],
+        "patterns": rows,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in rows:
+        if "rejected" in r:
+            print(f"{r['id']:<16} REJECTED  {r['rejected']}")
+            continue
+        line = f"{r['id']:<16} {r['risk']:<11} {r['compiled_worst'][largest]['ns_per_byte']:>10} ns/byte"
+        if r.get("original_worst"):
+            size, res = max(r["original_worst"].items(), key=lambda kv: int(kv[0]))
+            line += f"   (original at {size}: {res['ns_per_byte']} ns/byte)"
+        print(line)
+    print(f"worst compiled: {report['worst_pattern']} at {report['worst_ns_per_byte']} ns/byte; saved {args.output}")
+
+    failed = any("rejected" in r for r in rows)
+    if args.max_ns_per_byte and report["worst_ns_per_byte"] and report["worst_ns_per_byte"] > args.max_ns_per_byte:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini API, for load tests that should exercise the
+real HTTP path (pool, gateway, retries) without a key or quota.
+
+Serves generateContent, streamGenerateContent (SSE) and cachedContents for any model with
+the stub provider's deterministic answers, after a configurable latency and
+with an optional share of 503s. Point the service at it with LLM_PROVIDER=mock:
+
+    cd backend
+    python benchmarks/mock_llm_server.py --port 8099 --latency-ms 300 --error-rate 0.02
+    LLM_PROVIDER=mock LLM_MOCK_URL=http://127.0.0.1:8099/v1beta/models/mock:generateContent uvicorn app.main:app
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import typing as t
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse, StreamingResponse  # noqa: E402
+
+from app.providers import stub_llm_response  # noqa: E402
+
+# Rough chars per token, to honour maxOutputTokens
+CHARS_PER_TOKEN = 4
+
+
+def _text(content: t.Optional[dict]) -> str:
+    return "".join(part.get("text", "") for part in (content or {}).get("parts") or [])
+
+
+def _answer(body: dict, contexts: t.Dict[str, str]) -> str:
+    prompt = "".join(_text(content) for content in body.get("contents") or [])
+    system = contexts.get(body.get("cachedContent", "")) or _text(body.get("systemInstruction")) or None
+    limit = (body.get("generationConfig") or {}).get("maxOutputTokens")
+    text = stub_llm_response(prompt, system)
+    return text[:limit * CHARS_PER_TOKEN] if limit else text
+
+
+def _event(text: str) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def create_app(latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0, chunk_chars: int = 64, chunk_delay_ms: float = 0.0, seed: t.Optional[int] = None) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+    rng = random.Random(seed)
+    app.state.calls = 0
+    # cachedContents name -> system instruction text
+    app.state.contexts = {}
+
+    async def delay() -> bool:
+        """Sleep for the configured latency; False means answer with a 503."""
+        app.state.calls += 1
+        await asyncio.sleep(max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000.0)
+        return rng.random() >= error_rate
+
+    @app.post("/v1beta/cachedContents")
+    async def cache_context(request: Request):
+        body = await request.json()
+        name = f"cachedContents/{len(app.state.contexts) + 1}"
+        app.state.contexts[name] = _text(body.get("systemInstruction"))
+        return {"name": name, "model": body.get("model"), "ttl": body.get("ttl")}
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate(model: str, request: Request):
+        body = await request.json()
+        if not await delay():
+            return JSONResponse({"error": {"code": 503, "status": "UNAVAILABLE"}}, status_code=503)
+        return _event(_answer(body, app.state.contexts))
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream(model: str, request: Request):
+        body = await request.json()
+        if not await delay():
+            return JSONResponse({"error": {"code": 503, "status": "UNAVAILABLE"}}, status_code=503)
+        text = _answer(body, app.state.contexts)
+
+        async def events() -> t.AsyncIterator[str]:
+            for i in range(0, len(text), chunk_chars):
+                yield f"data: {json.dumps(_event(text[i:i + chunk_chars]))}\n\n"
+                await asyncio.sleep(chunk_delay_ms / 1000.0)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a Gemini-compatible mock LLM for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 503")
+    parser.add_argument("--chunk-delay-ms", type=float, default=20.0, help="pause between streamed chunks")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, chunk_delay_ms=args.chunk_delay_ms, seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+
+# Tests never write analysis history to the real data directory; test_history
+# builds its own stores under tmp_path
+os.environ.setdefault("HISTORY_BACKEND", "off")
@@ -0,0 +1,49 @@
+import os
+import asyncio
+
+os.environ.setdefault("USE_STUB", "true")
+
+from fastapi.testclient import TestClient
+
+import app.main as main
+
+
+def test_batch_dedupes_bounds_concurrency_and_keeps_order(monkeypatch):
+    """Duplicate prompts share one analysis and rewrites never exceed the limit."""
+    main.VERDICT_CACHE.clear()
+    state = {"active": 0, "peak": 0, "calls": 0}
+
+    async def fake_generate(prompt, **kwargs):
+        state["calls"] += 1
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return "A clear and professional request."
+
+    monkeypatch.setattr(main, "call_gemini_generate", fake_generate)
+    prompts = [f"Explain topic number {i} to students" for i in range(6)]
+    items = [{"prompt": p} for p in prompts] + [{"prompt": prompts[0]}, {"prompt": "fuck this"}]
+
+    resp = TestClient(main.app).post("/api/analyze/batch", json={"items": items, "max_concurrency": 2})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["unique_prompts"] == 7
+    assert [r["index"] for r in data["results"]] == list(range(8))
+    assert all(r["ok"] for r in data["results"])
+    assert data["results"][6]["result"] == data["results"][0]["result"]
+    assert data["results"][7]["result"]["verdict"] == "BLOCK"
+    assert state["calls"] == 6 and state["peak"] <= 2
+
+
+def test_bad_options_fail_only_their_item():
+    """An item with invalid options gets its own error; the rest of the batch is analyzed."""
+    main.VERDICT_CACHE.clear()
+    items = [{"prompt": "hello there"}, {"prompt": "x", "options": {"detail": "bogus"}}, {"prompt": "y", "options": {"stages": ["translate"]}}]
+    resp = TestClient(main.app).post("/api/analyze/batch", json={"items": items})
+    assert resp.status_code == 200
+    first, bad_detail, bad_stage = resp.json()["results"]
+    assert first["ok"] and first["result"]["verdict"]
+    assert not bad_detail["ok"] and bad_detail["index"] == 1
+    assert bad_detail["error"] == "HTTPException: 400: options.detail must be one of ['verdict', 'full']"
+    assert not bad_stage["ok"] and bad_stage["error"].startswith("HTTPException: 400:")
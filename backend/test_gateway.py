@@ -0,0 +1,163 @@
+import os
+import asyncio
+
+os.environ.setdefault("USE_STUB", "true")
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.gateway import AIMDLimiter, CircuitBreaker, CircuitOpenError, ConcurrencyLimited, LLMGateway
+from app.llm_client import AsyncLLMClient
+from app.main import app
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _client(handler, gateway):
+    return AsyncLLMClient(transport=httpx.MockTransport(handler), gateway=gateway, coalesce=False)
+
+
+def test_breaker_trips_fails_fast_and_half_opens():
+    """Consecutive failures open the circuit; one probe after the reset timeout closes it."""
+    clock = FakeClock()
+    calls = []
+    status = {"code": 500}
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(status["code"], json={"ok": True})
+
+    gateway = LLMGateway("test", breaker=CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock), max_retries=0)
+    client = _client(handler, gateway)
+
+    async def post():
+        return await client.post_json("http://llm.test/g", {"p": 1})
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await post()
+        with pytest.raises(CircuitOpenError):
+            await post()
+        assert len(calls) == 2 and gateway.status()["circuit"] == "open"
+
+        clock.now += 10
+        status["code"] = 200
+        assert await post() == {"ok": True}
+        assert gateway.status()["circuit"] == "closed"
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_half_open_probe_failure_reopens():
+    """A failed probe opens the circuit again straight away."""
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow() and not breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+
+
+def test_retries_only_429_and_503_with_jittered_backoff():
+    """429/503 are retried with backoff (Retry-After wins); other errors are not."""
+    delays = []
+    responses = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    def handler(request):
+        return responses.pop(0)
+
+    gateway = LLMGateway("test", max_retries=2, base_delay=1, max_delay=8, rng=lambda: 0.5, sleep=fake_sleep)
+    client = _client(handler, gateway)
+
+    async def run():
+        responses[:] = [httpx.Response(503), httpx.Response(429, headers={"Retry-After": "3"}), httpx.Response(200, json={"ok": 1})]
+        assert await client.post_json("http://llm.test/g", {}) == {"ok": 1}
+        assert delays == [0.5, 3.0]
+
+        responses[:] = [httpx.Response(500)]
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.post_json("http://llm.test/g", {})
+        responses[:] = [httpx.Response(503)] * 3
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.post_json("http://llm.test/g", {})
+        assert responses == []
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_aimd_limiter_grows_on_success_and_shrinks_on_overload():
+    """Fast successes add 1/limit; overload multiplies the limit down; excess calls are rejected."""
+    limiter = AIMDLimiter(initial=2, min_limit=1, max_limit=4, backoff=0.5, latency_target=1)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.1, overloaded=False)
+    assert limiter.limit == 2.5
+    limiter.release(0.1, overloaded=True)
+    assert limiter.limit == 1.25
+    assert limiter.try_acquire()
+    limiter.release(2.0, overloaded=False)  # slower than target counts as overload
+    assert limiter.limit == 1
+
+
+def test_slow_stream_does_not_shrink_the_limit():
+    """A stream that starts quickly but is read slowly counts as a fast success."""
+    async def handler(request):
+        return httpx.Response(200, text="".join(f'data: {{"i": {i}}}\n\n' for i in range(3)))
+
+    gateway = LLMGateway("test", limiter=AIMDLimiter(initial=4, max_limit=8, latency_target=0.05))
+    client = _client(handler, gateway)
+
+    async def run():
+        async for _ in client.stream_sse("http://llm.test/s", {}):
+            await asyncio.sleep(0.05)  # slow reader: the whole stream takes ~0.15s
+        await client.aclose()
+
+    asyncio.run(run())
+    assert gateway.limiter.limit == 4.25 and gateway.limiter.in_flight == 0
+
+
+def test_over_limit_calls_are_rejected_without_upstream():
+    """A call over the concurrency limit raises ConcurrencyLimited immediately."""
+    release = None
+
+    async def handler(request):
+        await release.wait()
+        return httpx.Response(200, json={})
+
+    gateway = LLMGateway("test", limiter=AIMDLimiter(initial=1, max_limit=1))
+    client = _client(handler, gateway)
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(client.post_json("http://llm.test/g", {"a": 1}))
+        await asyncio.sleep(0)
+        with pytest.raises(ConcurrencyLimited):
+            await client.post_json("http://llm.test/g", {"a": 2})
+        release.set()
+        assert await first == {}
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_health_reports_gateway_state():
+    """/health exposes circuit and limiter state."""
+    state = TestClient(app).get("/health").json()["llm_gateway"]
+    assert state["circuit"] == "closed"
+    assert state["in_flight"] == 0
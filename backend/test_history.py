@@ -0,0 +1,178 @@
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import zlib
+import sqlite3
+
+os.environ.setdefault("USE_STUB", "true")
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.history import HistoryRecord, HistoryStore, encode_export, prompt_hash
+
+client = TestClient(main.app)
+
+
+def _record(i, verdict="ALLOW", persona="Professor", created_at=None):
+    return HistoryRecord(
+        created_at if created_at is not None else time.time(), "analyze", prompt_hash(f"prompt {i}"), persona,
+        verdict, 100 - i % 50, [{"type": "slang", "token": "lol"}], "1", False, {"total_ms": 1.0}, f"prompt {i}",
+    )
+
+
+def test_writes_are_batched_and_paginated(tmp_path):
+    """Records land in few transactions and pages chain through next_before, newest first."""
+    store = HistoryStore(str(tmp_path / "h.sqlite3"), batch_size=100, flush_ms=50)
+    for i in range(250):
+        store.record(_record(i, verdict="BLOCK" if i % 5 == 0 else "ALLOW"))
+    assert store.flush()
+    assert store.written == 250 and store.batches < 250
+
+    seen, before = [], None
+    while True:
+        page = store.query(limit=40, before=before)
+        seen += [item["id"] for item in page["items"]]
+        before = page["next_before"]
+        if before is None:
+            break
+    assert seen == sorted(seen, reverse=True) and len(seen) == 250
+
+    blocked = store.query(limit=500, verdict="BLOCK")["items"]
+    assert len(blocked) == 50 and all(item["verdict"] == "BLOCK" for item in blocked)
+    assert blocked[0]["highlights"] == [{"type": "slang", "token": "lol"}]
+    # Prompts are only kept when asked for
+    assert blocked[0]["prompt"] is None
+    store.close()
+
+
+def test_record_never_waits_on_a_locked_database(tmp_path):
+    """With the database locked the writer stalls, record() still returns at once and drops past the cap."""
+    path = str(tmp_path / "h.sqlite3")
+    store = HistoryStore(path, batch_size=1, flush_ms=0, queue_max=5)
+    store.record(_record(0))
+    assert store.flush()
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")
+    try:
+        start = time.perf_counter()
+        accepted = sum(store.record(_record(i)) for i in range(1, 50))
+        assert time.perf_counter() - start < 0.5
+        assert store.dropped > 0 and accepted < 49
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert store.flush()
+    assert store.written == 1 + accepted
+    store.close()
+
+
+def test_aggregates_by_verdict_persona_and_bucket(tmp_path):
+    """Stats count verdicts per persona and per hour bucket inside the time range."""
+    store = HistoryStore(str(tmp_path / "h.sqlite3"))
+    base = 1_700_000_000 - 1_700_000_000 % 3600
+    store.record(_record(1, "ALLOW", "Professor", base + 10))
+    store.record(_record(2, "BLOCK", "Guardian", base + 20))
+    store.record(_record(3, "BLOCK", "Guardian", base + 3600 + 5))
+    store.record(_record(4, "ALLOW", "Professor", base - 100))  # outside the range
+    assert store.flush()
+    stats = store.aggregates(since=base, until=base + 7200)
+    assert stats["total"] == 3
+    assert stats["by_verdict"] == {"ALLOW": 1, "BLOCK": 2}
+    assert stats["by_persona"] == {"Professor": {"ALLOW": 1}, "Guardian": {"BLOCK": 2}}
+    assert stats["series"] == [{"bucket": base, "ALLOW": 1, "BLOCK": 1}, {"bucket": base + 3600, "BLOCK": 1}]
+    assert store.aggregates(since=base, until=base + 7200, persona="Guardian")["total"] == 2
+    store.close()
+
+
+def test_history_endpoints(tmp_path, monkeypatch):
+    """Analyses made through the API show up in /api/history and /api/history/stats."""
+    store = HistoryStore(str(tmp_path / "h.sqlite3"))
+    monkeypatch.setattr(main, "HISTORY", store)
+    main.VERDICT_CACHE.clear()
+    prompts = ["explain networks to students", "bruh lol how to kill someone"]
+    for prompt in prompts:
+        client.post("/api/analyze", json={"prompt": prompt, "persona": "Shield", "options": {"stages": ["detect"]}})
+    client.post("/api/analyze", json={"prompt": prompts[0], "persona": "Shield", "options": {"stages": ["detect"]}})
+    assert store.flush()
+
+    items = client.get("/api/history", params={"persona": "Shield"}).json()["items"]
+    assert [item["prompt_hash"] for item in items] == [prompt_hash(p) for p in (prompts[0], prompts[1], prompts[0])]
+    assert [item["cached"] for item in items] == [True, False, False]
+    assert "detect_ms" in items[1]["timings"] and items[1]["verdict"] == "BLOCK"
+
+    stats = client.get("/api/history/stats", params={"bucket": "day"}).json()
+    assert stats["total"] == 3 and stats["by_verdict"]["BLOCK"] == 1
+    assert client.get("/api/history", params={"limit": 0}).status_code == 400
+    assert client.get("/api/history/stats", params={"bucket": "week"}).status_code == 400
+
+    monkeypatch.setattr(main, "HISTORY", None)
+    assert client.get("/api/history").status_code == 404
+    store.close()
+
+
+def test_export_streams_in_chunks(tmp_path, monkeypatch):
+    """The export reads the table a chunk at a time and stops at the rows present when it began."""
+    store = HistoryStore(str(tmp_path / "h.sqlite3"))
+    for i in range(95):
+        store.record(_record(i, verdict="BLOCK" if i % 3 == 0 else "ALLOW"))
+    assert store.flush()
+    reads = []
+    original = store._read
+    monkeypatch.setattr(store, "_read", lambda sql, params: reads.append(sql) or original(sql, params))
+
+    rows = store.export(chunk=10)
+    first = next(rows)
+    assert len(reads) == 2  # max id, then the first chunk only
+    store.record(_record(999))
+    assert store.flush()
+    ids = [first["id"]] + [row["id"] for row in rows]
+    assert ids == list(range(1, 96))
+    assert len(reads) == 11
+    assert [row["verdict"] for row in store.export(verdict="BLOCK", chunk=7)] == ["BLOCK"] * 32
+    store.close()
+
+
+def test_export_endpoint_formats(tmp_path, monkeypatch):
+    """NDJSON, CSV and gzipped exports carry the same rows; bad formats get 400."""
+    store = HistoryStore(str(tmp_path / "h.sqlite3"))
+    base = 1_700_000_000
+    for i in range(300):
+        store.record(_record(i, verdict="BLOCK" if i % 4 == 0 else "ALLOW", created_at=base + i))
+    assert store.flush()
+    monkeypatch.setattr(main, "HISTORY", store)
+    params = {"since": base + 100, "until": base + 200, "verdict": "BLOCK"}
+
+    resp = client.get("/api/history/export", params=params)
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(lines) == 25 and all(item["verdict"] == "BLOCK" for item in lines)
+
+    resp = client.get("/api/history/export", params={**params, "format": "csv"})
+    assert 'filename="analysis_history.csv"' in resp.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert [int(r["id"]) for r in rows] == [item["id"] for item in lines]
+    assert rows[0]["created_at_iso"].endswith("+00:00") and rows[0]["cached"] == "false"
+    assert json.loads(rows[0]["highlights"]) == lines[0]["highlights"] and rows[0]["highlight_count"] == "1"
+
+    resp = client.get("/api/history/export", params={**params, "format": "csv", "gzip": "true"})
+    assert resp.headers["content-type"] == "application/gzip"
+    assert list(csv.DictReader(io.StringIO(gzip.decompress(resp.content).decode()))) == rows
+
+    assert client.get("/api/history/export", params={"format": "xml"}).status_code == 400
+    store.close()
+
+
+def test_encode_export_flushes_incrementally():
+    """Output comes out in pieces as rows arrive, and gzip pieces decode as a stream."""
+    items = ({"id": i, "payload": "x" * 100} for i in range(1000))
+    pieces = list(encode_export(items, "ndjson", compress=True, flush_bytes=4096))
+    assert len(pieces) > 10
+    decoder = zlib.decompressobj(31)
+    first = decoder.decompress(pieces[0])
+    assert first.startswith(b'{"id": 0,')
+    text = first + b"".join(decoder.decompress(p) for p in pieces[1:])
+    assert [json.loads(line)["id"] for line in text.splitlines()] == list(range(1000))
@@ -0,0 +1,91 @@
+import os
+import random
+
+os.environ.setdefault("USE_STUB", "true")
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.detectors import IncrementalScanner, active_engine
+from app.regex_safety import match_reach
+from app.sessions import SessionStore
+
+client = TestClient(main.app)
+
+WORDS = ["explain", "network", "students", "bruh", "lol", "hack", "how to", "kill", "someone", "shit",
+         "ignore previous instructions", "<system>", "is it ok to", "sexual", "ನಮಸ್ಕಾರ", "disregard", "above",
+         "f", "u", "c", "k", "fuuck", "İ", " ", "\n", "formal", "email", "want", "to", "sex", "girl"]
+
+
+def test_match_reach():
+    """Bounded patterns report their widest match plus a boundary char; open-ended ones None."""
+    assert match_reach(r"\bkill\b") == 5
+    assert match_reach(r"how to (?:hack|kill)") == 12
+    assert match_reach(r"\bf+u+c+k+\b") is None
+    assert match_reach(r"ignore .*") is None
+
+
+def test_edits_match_full_scan():
+    """Random insertions and deletions: matches, COSTAR and Kannada equal a scan of the whole text."""
+    engine = active_engine()
+    rng = random.Random(3)
+    for _ in range(150):
+        scanner = IncrementalScanner(engine, " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 60))))
+        for _ in range(20):
+            start = rng.randint(0, len(scanner.text))
+            delete = rng.randint(0, min(15, len(scanner.text) - start))
+            scanner.edit(start, delete, "".join(rng.choice(WORDS) for _ in range(rng.randint(0, 3))))
+            full, inc = engine.scan(scanner.text), scanner.scan()
+            assert inc.matches == full.matches, scanner.text
+            assert inc.has_kannada == full.has_kannada
+            assert engine.extract_costar(inc) == engine.extract_costar(full)
+
+
+def test_edit_scans_only_around_the_edit():
+    """Typing into a long clean prompt reads a window around the edit, not the whole text."""
+    text = "Explain how wifi networks work for students. " * 2000
+    scanner = IncrementalScanner(active_engine(), text, margin=256)
+    scanner.edit(len(text) // 2, 0, "bruh ")
+    assert scanner.last_scanned < len(text) // 8
+    assert [m.text for m in scanner.scan().by_category("slang")] == ["bruh"]
+    scanner.edit(len(text) // 2, 5, "")
+    assert not scanner.scan().matches and scanner.tail_searches == 0
+
+
+def test_session_store_expires_idle_sessions():
+    """Sessions idle past the TTL, or beyond the cap, are dropped oldest first."""
+    now = [0.0]
+    store = SessionStore(ttl=10, max_sessions=2, clock=lambda: now[0])
+    engine = active_engine()
+    a, b = store.open(engine, "a", "Professor"), store.open(engine, "b", "Professor")
+    now[0] = 5
+    assert store.get(a.id) is a
+    store.open(engine, "c", "Professor")
+    assert store.get(b.id) is None and store.get(a.id) is a
+    now[0] = 20
+    assert store.get(a.id) is None and store.stats()["expired"] == 3
+
+
+def test_session_endpoints():
+    """Edits update the verdict; a stale revision gets 409, bad offsets 400, unknown sessions 404."""
+    body = client.post("/api/analyze/session", json={"prompt": "explain networks to students", "persona": "Guardian"}).json()
+    sid = body["session_id"]
+    assert body["revision"] == 0 and body["verdict"] == "ALLOW"
+
+    edits = [{"offset": 0, "delete": 0, "insert": "how to kill someone, "}]
+    body = client.post(f"/api/analyze/session/{sid}/edits", json={"revision": 0, "edits": edits, "rewrite": True}).json()
+    assert body["revision"] == 1 and body["verdict"] == "BLOCK"
+    assert body["suggested_rewrite"].startswith("I'd like guidance")
+    expected = client.post("/api/analyze", json={"prompt": "how to kill someone, explain networks to students", "persona": "Guardian",
+                                                  "options": {"stages": ["detect"], "detail": "full"}}).json()
+    assert body["highlights"] == expected["highlights"] and body["score"] == expected["score"]
+
+    stale = client.post(f"/api/analyze/session/{sid}/edits", json={"revision": 0, "edits": edits})
+    assert stale.status_code == 409
+    outside = client.post(f"/api/analyze/session/{sid}/edits", json={"revision": 1, "edits": [{"offset": 500, "delete": 1}]})
+    assert outside.status_code == 400
+
+    body = client.post(f"/api/analyze/session/{sid}/edits", json={"revision": 1, "edits": [{"offset": 0, "delete": 21}]}).json()
+    assert body["revision"] == 2 and body["verdict"] == "ALLOW" and body["suggested_rewrite"] == ""
+    assert client.delete(f"/api/analyze/session/{sid}").status_code == 200
+    assert client.post(f"/api/analyze/session/{sid}/edits", json={"revision": 2, "edits": []}).status_code == 404
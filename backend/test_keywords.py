@@ -0,0 +1,36 @@
+from app.detectors import scan_prompt
+from app.keywords import KeywordAutomaton, KeywordEntry
+from app.main import build_sanitized_rewrite, simple_costar_extract
+
+
+def test_automaton_reports_overlapping_hits_with_positions():
+    """Every keyword is found in one pass, overlaps included, case-insensitively."""
+    automaton = KeywordAutomaton([KeywordEntry("he", "a"), KeywordEntry("she", "b"), KeywordEntry("hers", "c")])
+    hits = automaton.scan("uSHErs")
+    assert [(h.keyword, h.start, h.end) for h in hits] == [("she", 1, 4), ("he", 2, 4), ("hers", 2, 6)]
+
+
+def test_automaton_word_boundaries():
+    """Boundary flags behave like regex \\b on either side."""
+    automaton = KeywordAutomaton([KeywordEntry("bet", "slang", None, True, True)])
+    assert [h.start for h in automaton.scan("bet on it, alphabet, bet_")] == [0]
+    assert automaton.scan("x", offset=5) == []
+    assert [h.start for h in automaton.scan("a bet", offset=10)] == [12]
+
+
+def test_positions_map_back_when_lowercasing_changes_length():
+    """'İ' lowercases to two characters; spans still index the original text."""
+    text = "İİ lol"
+    (hit,) = scan_prompt(text).by_category("slang")
+    assert text[hit.start:hit.end] == "lol"
+
+
+def test_costar_and_slang_stripping_use_the_automaton():
+    """COSTAR labels and slang stripping keep their word-boundary semantics."""
+    costar = simple_costar_extract("Explain AI and wifi networks to students as a funny tweet")
+    assert costar["Context"] == "AI, Network"
+    assert costar["Objective"] == "Explain"
+    assert costar["Audience"] == "Twitter readers"
+    assert simple_costar_extract("an unexplained script")["Objective"] == "None"
+    rewrite = build_sanitized_rewrite("bruh explain alphabet", costar={}, persona="Professor")
+    assert "bruh" not in rewrite and "alphabet" in rewrite
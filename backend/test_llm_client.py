@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+
+from app.llm_client import AsyncLLMClient
+from app.metrics import LLM_COALESCED_TOTAL
+
+
+def test_async_client_reuses_pool_and_applies_call_timeout():
+    """Calls on one event loop share a single pooled httpx client."""
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200, json={"ok": True})
+
+    client = AsyncLLMClient(timeout=20, transport=httpx.MockTransport(handler))
+
+    async def run():
+        first = await client.post_json("http://llm.test/generate", {"a": 1})
+        pool = client._client
+        second = await client.post_json("http://llm.test/generate", {"a": 2}, timeout=3)
+        assert client._client is pool
+        await client.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ({"ok": True}, {"ok": True})
+    assert seen == [20, 3]
+
+
+def test_identical_concurrent_calls_share_one_request():
+    """Concurrent identical payloads hit upstream once; different ones do not coalesce."""
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.content)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"n": len(calls)})
+
+    client = AsyncLLMClient(transport=httpx.MockTransport(handler))
+    before = LLM_COALESCED_TOTAL.value(client="async_client")
+
+    async def run():
+        same = [client.post_json("http://llm.test/generate", {"prompt": "hi", "cfg": {"t": 1}}) for _ in range(5)]
+        other = client.post_json("http://llm.test/generate", {"prompt": "bye"})
+        results = await asyncio.gather(*same, other)
+        assert len(client._inflight) == 0
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert len({r["n"] for r in results[:5]}) == 1
+    assert LLM_COALESCED_TOTAL.value(client="async_client") - before == 4
+
+
+def test_coalesced_waiters_share_errors_and_survive_cancellation():
+    """One caller timing out does not cancel the shared call for the rest."""
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return httpx.Response(503)
+
+    client = AsyncLLMClient(transport=httpx.MockTransport(handler))
+
+    async def run():
+        impatient = asyncio.wait_for(client.post_json("http://llm.test/g", {"p": 1}), 0.01)
+        patient = client.post_json("http://llm.test/g", {"p": 1})
+        results = await asyncio.gather(impatient, patient, return_exceptions=True)
+        await client.aclose()
+        return results
+
+    impatient, patient = asyncio.run(run())
+    assert isinstance(impatient, asyncio.TimeoutError)
+    assert isinstance(patient, httpx.HTTPStatusError)
+    assert calls == [1]
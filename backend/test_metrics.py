@@ -0,0 +1,32 @@
+import threading
+
+from app.metrics import Counter, Histogram
+
+
+def test_sharded_counter_sums_across_threads():
+    """Each thread writes its own shard; the rendered value is the total."""
+    counter = Counter("test_total", "test", ("verdict",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(verdict="ALLOW")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert counter.value(verdict="ALLOW") == 4000
+    assert 'test_total{verdict="ALLOW"} 4000' in counter.render()
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Buckets are cumulative and end with +Inf, followed by sum and count."""
+    hist = Histogram("test_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        hist.observe(value, stage="detect")
+    lines = hist.render()
+    assert 'test_seconds_bucket{stage="detect",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="detect",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="detect",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="detect"} 3' in lines
@@ -0,0 +1,107 @@
+import re
+import time
+import random
+
+import pytest
+
+from app.detectors import DEFAULT_RULESET_PATH, PATTERN_FAMILIES, build_engine, load_ruleset
+from app.regex_safety import EXPONENTIAL, POLYNOMIAL, SAFE, compile_pattern, lint, rewrite_gaps
+from benchmarks.bench_redos import adversarial_inputs
+
+
+def _default_patterns():
+    ruleset = load_ruleset(DEFAULT_RULESET_PATH)
+    return [p for family in PATTERN_FAMILIES for p in ruleset.get(family, [])]
+
+
+def test_lint_classifies_risk():
+    """Nested quantifiers are exponential, wildcard gaps polynomial, plain runs safe."""
+    assert lint(r"(x+x+)+y")[0] == EXPONENTIAL
+    assert lint(r"hard.*fuck")[0] == POLYNOMIAL
+    assert lint(r"\bf+u+c+k+\b")[0] == SAFE
+    assert lint(r"ignore .*")[0] == SAFE
+
+
+def test_compile_rejects_exponential_and_invalid():
+    """Patterns that cannot be made safe never get compiled."""
+    with pytest.raises(ValueError, match="catastrophic"):
+        compile_pattern(r"(x+x+)+y")
+    with pytest.raises(ValueError, match="invalid regex"):
+        compile_pattern(r"(unclosed")
+
+
+def test_rewrite_bounds_gaps():
+    """Every top-level gap gets bounded (k-th gap to k x max); literal middles commit, the last gap stays greedy."""
+    assert rewrite_gaps("disregard.*above", 50) == "disregard.{0,50}(?:above)"
+    assert rewrite_gaps("a.*b.+c", 50) == "a(?>.{0,50}?(?:b)).{1,100}(?:c)"
+    assert rewrite_gaps(r"a.*\d+.*c", 50) == r"a(?>.{0,50}?(?:\d+?)).{0,100}(?:c)"
+    assert rewrite_gaps("x.*y|z", 50) == "x.{0,50}(?:y)|z"
+    _, report = compile_pattern("hard.*fuck.*with", max_gap=50)
+    assert report.risk == POLYNOMIAL and lint(report.compiled)[0] == SAFE
+
+
+def test_rewritten_patterns_agree_with_originals():
+    """On short inputs (gaps under the bound) match existence and text are unchanged."""
+    rng = random.Random(7)
+    vocab = ["hard", "fuck", "with", "girl", "girls", "want", "to", "sex", "above", "disregard",
+             "looking for", "hookup", "12", "7", " ", "  ", "x", "sleep with", "ggiirl"]
+    patterns = [p for p in _default_patterns() if compile_pattern(p)[1].compiled != p]
+    assert patterns
+    for _ in range(1500):
+        text = " ".join(rng.choice(vocab) for _ in range(rng.randint(1, 14)))
+        for p in patterns:
+            safe, _ = compile_pattern(p)
+            orig = re.compile(p, re.I).search(text)
+            new = safe.search(text)
+            assert bool(orig) == bool(new), (p, text)
+            if orig and "(?>" not in safe.pattern:
+                assert orig.group(0) == new.group(0), (p, text)
+
+
+# Patterns and one text per piece of a match, for test_repeated_literals_before_the_match
+CHAINS = {
+    r"hard.*fuck.*with.*\d+.*girls?": ["hard", "fuck", "with", "5", "girls"],
+    r"want.*to.*(fuck|have sex|sleep with)": ["want", "to", "sleep with"],
+    r"a.*b.+c.*d": ["a", "b", "c", "d"],
+}
+
+
+def test_repeated_literals_before_the_match():
+    """A piece repeating early (e.g. a second "fuck") never hides a match whose gaps are all within the bound."""
+    rng = random.Random(16)
+    max_gap = 60
+    for pattern, pieces in CHAINS.items():
+        safe, _ = compile_pattern(pattern, max_gap=max_gap)
+        for _ in range(300):
+            text = pieces[0]
+            for piece in pieces[1:]:
+                gap = "-" * rng.randint(1, max_gap - len(piece) - 3)
+                if rng.random() < 0.7:
+                    # An early copy of the piece, then the real one as far away as allowed
+                    gap = "-" * rng.randint(1, 3) + piece + "-" * (max_gap - len(piece) - 4)
+                text += gap + piece
+            assert re.search(pattern, text, re.I), (pattern, text)
+            assert safe.search(text), (pattern, text)
+    assert compile_pattern(r"hard.*fuck.*with.*\d+.*girls?")[0].search("hard fuck " + "x" * 250 + " fuck " + "y" * 250 + " with 5 girls")
+    assert compile_pattern(r"want.*to.*(fuck|have sex|sleep with)")[0].search("want to " + "a" * 250 + " to " + "b" * 200 + " sleep with")
+
+
+def test_adversarial_100kb_is_bounded():
+    """No compiled default pattern takes more than ~10µs per byte on 100KB adversarial input."""
+    size = 100_000
+    for p in _default_patterns():
+        regex, _ = compile_pattern(p)
+        for name, text in adversarial_inputs(p, size).items():
+            start = time.perf_counter()
+            regex.search(text)
+            assert time.perf_counter() - start < size * 10e-6, (p, name)
+
+
+def test_build_engine_rejects_exponential_rule():
+    """A ruleset edit introducing a ReDoS pattern fails to load with the rule's id."""
+    ruleset = load_ruleset(DEFAULT_RULESET_PATH)
+    ruleset["risky"] = ruleset["risky"] + [r"(a+)+$"]
+    with pytest.raises(ValueError, match=r"risky\[\d+\] rejected"):
+        build_engine(ruleset)
+    engine = build_engine(load_ruleset(DEFAULT_RULESET_PATH))
+    assert len(engine.reports) == len(engine.rules)
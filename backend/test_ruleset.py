@@ -0,0 +1,118 @@
+import os
+import json
+
+os.environ.setdefault("USE_STUB", "true")
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.detectors import DEFAULT_RULESET_PATH, active_engine, build_engine, load_ruleset, swap_engine
+from app.ruleset import RulesetManager
+
+client = TestClient(main.app)
+
+
+def _write_ruleset(path, version, extra_slang=()):
+    data = load_ruleset(DEFAULT_RULESET_PATH)
+    data["version"] = version
+    data["slang"] = data["slang"] + list(extra_slang)
+    path.write_text(json.dumps(data))
+
+
+def test_default_file_builds_current_version():
+    """The shipped ruleset file compiles and is what requests use."""
+    engine = build_engine(load_ruleset(DEFAULT_RULESET_PATH))
+    assert engine.version == active_engine().version
+    resp = client.post("/api/analyze", json={"prompt": "explain networks", "persona": "Professor"})
+    assert resp.json()["ruleset_version"] == engine.version
+
+
+def test_build_engine_rejects_bad_rules():
+    """Malformed rulesets raise ValueError instead of half-loading."""
+    data = load_ruleset(DEFAULT_RULESET_PATH)
+    for broken in ({**data, "version": ""}, {**data, "injection": ["(unclosed"]}, {**data, "slang": "lol"}):
+        try:
+            build_engine(broken)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {broken}")
+
+
+def test_reload_swaps_engine_and_cache_key(tmp_path):
+    """A reload changes detection, the reported version and the cache key."""
+    path = tmp_path / "rules.json"
+    _write_ruleset(path, "1")
+    manager = RulesetManager(str(path), watch_interval=0)
+    original = active_engine()
+    main.VERDICT_CACHE.clear()
+    try:
+        body = {"prompt": "that was cringe", "persona": "Professor", "options": {"stages": []}}
+        before = client.post("/api/analyze", json=body).json()
+        assert not any(h.get("token") == "cringe" for h in before["highlights"])
+
+        _write_ruleset(path, "2-test", extra_slang=["cringe"])
+        assert manager.reload() == (True, "2-test")
+        after = client.post("/api/analyze", json=body).json()
+        assert after["ruleset_version"] == "2-test"
+        assert any(h.get("token") == "cringe" for h in after["highlights"])
+    finally:
+        swap_engine(original)
+
+
+def test_edit_without_version_bump_gets_fresh_cache_entries(tmp_path):
+    """Same declared version, different rules: a new digest, so cached verdicts are not reused."""
+    path = tmp_path / "rules.json"
+    _write_ruleset(path, "same")
+    manager = RulesetManager(str(path), watch_interval=0)
+    original = active_engine()
+    main.VERDICT_CACHE.clear()
+    try:
+        body = {"prompt": "that was cringe", "persona": "Professor", "options": {"stages": []}}
+        manager.reload()
+        digest = active_engine().digest
+        assert client.post("/api/analyze", json=body).json()["verdict"] == "ALLOW"
+        _write_ruleset(path, "same", extra_slang=["cringe"])
+        manager.reload()
+        assert active_engine().version == "same" and active_engine().digest != digest
+        after = client.post("/api/analyze", json=body).json()
+        assert after["ruleset_version"] == "same"
+        assert any(h.get("token") == "cringe" for h in after["highlights"])
+    finally:
+        swap_engine(original)
+
+
+def test_broken_file_keeps_previous_engine(tmp_path):
+    """A reload of an invalid file reports the error and changes nothing."""
+    path = tmp_path / "rules.json"
+    path.write_text("{not json")
+    manager = RulesetManager(str(path), watch_interval=0)
+    original = active_engine()
+    assert manager.reload() == (False, original.version)
+    assert active_engine() is original
+    assert manager.status()["last_error"].startswith("JSONDecodeError")
+
+
+def test_watcher_check_reloads_on_change(tmp_path):
+    """check() only reloads when the file's mtime or size changed."""
+    path = tmp_path / "rules.json"
+    _write_ruleset(path, "w1")
+    manager = RulesetManager(str(path), watch_interval=0)
+    original = active_engine()
+    try:
+        assert manager.check() is False
+        _write_ruleset(path, "w2", extra_slang=["meh"])
+        assert manager.check() is True
+        assert active_engine().version == "w2"
+    finally:
+        swap_engine(original)
+
+
+def test_admin_reload_requires_token(monkeypatch):
+    """The admin endpoint is off without ADMIN_TOKEN and checks the header."""
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.post("/api/admin/ruleset/reload").status_code == 403
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert client.post("/api/admin/ruleset/reload", headers={"X-Admin-Token": "nope"}).status_code == 401
+    resp = client.post("/api/admin/ruleset/reload", headers={"X-Admin-Token": "s3cret"})
+    assert resp.status_code == 200
+    assert resp.json()["version"] == active_engine().version
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+
+import httpx
+
+from app.server import Supervisor
+from app.workers import READY, WorkerTable
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_worker_table_rows_are_shared_by_slot():
+    """Slots hold each worker's stats; cleared slots drop out of the snapshot."""
+    table = WorkerTable(3)
+    table.write(0, 101, READY, 0, time.time())
+    table.write(2, 303, READY, 1, time.time())
+    table.update(2, requests=7)
+    rows = table.snapshot()
+    assert [(r["slot"], r["pid"], r["state"]) for r in rows] == [(0, 101, "ready"), (2, 303, "ready")]
+    assert rows[1]["requests"] == 7 and rows[1]["generation"] == 1
+    table.clear(0)
+    assert [r["pid"] for r in table.snapshot()] == [303]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, check, timeout: float = 20) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            worker = httpx.get(url, timeout=2).json()["worker"]
+            if check(worker):
+                return worker
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise AssertionError(f"{url} never satisfied the check")
+
+
+def test_prefork_launcher_rolling_restart_and_shutdown():
+    """Workers come up, SIGHUP replaces all of them, SIGTERM exits cleanly."""
+    port = _free_port()
+    env = {**os.environ, "USE_STUB": "true", "CACHE_BACKEND": "memory", "HISTORY_BACKEND": "off", "RULESET_WATCH_INTERVAL": "0"}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", "2", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/health"
+    try:
+        first = _wait_for(url, lambda w: w["count"] == 2)
+        old_pids = {w["pid"] for w in first["workers"]}
+        proc.send_signal(signal.SIGHUP)
+        second = _wait_for(url, lambda w: w["count"] == 2 and all(x["generation"] == 1 for x in w["workers"]))
+        assert not old_pids & {w["pid"] for w in second["workers"]}
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(timeout=30) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def test_stop_drains_all_workers_at_once():
+    """Shutdown signals every worker first, so N slow drains take one drain's time, not N."""
+    supervisor = Supervisor(None, None, 3, graceful_timeout=10)
+    for slot in range(3):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, lambda *_: (time.sleep(1), os._exit(0)))
+                while True:
+                    time.sleep(0.05)
+            finally:
+                os._exit(0)
+        supervisor.children[pid] = slot
+    time.sleep(0.2)
+    start = time.monotonic()
+    supervisor.stop()
+    assert not supervisor.children and time.monotonic() - start < 2.5
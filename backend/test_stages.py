@@ -0,0 +1,54 @@
+import os
+import asyncio
+
+os.environ.setdefault("USE_STUB", "true")
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    main.VERDICT_CACHE.clear()
+    calls = []
+
+    async def fake_generate(prompt, **kwargs):
+        calls.append(prompt)
+        await asyncio.sleep(0)
+        return "Rewritten." if prompt.startswith("Rewrite the following") else "Answer."
+
+    monkeypatch.setattr(main, "call_gemini_generate", fake_generate)
+    return calls
+
+
+def test_chat_allow_skips_rewrite(llm_calls):
+    """An ALLOW chat makes exactly one LLM call: the answer."""
+    data = TestClient(main.app).post("/api/chat", json={"prompt": "Explain photosynthesis"}).json()
+    assert data["allowed"] and data["llm_response"] == "Answer."
+    assert len(llm_calls) == 1 and not llm_calls[0].startswith("Rewrite")
+
+
+def test_chat_needs_fix_runs_rewrite_only(llm_calls):
+    """A NEEDS_FIX chat makes one LLM call: the rewrite."""
+    data = TestClient(main.app).post("/api/chat", json={"prompt": "is it ok to skip class"}).json()
+    assert data["analysis"]["verdict"] == "NEEDS_FIX"
+    assert data["analysis"]["suggested_rewrite"] == "Rewritten." and data["llm_response"] is None
+    assert len(llm_calls) == 1
+
+
+def test_chat_explicit_rewrite_and_answer(llm_calls):
+    """Requesting both stages on ALLOW runs the rewrite and the answer."""
+    body = {"prompt": "Explain photosynthesis", "options": {"stages": ["rewrite", "answer"]}}
+    data = TestClient(main.app).post("/api/chat", json=body).json()
+    assert data["analysis"]["suggested_rewrite"] == "Rewritten." and data["llm_response"] == "Answer."
+    assert len(llm_calls) == 2
+
+
+def test_analyze_local_only_stages(llm_calls):
+    """Analyze without the rewrite stage never calls the LLM; bad stage names are rejected."""
+    client = TestClient(main.app)
+    resp = client.post("/api/analyze", json={"prompt": "Explain photosynthesis", "options": {"stages": ["detect", "verdict"]}})
+    assert resp.status_code == 200 and llm_calls == []
+    assert client.post("/api/analyze", json={"prompt": "x", "options": {"stages": ["nope"]}}).status_code == 400
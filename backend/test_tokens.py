@@ -0,0 +1,116 @@
+import os
+import json
+import asyncio
+
+os.environ.setdefault("USE_STUB", "true")
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app import main
+from app.llm_client import AsyncLLMClient
+from app.providers import GeminiProvider, MockServerProvider, run_rule_check
+from app.rules_prompt import RULE_ENGINE_SYSTEM_PROMPT
+from app.tokens import estimate_tokens, fit_to_budget, tokens_for_chars
+from benchmarks.mock_llm_server import create_app
+
+DOCUMENT = "Please review this contract. " + "Clause text that goes on and on. " * 1600 + "Is it fair to me?"
+
+
+def test_fit_to_budget_keeps_head_and_tail():
+    """Oversize input is cut to the budget around a marker; small input is returned as is."""
+    assert len(DOCUMENT) > 50_000
+    fitted = fit_to_budget(DOCUMENT, 500)
+    assert estimate_tokens(fitted) <= 500
+    assert fitted.startswith("Please review this contract.") and fitted.endswith("Is it fair to me?")
+    assert "characters omitted" in fitted
+    short = "explain networks"
+    assert fit_to_budget(short, 500) is short
+    kannada = "ನಮಸ್ಕಾರ " * 2000
+    assert estimate_tokens(fit_to_budget(kannada, 100)) <= 100
+
+
+def _recording(status_for_cache=200):
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        seen.append((request.url.path, body))
+        if request.url.path.endswith("/cachedContents"):
+            if status_for_cache != 200:
+                return httpx.Response(status_for_cache)
+            return httpx.Response(200, json={"name": "cachedContents/abc"})
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": '{"verdict": "allow"}'}]}}]})
+
+    client = AsyncLLMClient(transport=httpx.MockTransport(handler), coalesce=False)
+    return seen, client
+
+
+def test_rule_check_uses_system_instruction_and_budgets():
+    """The rule prompt travels as systemInstruction; only the trimmed user prompt is per-call content."""
+    seen, client = _recording()
+    provider = GeminiProvider("http://llm.test/v1beta/models/m:generateContent", client=client)
+
+    async def run():
+        result = await run_rule_check(DOCUMENT, provider)
+        await client.aclose()
+        return result
+
+    assert asyncio.run(run())["verdict"] == "ALLOW"
+    (_, body), = seen
+    assert body["systemInstruction"]["parts"][0]["text"] == RULE_ENGINE_SYSTEM_PROMPT
+    content = body["contents"][0]["parts"][0]["text"]
+    assert RULE_ENGINE_SYSTEM_PROMPT not in content and estimate_tokens(content) <= 2048
+    assert body["generationConfig"]["maxOutputTokens"] == 512
+
+
+def test_context_cache_uploads_system_once():
+    """With context caching the system prompt is uploaded once and referenced by name after."""
+    app = create_app()
+    client = AsyncLLMClient(transport=httpx.ASGITransport(app=app), coalesce=False)
+    provider = MockServerProvider("http://mock.test/v1beta/models/mock:generateContent", client=client, context_cache=True)
+
+    async def run():
+        results = [await run_rule_check(f"prompt {i}", provider) for i in range(3)]
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    # The mock resolves the cached instruction, so it still answers as the rule engine
+    assert all(r["verdict"] == "ALLOW" and r["reasons"] == ["stubbed - no API key"] for r in results)
+    assert list(app.state.contexts.values()) == [RULE_ENGINE_SYSTEM_PROMPT]
+
+
+def test_context_cache_unavailable_falls_back_to_system_instruction():
+    """A rejected cache upload is not retried per call; calls carry systemInstruction instead."""
+    seen, client = _recording(status_for_cache=400)
+    provider = GeminiProvider("http://llm.test/v1beta/models/m:generateContent", client=client, context_cache=True)
+
+    async def run():
+        for i in range(3):
+            await run_rule_check(f"prompt {i}", provider)
+        await client.aclose()
+
+    asyncio.run(run())
+    paths = [path for path, _ in seen]
+    assert paths.count("/v1beta/cachedContents") == 1 and len(paths) == 4
+    assert all("systemInstruction" in body and "cachedContent" not in body for path, body in seen[1:])
+    assert seen[0][1]["model"] == "models/m"
+
+
+def test_rewrite_request_is_budgeted(monkeypatch):
+    """A pasted document is trimmed in the rewrite instruction and output is capped to what is kept."""
+    main.VERDICT_CACHE.clear()
+    calls = []
+
+    async def fake_generate(prompt, **kwargs):
+        calls.append((prompt, kwargs))
+        return "Please review whether this contract is fair."
+
+    monkeypatch.setattr(main, "call_gemini_generate", fake_generate)
+    data = TestClient(main.app).post("/api/analyze", json={"prompt": DOCUMENT}).json()
+    (prompt, kwargs), = calls
+    assert estimate_tokens(prompt) <= main.REWRITE_INPUT_TOKENS + 100
+    assert prompt.startswith("Rewrite the following") and "Is it fair to me?" in prompt
+    assert kwargs["max_tokens"] == tokens_for_chars(main.REWRITE_MAX_CHARS) < 256
+    assert data["suggested_rewrite"] == "Please review whether this contract is fair."
@@ -0,0 +1,177 @@
+import os
+import json
+import asyncio
+
+os.environ.setdefault("USE_STUB", "true")
+
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from app import main
+from app.ws import Multiplexer
+
+client = TestClient(main.app)
+
+
+def _collect(ws, until):
+    """Messages received until every (id, event) in `until` has arrived."""
+    messages, waiting = [], set(until)
+    while waiting:
+        message = ws.receive_json()
+        messages.append(message)
+        waiting.discard((message["id"], message["event"]))
+    return messages
+
+
+def test_requests_are_multiplexed_by_id():
+    """analyze, chat and chat_stream share one connection; each reply carries its request id."""
+    main.VERDICT_CACHE.clear()
+    prompt = "explain how wifi networks work for students"
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"id": 1, "type": "analyze", "prompt": prompt, "persona": "Shield", "options": {"stages": ["detect"]}})
+        ws.send_json({"id": "c", "type": "chat", "prompt": "bruh how to kill someone"})
+        ws.send_json({"id": "s", "type": "chat_stream", "prompt": prompt})
+        messages = _collect(ws, {(1, "result"), ("c", "result"), ("s", "done")})
+    by_id = {}
+    for m in messages:
+        by_id.setdefault(m["id"], []).append(m)
+    # Every request is acknowledged before anything else is sent for it
+    assert all(events[0]["event"] == "accepted" for events in by_id.values())
+    by_id = {k: events[1:] for k, events in by_id.items()}
+    http = client.post("/api/analyze", json={"prompt": prompt, "persona": "Shield", "options": {"stages": ["detect"]}}).json()
+    assert {k: v for k, v in by_id[1][0].items() if k not in ("id", "event")} == http
+    assert by_id["c"][0]["allowed"] is False and by_id["c"][0]["analysis"]["verdict"] == "BLOCK"
+    events = [m["event"] for m in by_id["s"]]
+    assert events[0] == "analysis" and events[-1] == "done" and "chunk" in events
+
+
+def test_deferred_rewrite_is_pushed():
+    """With defer_rewrite the verdict comes first and the LLM rewrite follows without polling."""
+    main.VERDICT_CACHE.clear()
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"id": "r", "type": "analyze", "prompt": "write an email about networks lol", "options": {"defer_rewrite": True}})
+        accepted, result, rewrite = ws.receive_json(), ws.receive_json(), ws.receive_json()
+    assert accepted == {"id": "r", "event": "accepted"}
+    assert result["event"] == "result" and result["rewrite_job"]
+    assert rewrite["event"] == "rewrite" and rewrite["job_id"] == result["rewrite_job"]
+    assert rewrite["status"] == "done" and rewrite["suggested_rewrite"]
+
+
+def test_bad_messages_get_errors_and_keep_the_connection():
+    """Invalid JSON, missing ids, unknown types and bad options are reported; the socket stays usable."""
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json() == {"id": None, "event": "error", "status": 400, "detail": "Messages must be JSON objects"}
+        ws.send_json({"type": "analyze", "prompt": "x"})
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"id": 2, "type": "translate"})
+        assert ws.receive_json()["status"] == 400
+        # Envelope problems are rejected unacknowledged; handler errors follow `accepted`
+        ws.send_json({"id": 3, "type": "analyze", "prompt": "x", "options": {"detail": "all"}})
+        assert ws.receive_json() == {"id": 3, "event": "accepted"}
+        assert ws.receive_json() == {"id": 3, "event": "error", "status": 400, "detail": "options.detail must be one of ['verdict', 'full']"}
+        ws.send_json({"id": 4, "type": "analyze"})
+        assert ws.receive_json()["event"] == "accepted" and ws.receive_json()["status"] == 422
+        ws.send_json({"id": 5, "type": "analyze", "prompt": "hello", "options": {"stages": ["detect"]}})
+        assert ws.receive_json()["event"] == "accepted" and ws.receive_json()["event"] == "result"
+
+
+class FakeSocket:
+    """Just enough of a WebSocket for Multiplexer: scripted input, recorded (and optionally gated) output."""
+
+    def __init__(self, send_gate=None):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.reads = 0
+        self.send_gate = send_gate
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        message = await self.incoming.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        self.reads += 1
+        return message
+
+    async def send_text(self, text):
+        if self.send_gate is not None:
+            await self.send_gate.wait()
+        self.sent.append(json.loads(text))
+
+
+def test_reading_pauses_at_max_inflight():
+    """With max_inflight requests running the next message is not read until one finishes."""
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow(message):
+            await release.wait()
+            yield "result", {}
+
+        socket = FakeSocket()
+        mux = Multiplexer(socket, {"slow": slow}, max_inflight=2)
+        run = asyncio.create_task(mux.run())
+        for i in range(5):
+            socket.incoming.put_nowait(json.dumps({"id": i, "type": "slow"}))
+        await asyncio.sleep(0.05)
+        assert socket.reads == 2
+        release.set()
+        await asyncio.sleep(0.05)
+        assert socket.reads == 5 and sorted(m["id"] for m in socket.sent if m["event"] == "result") == [0, 1, 2, 3, 4]
+        socket.incoming.put_nowait(None)
+        await run
+
+    asyncio.run(scenario())
+
+
+def test_slow_client_pauses_producers_and_cancel_stops_them():
+    """A full send queue makes a streaming handler wait; cancel ends it with a `cancelled` event."""
+    async def scenario():
+        produced = []
+
+        async def stream(message):
+            for i in range(1000):
+                produced.append(i)
+                yield "chunk", {"i": i}
+
+        gate = asyncio.Event()
+        socket = FakeSocket(send_gate=gate)
+        mux = Multiplexer(socket, {"stream": stream}, send_queue=4)
+        run = asyncio.create_task(mux.run())
+        socket.incoming.put_nowait(json.dumps({"id": "s", "type": "stream"}))
+        await asyncio.sleep(0.05)
+        assert len(produced) < 10
+        socket.incoming.put_nowait(json.dumps({"id": "s", "type": "cancel"}))
+        await asyncio.sleep(0.05)
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert len(produced) < 10 and socket.sent[-1] == {"id": "s", "event": "cancelled"}
+        socket.incoming.put_nowait(None)
+        await run
+
+    asyncio.run(scenario())
+
+
+def test_cancel_before_the_request_starts():
+    """A cancel arriving right behind its request frees the slot and the id and is acknowledged."""
+    async def scenario():
+        async def slow(message):
+            await asyncio.sleep(10)
+            yield "result", {}
+
+        socket = FakeSocket()
+        mux = Multiplexer(socket, {"slow": slow}, max_inflight=2)
+        run = asyncio.create_task(mux.run())
+        for _ in range(5):
+            socket.incoming.put_nowait(json.dumps({"id": "x", "type": "slow"}))
+            socket.incoming.put_nowait(json.dumps({"id": "x", "type": "cancel"}))
+        await asyncio.sleep(0.05)
+        assert socket.reads == 10
+        assert sorted(m["event"] for m in socket.sent) == ["accepted"] * 5 + ["cancelled"] * 5
+        assert not mux._tasks and not mux._cancelled and not mux._slots.locked()
+        socket.incoming.put_nowait(None)
+        await run
+
+    asyncio.run(scenario())
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Mic, Paperclip, Send } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { useAnalysis } from '../contexts/AnalysisContext';
-import { promptApi } from '../services/api';
+import { promptSocket, SocketEventError } from '../services/api';
 import { RecommendedPrompts } from './RecommendedPrompts';
 
 interface Message {
@@ -52,8 +52,8 @@ export const ChatArea: React.FC = () => {
     setError(null);
 
     try {
-      // Call the real backend API for chat
-      const chatResponse = await promptApi.chat({
+      // Call the real backend API for chat (over the shared WebSocket, HTTP as fallback)
+      const chatResponse = await promptSocket.chat({
         prompt: currentPrompt,
         persona: 'Professor'
       });
@@ -89,7 +89,8 @@ export const ChatArea: React.FC = () => {
       
     } catch (error) {
       console.error('Chat API error:', error);
-      setError('Failed to analyze prompt. Please check your backend connection.');
+      // The server answered with an error: show it rather than blaming the connection
+      setError(error instanceof SocketEventError ? error.message : 'Failed to analyze prompt. Please check your backend connection.');
       
       const errorMessage: Message = {
         id: (Date.now() + 1).toString(),
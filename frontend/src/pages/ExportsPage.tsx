@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { motion } from 'framer-motion';
 import { Download, FileText, Clock } from 'lucide-react';
+import { promptApi } from '../services/api';
 
 interface ExportTask {
   id: string;
@@ -53,13 +54,16 @@ export const ExportsPage: React.FC = () => {
   const [includeTimestamps, setIncludeTimestamps] = useState(true);
 
   const handleCreateExport = () => {
-    // In a real app, this would call an API to create the export
-    console.log('Creating export with settings:', {
-      dateRange: selectedDateRange,
-      format: selectedFormat,
-      includeAnalysis,
-      includeScores,
-      includeTimestamps,
+    // CSV and JSON stream from the backend history; PDF reports are not generated server-side yet
+    if (selectedFormat === 'pdf') {
+      console.log('PDF export is not available yet');
+      return;
+    }
+    const days: Record<string, number> = { 'last-7-days': 7, 'last-30-days': 30, 'last-90-days': 90 };
+    const since = days[selectedDateRange] ? Date.now() / 1000 - days[selectedDateRange] * 86400 : undefined;
+    window.location.href = promptApi.historyExportUrl({
+      format: selectedFormat === 'csv' ? 'csv' : 'ndjson',
+      since,
     });
   };
 
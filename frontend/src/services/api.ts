@@ -50,6 +50,9 @@ export interface AnalyzeResponse {
   highlights: Highlight[];
   suggested_rewrite: string;
   reasons: string[];
+  // Detection stopped at a BLOCK; the fields listed in `partial` cover only what it reached
+  early_exit?: boolean;
+  partial?: string[];
 }
 
 export interface ChatResponse {
@@ -75,8 +78,150 @@ export const promptApi = {
     return response.data;
   },
   
+  // Streamed download of stored analyses (GET, so it can be used as a link target)
+  historyExportUrl: (params: { format: 'ndjson' | 'csv'; since?: number; until?: number; verdict?: string; gzip?: boolean }): string => {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== undefined) query.set(key, String(value));
+    });
+    return `${API_BASE_URL}/api/history/export?${query.toString()}`;
+  },
+
   healthCheck: async (): Promise<HealthResponse> => {
     const response = await api.get<HealthResponse>('/health');
     return response.data;
   },
 };
+
+// Server messages on /ws: the request id, an event name and the event's fields
+export interface SocketEvent {
+  id: string | number | null;
+  event: string;
+  [key: string]: any;
+}
+
+type PendingRequest = {
+  onEvent?: (event: SocketEvent) => void;
+  resolve: (event: SocketEvent) => void;
+  reject: (error: Error) => void;
+  terminal: (event: SocketEvent) => boolean;
+  // The server sent `accepted`: the request is running and must not be retried
+  accepted: boolean;
+};
+
+// A server `error` event for a request, passed on as-is
+export class SocketEventError extends Error {
+  constructor(public event: SocketEvent) {
+    super(typeof event.detail === 'string' ? event.detail : JSON.stringify(event.detail));
+  }
+}
+
+// The connection failed; `accepted` says whether the server had already taken the request
+export class SocketClosedError extends Error {
+  constructor(message: string, public accepted: boolean) {
+    super(message);
+  }
+}
+
+// Only a request the server never acknowledged is safe to repeat over HTTP
+const neverAccepted = (error: unknown) => error instanceof SocketClosedError && !error.accepted;
+
+// One persistent connection for analyze/chat requests, multiplexed by id.
+// Falls back to plain HTTP when a request fails before the server accepted it.
+export class PromptSocket {
+  private socket: WebSocket | null = null;
+  private opening: Promise<WebSocket> | null = null;
+  private pending = new Map<string, PendingRequest>();
+  private nextId = 1;
+
+  constructor(private url: string = API_BASE_URL.replace(/^http/, 'ws') + '/ws') {}
+
+  private connect(): Promise<WebSocket> {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) return Promise.resolve(this.socket);
+    if (this.opening) return this.opening;
+    this.opening = new Promise((resolve, reject) => {
+      const socket = new WebSocket(this.url);
+      socket.onopen = () => {
+        this.socket = socket;
+        this.opening = null;
+        resolve(socket);
+      };
+      socket.onerror = () => {
+        this.opening = null;
+        reject(new SocketClosedError('WebSocket connection failed', false));
+      };
+      socket.onclose = () => {
+        this.socket = null;
+        this.pending.forEach(p => p.reject(new SocketClosedError('WebSocket closed', p.accepted)));
+        this.pending.clear();
+      };
+      socket.onmessage = (message) => {
+        const event: SocketEvent = JSON.parse(message.data);
+        const request = this.pending.get(String(event.id));
+        if (!request) return;
+        if (event.event === 'accepted') {
+          request.accepted = true;
+          return;
+        }
+        request.onEvent?.(event);
+        if (event.event === 'error') {
+          this.pending.delete(String(event.id));
+          request.reject(new SocketEventError(event));
+        } else if (request.terminal(event)) {
+          this.pending.delete(String(event.id));
+          request.resolve(event);
+        }
+      };
+    });
+    return this.opening;
+  }
+
+  // Send one request; resolves with its final event, every event goes to onEvent
+  async request(type: string, body: object, terminal: (event: SocketEvent) => boolean, onEvent?: (event: SocketEvent) => void): Promise<SocketEvent> {
+    const socket = await this.connect();
+    const id = String(this.nextId++);
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { onEvent, resolve, reject, terminal, accepted: false });
+      try {
+        socket.send(JSON.stringify({ ...body, id, type }));
+      } catch {
+        this.pending.delete(id);
+        reject(new SocketClosedError('WebSocket send failed', false));
+      }
+    });
+  }
+
+  async analyze(request: AnalyzeRequest, onRewrite?: (suggestedRewrite: string) => void): Promise<AnalyzeResponse> {
+    try {
+      // A deferred rewrite is pushed on the same id after the result
+      const onEvent = (event: SocketEvent) => {
+        if (event.event === 'rewrite' && event.suggested_rewrite) onRewrite?.(event.suggested_rewrite);
+      };
+      let result: AnalyzeResponse | null = null;
+      await this.request('analyze', request, (event) => {
+        if (event.event === 'result') result = event as unknown as AnalyzeResponse;
+        return event.event === 'rewrite' || (event.event === 'result' && !event.rewrite_job);
+      }, onEvent);
+      return result!;
+    } catch (error) {
+      if (!neverAccepted(error)) throw error;
+      return promptApi.analyze(request);
+    }
+  }
+
+  async chat(request: ChatRequest): Promise<ChatResponse> {
+    try {
+      return (await this.request('chat', request, (event) => event.event === 'result')) as unknown as ChatResponse;
+    } catch (error) {
+      if (!neverAccepted(error)) throw error;
+      return promptApi.chat(request);
+    }
+  }
+
+  // Streamed chat: onEvent gets `analysis`, then `rewrite` or `chunk` events
+  streamChat(request: ChatRequest, onEvent: (event: SocketEvent) => void): Promise<SocketEvent> {
+    return this.request('chat_stream', request, (event) => event.event === 'done', onEvent);
+  }
+}
+
+export const promptSocket = new PromptSocket();